@@ -0,0 +1,249 @@
+import hashlib
+import logging
+import os
+import re
+import requests
+import shutil
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import NamedTemporaryFile
+from urllib.parse import urlsplit
+from pydeploy.http_session import HttpSession
+
+logging.basicConfig(
+    format="%(asctime)s,%(levelname)s,%(module)s,%(message)s",
+    level=logging.INFO,
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+class AptProxy(object):
+    """
+    Minimal caching HTTP proxy for apt, in the style of apt-cacher-ng, that runs on the deployment
+    server for the duration of a run so that each package is downloaded from upstream only once
+    for the whole fleet.
+
+    Package files are immutable, as their names include their version, so they are cached
+    indefinitely.  Everything else, such as the Release and Packages indexes, is passed through
+    to the upstream mirror.  Concurrent requests for the same uncached package wait for the first
+    one to complete and are then served from the cache.
+
+    Only plain http sources are proxied; apt connects directly to https sources.  So that the
+    proxy is not an open relay, only the apt repository paths, under dists/ or pool/, of the hosts
+    of the package sources allowed with allow_sources are proxied.  Once the total size of the
+    cached packages exceeds max_bytes, the least recently used ones are evicted.
+    """
+
+    CACHE_DIR_DEFAULT = os.path.join(os.path.expanduser("~"), ".pydeploy", "apt-cache")
+    CACHEABLE_SUFFIXES = (".deb", ".udeb")
+    CHUNK_SIZE = 1024 * 1024
+    MAX_BYTES_DEFAULT = 10 * 1024 * 1024 * 1024
+    PASS_THROUGH_REQUEST_HEADERS = ["If-Modified-Since", "If-None-Match", "Range"]
+    PASS_THROUGH_RESPONSE_HEADERS = [
+        "Content-Length",
+        "Content-Range",
+        "Content-Type",
+        "ETag",
+        "Last-Modified",
+    ]
+    PORT_DEFAULT = 3142
+    REPO_PATH_SEGMENTS = {"dists", "pool"}
+    SOURCE_HOST_PATTERN = re.compile(r"\bhttp://([^/\s\]\"']+)", re.IGNORECASE)
+    TIMEOUT_SEC = 60
+
+    def __init__(
+        self,
+        cache_dir: str = CACHE_DIR_DEFAULT,
+        bind_address: str = "127.0.0.1",
+        port: int = PORT_DEFAULT,
+        session: requests.Session = None,
+        max_bytes: int = MAX_BYTES_DEFAULT,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.session = (
+            session
+            if session is not None
+            else HttpSession.create(verify=True, timeout_sec=AptProxy.TIMEOUT_SEC)
+        )
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        self.evict_lock = threading.Lock()
+        self.thread = None
+
+        # The set of the hosts, with their port if any, of the allowed package sources.
+        self.allowed_hosts = set()
+        self.allowed_hosts_lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                proxy.handle_get(self)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self.server = ThreadingHTTPServer((bind_address, port), Handler)
+        self.server.daemon_threads = True
+
+    def allow_sources(self, sources: str) -> None:
+        """
+        Allows the hosts of all of the http urls in the package sources, the contents of apt
+        sources.list files in either format, to be proxied.
+        """
+        hosts = {h.lower() for h in AptProxy.SOURCE_HOST_PATTERN.findall(sources)}
+        with self.allowed_hosts_lock:
+            new_hosts = hosts - self.allowed_hosts
+            self.allowed_hosts |= hosts
+        if new_hosts:
+            logger.info(f"Allowed package source hosts; hosts={sorted(new_hosts)}")
+
+    def evict(self, keep_path: str = None) -> None:
+        """
+        Removes the least recently used packages, other than the one at keep_path, until the total
+        size of the cached packages is no larger than max_bytes.
+        """
+        with self.evict_lock:
+            packages = []
+            for dir_path, _, file_names in os.walk(self.cache_dir):
+                for file_name in file_names:
+                    if file_name.endswith(".part"):
+                        continue
+                    path = os.path.join(dir_path, file_name)
+                    stat = os.stat(path)
+                    packages.append((stat.st_mtime, stat.st_size, path))
+
+            total_bytes = sum(size for _, size, _ in packages)
+            for _, size, path in sorted(packages):
+                if total_bytes <= self.max_bytes:
+                    break
+                if path == keep_path:
+                    continue
+                logger.info(f"Evicting package; path={path}, bytes={size}")
+                os.remove(path)
+                total_bytes -= size
+
+    def get_cache_path(self, url: str) -> str:
+        # The file name keeps the package file name for legibility and is prefixed with the hash of
+        # the full url so that urls from different mirrors and paths never collide.
+        url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        file_name = os.path.basename(urlsplit(url).path)
+        return os.path.join(self.cache_dir, url_hash[:2], f"{url_hash}_{file_name}")
+
+    def get_lock(self, url: str) -> threading.Lock:
+        with self.locks_lock:
+            if url not in self.locks:
+                self.locks[url] = threading.Lock()
+            return self.locks[url]
+
+    def get_port(self) -> int:
+        return self.server.server_address[1]
+
+    def handle_get(self, handler: BaseHTTPRequestHandler) -> None:
+        # When used as a proxy the request path is the absolute url of the upstream resource.
+        url = handler.path
+        split_url = urlsplit(url)
+        if split_url.scheme != "http":
+            handler.send_error(400, "Only absolute http urls are supported")
+            return
+        if not self.is_allowed(split_url.netloc, split_url.path):
+            logger.warning(f"Refused request for a url that is not of a package source; url={url}")
+            handler.send_error(403, "Only the package repositories of the hosts are proxied")
+            return
+
+        try:
+            if split_url.path.endswith(AptProxy.CACHEABLE_SUFFIXES):
+                self.serve_cached(handler, url)
+            else:
+                self.serve_pass_through(handler, url)
+        except requests.RequestException as e:
+            logger.warning(f"Unable to fetch from upstream; url={url}, e={e}")
+            handler.send_error(502, "Unable to fetch from upstream")
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info(f"Client disconnected; url={url}")
+
+    def is_allowed(self, host: str, path: str) -> bool:
+        with self.allowed_hosts_lock:
+            if host.lower() not in self.allowed_hosts:
+                return False
+        return not AptProxy.REPO_PATH_SEGMENTS.isdisjoint(path.split("/"))
+
+    @staticmethod
+    def send_file(handler: BaseHTTPRequestHandler, f) -> None:
+        handler.send_response(200)
+        handler.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+        handler.send_header("Content-Type", "application/vnd.debian.binary-package")
+        handler.end_headers()
+        shutil.copyfileobj(f, handler.wfile, AptProxy.CHUNK_SIZE)
+
+    def serve_cached(self, handler: BaseHTTPRequestHandler, url: str) -> None:
+        cache_path = self.get_cache_path(url)
+        with self.get_lock(url):
+            # The package is opened while locked so that it can not be evicted before it is served.
+            try:
+                # The modification time of the package is the time at which it was last used.
+                os.utime(cache_path)
+                f = open(cache_path, "rb")
+            except FileNotFoundError:
+                logger.info(f"Caching package; url={url}")
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                with self.session.get(url, stream=True) as r:
+                    if r.status_code != 200:
+                        handler.send_error(r.status_code)
+                        return
+
+                    # Write to a temp file in the cache dir and only move it into place once it is
+                    # complete so that a failed download is never served.
+                    with NamedTemporaryFile(
+                        dir=os.path.dirname(cache_path), suffix=".part", delete=False
+                    ) as part:
+                        try:
+                            for chunk in r.iter_content(chunk_size=AptProxy.CHUNK_SIZE):
+                                part.write(chunk)
+                        except Exception:
+                            os.remove(part.name)
+                            raise
+                    os.replace(part.name, cache_path)
+                f = open(cache_path, "rb")
+                self.evict(keep_path=cache_path)
+        with f:
+            AptProxy.send_file(handler, f)
+
+    def serve_pass_through(self, handler: BaseHTTPRequestHandler, url: str) -> None:
+        headers = {
+            h: handler.headers[h]
+            for h in AptProxy.PASS_THROUGH_REQUEST_HEADERS
+            if handler.headers[h] is not None
+        }
+        with self.session.get(url, headers=headers, stream=True) as r:
+            handler.send_response(r.status_code)
+            for h in AptProxy.PASS_THROUGH_RESPONSE_HEADERS:
+                # The body is forwarded as decoded by requests, so its encoding is not forwarded
+                if h == "Content-Length" and r.headers.get("Content-Encoding"):
+                    continue
+                if h in r.headers:
+                    handler.send_header(h, r.headers[h])
+            handler.end_headers()
+            for chunk in r.iter_content(chunk_size=AptProxy.CHUNK_SIZE):
+                handler.wfile.write(chunk)
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info(
+            f"Apt proxy started; address={self.server.server_address[0]}, port={self.get_port()}, "
+            f"cache_dir={self.cache_dir}"
+        )
+
+    def stop(self) -> None:
+        if self.thread is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.thread = None
+        logger.info("Apt proxy stopped")
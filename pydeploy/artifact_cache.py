@@ -0,0 +1,179 @@
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import threading
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile
+from pydeploy.utils import HashAlgo
+
+logging.basicConfig(
+    format="%(asctime)s,%(levelname)s,%(module)s,%(message)s",
+    level=logging.INFO,
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+class ArtifactCache(object):
+    """
+    Persistent, content-addressable store of the artifacts downloaded by the deployment server, so
+    that an artifact is downloaded only once across runs.
+
+    Artifacts are looked up by the url from which they are downloaded along with their expected
+    checksum, so that the contents behind a url that changes, for example a "latest" url, are never
+    served in place of the expected ones.  They are stored under the sha256 of their contents, such
+    that the same contents downloaded from different urls are stored only once.
+
+    Downloads that are interrupted are kept as partial downloads, and resumed rather than restarted
+    by the next request for the same artifact.  An artifact is only stored once its checksum is
+    verified.
+
+    Concurrent requests for the same artifact, from threads or from other processes, are coalesced;
+    all but the first wait for it to be downloaded.  Once the total size of the stored artifacts
+    exceeds max_bytes, the least recently used ones are evicted.
+    """
+
+    CACHE_DIR_DEFAULT = os.path.join(os.path.expanduser("~"), ".pydeploy", "artifacts")
+    MAX_BYTES_DEFAULT = 10 * 1024 * 1024 * 1024
+
+    def __init__(self, cache_dir: str = CACHE_DIR_DEFAULT, max_bytes: int = MAX_BYTES_DEFAULT):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.keys_dir = os.path.join(cache_dir, "keys")
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.locks_dir = os.path.join(cache_dir, "locks")
+        self.partials_dir = os.path.join(cache_dir, "partials")
+        for dir in [self.keys_dir, self.objects_dir, self.locks_dir, self.partials_dir]:
+            os.makedirs(dir, exist_ok=True)
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def add(self, key: str, url: str, checksum: str, hash_algo: HashAlgo, download) -> str:
+        """
+        Downloads the artifact with the download function and stores it once its checksum is
+        verified.  Returns the path of the stored artifact.
+
+        The download function is passed the path of the file to which to download the artifact and
+        the list of HashAlgo for which it returns the dict of HashAlgo to hex digest.  The file is
+        left in place if the download raises, other than for a checksum mismatch, and is passed to
+        the download function again the next time that the artifact is added.
+        """
+        # The partial download is kept, under the key, if the download is interrupted so that it is
+        # resumed by the next request for the artifact.
+        partial_path = self.get_partial_path(key)
+        digests = download(partial_path, list({hash_algo, HashAlgo.SHA256SUM}))
+        if digests[hash_algo] != checksum.lower():
+            os.remove(partial_path)
+            raise Exception(
+                f"Downloaded artifact checksum mismatch; url={url}, checksum={checksum}, "
+                f"actual_checksum={digests[hash_algo]}, hash_algo={hash_algo}"
+            )
+        sha256 = digests[HashAlgo.SHA256SUM]
+        object_path = self.get_object_path(sha256)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.replace(partial_path, object_path)
+
+        with NamedTemporaryFile("w", dir=self.keys_dir, delete=False) as f:
+            f.write(sha256)
+        os.replace(f.name, self.get_key_path(key))
+        return object_path
+
+    def evict(self, keep_path: str = None) -> None:
+        """
+        Removes the least recently used artifacts, other than the one at keep_path, until the total
+        size of the stored artifacts is no larger than max_bytes.
+        """
+        objects = []
+        for dir_path, _, file_names in os.walk(self.objects_dir):
+            for file_name in file_names:
+                if file_name.endswith(".part"):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                stat = os.stat(path)
+                objects.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in objects)
+        for _, size, path in sorted(objects):
+            if total_bytes <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            logger.info(f"Evicting artifact; path={path}, bytes={size}")
+            os.remove(path)
+            total_bytes -= size
+
+    def fetch(
+        self,
+        url: str,
+        checksum: str,
+        hash_algo: HashAlgo,
+        target_local_path: str,
+        download,
+    ) -> dict[HashAlgo, str]:
+        """
+        Provides the artifact at target_local_path, downloading it with the download function, see
+        add, only if it is not already stored.  Returns the dict of HashAlgo to the hex digest of
+        the artifact for the hash_algo and sha256.
+        """
+        key = ArtifactCache.get_key(url, checksum)
+        with self.lock(key):
+            object_path = self.lookup(key)
+            if object_path is None:
+                logger.info(f"Artifact cache miss; url={url}")
+                object_path = self.add(key, url, checksum, hash_algo, download)
+            else:
+                logger.info(f"Artifact cache hit; url={url}, path={object_path}")
+
+            # The modification time of the artifact is the time at which it was last used.
+            os.utime(object_path)
+            if os.path.exists(target_local_path):
+                os.remove(target_local_path)
+            try:
+                os.link(object_path, target_local_path)
+            except OSError:
+                shutil.copyfile(object_path, target_local_path)
+        self.evict(keep_path=object_path)
+        return {hash_algo: checksum.lower(), HashAlgo.SHA256SUM: os.path.basename(object_path)}
+
+    @staticmethod
+    def get_key(url: str, checksum: str) -> str:
+        return hashlib.sha256(f"{url}\n{checksum}".encode("utf-8")).hexdigest()
+
+    def get_key_path(self, key: str) -> str:
+        return os.path.join(self.keys_dir, key)
+
+    def get_object_path(self, sha256: str) -> str:
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    def get_partial_path(self, key: str) -> str:
+        return os.path.join(self.partials_dir, key)
+
+    @contextmanager
+    def lock(self, key: str):
+        # The thread lock coalesces the requests within this process and the file lock those of
+        # other processes sharing the cache dir.
+        with self.locks_lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            thread_lock = self.locks[key]
+        with thread_lock:
+            with open(os.path.join(self.locks_dir, key), "w") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def lookup(self, key: str) -> str:
+        """
+        Returns the path of the stored artifact for the key, or None if it is not stored.
+        """
+        key_path = self.get_key_path(key)
+        if not os.path.exists(key_path):
+            return None
+        with open(key_path, "r") as f:
+            object_path = self.get_object_path(f.read().strip())
+        return object_path if os.path.exists(object_path) else None
@@ -1,8 +1,11 @@
 import copy
 import logging
 import os
+import requests
+import threading
 from fabric import Connection
 from pydeploy.enums import Distro
+from pydeploy.http_session import HttpSession
 from pydeploy.utils import Utils
 
 logging.basicConfig(level=logging.INFO)
@@ -18,6 +21,17 @@ class Configs(object):
         hosts_ssh_port: int,
         hosts_ssh_identity_file: str = None,
         requests_disable_warnings: bool = False,
+        state_db_path: str = None,
+        force: bool = False,
+        package_index_max_age_sec: int = 0,
+        apt_proxy: str = None,
+        offline_packages: bool = False,
+        unsafe_package_io: bool = False,
+        artifact_cache_max_mb: int = 0,
+        http_proxy: str = None,
+        http_timeout_sec: int = 30,
+        github_token: str = None,
+        version_index_max_age_sec: int = 86400,
     ) -> None:
         self.pydeploy_config_dir = pydeploy_config_dir
         self.config_file_path = config_file_path
@@ -26,8 +40,45 @@ class Configs(object):
         self.hosts_ssh_port = hosts_ssh_port
         self.hosts_ssh_identity_file = hosts_ssh_identity_file
         self.requests_disable_warnings = requests_disable_warnings
+        self.state_db_path = state_db_path
+        self.force = force
+        self.package_index_max_age_sec = package_index_max_age_sec
+        self.apt_proxy = apt_proxy
+        self.offline_packages = offline_packages
+        self.unsafe_package_io = unsafe_package_io
+        self.artifact_cache_max_mb = artifact_cache_max_mb
+        self.http_proxy = http_proxy
+        self.http_timeout_sec = http_timeout_sec
+        self.github_token = github_token
+        self.version_index_max_age_sec = version_index_max_age_sec
         self.connections = None
 
+        # The Plan that records the operations of the tasks instead of applying them, when run with
+        # --plan.
+        self.plan = None
+
+        # The ArtifactCache through which artifacts with a known checksum are downloaded, unless it
+        # is disabled with an artifact_cache_max_mb of 0.
+        self.artifact_cache = None
+
+        # The requests.Session shared by all of the outbound HTTP(S) requests of the run, created on
+        # first use by get_http_session.
+        self.http_session = None
+        self.http_session_lock = threading.Lock()
+
+        # The GitHubReleaseCache through which the GitHub release json documents are fetched.
+        self.github_release_cache = None
+
+        # The RepoKeyCache through which the signing keys of the package repos are fetched.
+        self.repo_key_cache = None
+
+        # The VersionIndex through which the versions of the tools are resolved from their version
+        # manifests.
+        self.version_index = None
+
+        # The Mirrors that order the mirrors of the artifacts that are available from more than one.
+        self.mirrors = None
+
         self.config_file_data = None
         self.distro = None
         self.distro_version = None
@@ -137,6 +188,16 @@ class Configs(object):
             )
         logging.info("Configs initialization complete")
 
+    def get_http_session(self) -> requests.Session:
+        with self.http_session_lock:
+            if self.http_session is None:
+                self.http_session = HttpSession.create(
+                    verify=self.is_request_verify(),
+                    timeout_sec=self.http_timeout_sec,
+                    proxy=self.http_proxy,
+                )
+            return self.http_session
+
     def is_request_warnings_disabled(self) -> bool:
         return self.requests_disable_warnings
 
@@ -195,6 +256,17 @@ class Configs(object):
             f"  hosts={self.hosts}\n"
             f"  hosts_connection_user={self.hosts_connection_user}\n"
             f"  requests_disable_warnings={self.requests_disable_warnings}\n"
+            f"  state_db_path={self.state_db_path}\n"
+            f"  force={self.force}\n"
+            f"  package_index_max_age_sec={self.package_index_max_age_sec}\n"
+            f"  apt_proxy={self.apt_proxy}\n"
+            f"  offline_packages={self.offline_packages}\n"
+            f"  unsafe_package_io={self.unsafe_package_io}\n"
+            f"  artifact_cache_max_mb={self.artifact_cache_max_mb}\n"
+            f"  http_proxy={self.http_proxy}\n"
+            f"  http_timeout_sec={self.http_timeout_sec}\n"
+            f"  github_token={'<redacted>' if self.github_token else None}\n"
+            f"  version_index_max_age_sec={self.version_index_max_age_sec}\n"
             f"  connections={self.connections}\n"
             f"  distro={self.distro}\n"
             f"  distro_version={self.distro_version}\n"
@@ -1,5 +1,4 @@
 import os
-import requests
 from fabric import Connection
 from invoke import Context
 from tempfile import TemporaryDirectory
@@ -43,32 +42,20 @@ WantedBy = default.target
 
         configs = ctx.distro.configs
         task_configs = ctx.distro.get_task_configs("install-drawio")
-        verify = ctx.distro.configs.is_request_verify()
         github_release_info = Utils.get_github_release_info(
+            configs=configs,
             url=task_configs["github_release_url"],
             artifact_regex=task_configs["artifact_regex"],
             hashes_regex=task_configs["hashes_regex"],
-            verify=verify,
         )
 
-        # Download the artifact and then validate the checksum
-        artifact_local_path, hashes_local_path = Utils.download_github_artifact_and_checksum(
-            configs=configs, github_release_info=github_release_info, temp_dir=temp_dir
-        )
-
-        hashes_line_pattern = f".*{github_release_info.artifact_filename}.*"
-        if not Utils.file_checksum_with_checksum_file(
-            file_path=artifact_local_path,
-            hashes_file_path=hashes_local_path,
-            hashes_file_pattern=hashes_line_pattern,
+        # Download the artifact, which is validated against the checksum in the hashes file
+        artifact_local_path, _ = Utils.download_github_artifact_and_checksum(
+            configs=configs,
+            github_release_info=github_release_info,
+            temp_dir=temp_dir,
             hashes_line_token=1,
-            hash_algo=HashAlgo.SHA256SUM,
-        ):
-            raise Exception(
-                f"checking sha256sum on file mismatch; "
-                f"artifact_local_path={artifact_local_path}, "
-                f"hashes_local_path={hashes_local_path}, "
-            )
+        )
 
         retval["artifact_local_path"] = artifact_local_path
         retval["artifact_filename"] = github_release_info.artifact_filename
@@ -98,44 +85,50 @@ WantedBy = default.target
         configs = ctx.distro.configs
         task_configs = ctx.distro.get_task_configs("install-minikube")
 
-        for architecture in architectures:
-            architecture_downloads = {}
-            for download in ["minikube", "kvm2_driver"]:
-                binary_file_name = Template(task_configs[download]["binary_template"]).substitute(
-                    architecture=architecture
-                )
-                sha256sum_file_name = Template(
-                    task_configs[download]["sha256sum_template"]
-                ).substitute(architecture=architecture)
-                binary_url = f"{task_configs['base_url']}/{binary_file_name}"
-                sha256sum_url = f"{task_configs['base_url']}/{sha256sum_file_name}"
-                binary_local_file_name = task_configs[download]["local_file_name"]
-                binary_local_file_path = os.path.join(temp_dir.name, binary_local_file_name)
-                Utils.download_file(
-                    configs=configs,
-                    url=binary_url,
-                    target_local_path=binary_local_file_path,
-                )
-                r = requests.get(url=sha256sum_url, verify=configs.is_request_verify())
-                if not r.ok:
-                    raise Exception(
-                        f"Unable to get sha256sum; sha256sum_url={sha256sum_url}, r={r}"
-                    )
-                sha256sum = r.text.strip()
-                if not Utils.file_checksum(
-                    file_path=binary_local_file_path,
-                    checksum=sha256sum,
-                    hash_algo=HashAlgo.SHA256SUM,
-                ):
-                    raise Exception(
-                        "Checksum for downloaded file did not match; "
-                        f"binary_local_file_path={binary_local_file_path}"
-                    )
-                architecture_downloads[download] = dict(
-                    binary_local_file_path=binary_local_file_path,
-                    binary_file_name=binary_local_file_name,
-                )
-            retval[architecture] = architecture_downloads
+        def get_download(architecture_download: tuple) -> dict:
+            architecture, download = architecture_download
+            binary_file_name = Template(task_configs[download]["binary_template"]).substitute(
+                architecture=architecture
+            )
+            sha256sum_file_name = Template(task_configs[download]["sha256sum_template"]).substitute(
+                architecture=architecture
+            )
+            binary_url = f"{task_configs['base_url']}/{binary_file_name}"
+            sha256sum_url = f"{task_configs['base_url']}/{sha256sum_file_name}"
+
+            # The local file name is the same for all of the architectures, so each architecture
+            # is downloaded to its own dir.
+            binary_local_file_name = task_configs[download]["local_file_name"]
+            binary_local_file_path = os.path.join(
+                temp_dir.name, architecture, binary_local_file_name
+            )
+            os.makedirs(os.path.dirname(binary_local_file_path), exist_ok=True)
+            r = configs.get_http_session().get(url=sha256sum_url)
+            if not r.ok:
+                raise Exception(f"Unable to get sha256sum; sha256sum_url={sha256sum_url}, r={r}")
+            sha256sum = r.text.strip()
+            Utils.download_file(
+                configs=configs,
+                url=binary_url,
+                target_local_path=binary_local_file_path,
+                checksum=sha256sum,
+                hash_algo=HashAlgo.SHA256SUM,
+            )
+            return dict(
+                binary_local_file_path=binary_local_file_path,
+                binary_file_name=binary_local_file_name,
+            )
+
+        # Both of the binaries of each of the architectures are fetched concurrently.
+        architecture_downloads = [
+            (architecture, download)
+            for architecture in sorted(architectures)
+            for download in ["minikube", "kvm2_driver"]
+        ]
+        for (architecture, download), downloaded in zip(
+            architecture_downloads, Utils.map_concurrently(get_download, architecture_downloads)
+        ):
+            retval.setdefault(architecture, {})[download] = downloaded
 
         if managed_temp_dir:
             temp_dir.cleanup()
@@ -1,8 +1,12 @@
+import hashlib
+import logging
 import os
+import re
 import requests
 from io import BytesIO, StringIO
 from tempfile import TemporaryDirectory
 from string import Template
+from urllib.parse import unquote
 from fabric import Connection
 from invoke.exceptions import Exit
 from invoke import Context
@@ -12,22 +16,58 @@ from pydeploy.utils import Utils, HashAlgo
 
 
 class Debian(Distribution):
+    APT_PROFILE_CONF_PATH = "/etc/apt/apt.conf.d/01pydeploy-profile"
+    APT_PROXY_CONF_PATH = "/etc/apt/apt.conf.d/01pydeploy-proxy"
+
+    # The timers that run apt in the background; apt-daily-upgrade.service runs unattended-upgrade.
+    # Their services are masked, but not stopped, so that a run in progress is not interrupted
+    # mid-transaction and is instead waited for.
+    APT_TIMERS = ["apt-daily.timer", "apt-daily-upgrade.timer"]
+    APT_TIMER_SERVICES = ["apt-daily.service", "apt-daily-upgrade.service"]
+
+    # Maps the keys of the package_manager_profile configs to apt options.  Keys that are not in
+    # this dict are used as apt options verbatim, for example "Acquire::http::Timeout".
+    APT_PROFILE_OPTIONS = {
+        "contents": "Acquire::IndexTargets::deb::Contents-deb::DefaultEnabled",
+        "install_recommends": "APT::Install-Recommends",
+        "install_suggests": "APT::Install-Suggests",
+        "languages": "Acquire::Languages",
+        "pipeline_depth": "Acquire::http::Pipeline-Depth",
+        "queue_mode": "Acquire::Queue-Mode",
+        "retries": "Acquire::Retries",
+    }
+
+    # Maps the hash names in the output of apt-get --print-uris to HashAlgo names
+    APT_HASH_ALGOS = {
+        "MD5Sum": "MD5SUM",
+        "SHA1": "SHA1SUM",
+        "SHA256": "SHA256SUM",
+        "SHA512": "SHA512SUM",
+    }
+
     def __init__(self, configs: Configs) -> None:
         super().__init__(configs)
 
-    def add_repo_impl(self, configs: Configs, conn: Connection, task_configs: dict) -> None:
-        self.install_package(conn, ["gpg"])
-        r = Utils.requests_retry(url=task_configs["key_url"], verify=configs.is_request_verify())
-        gpg_file_contents = r.content
+        # Dict of key url to the dearmored repo signing key, fetched, or revalidated in the
+        # configs.repo_key_cache, once per run.
+        self.repo_keys = {}
 
-        remote_gpg_temp_file_path = os.path.join("/var/tmp/", task_configs["key_file_name"])
-        remote_target_gpg_file_path = os.path.join(
-            "/etc/apt/trusted.gpg.d", task_configs["key_file_name"]
-        )
-        conn.put(local=BytesIO(gpg_file_contents), remote=remote_gpg_temp_file_path)
-        conn.run(f"rm -f {remote_target_gpg_file_path}")
-        conn.run(f"gpg --dearmor -o {remote_target_gpg_file_path} {remote_gpg_temp_file_path}")
-        conn.run(f"rm -f {remote_gpg_temp_file_path}")
+    def add_repo_impl(
+        self,
+        configs: Configs,
+        conn: Connection,
+        task_configs: dict,
+        repo_file_contents: str,
+        update_packages: bool = True,
+    ) -> None:
+        # If the package index is fresh before the repo is added only the new source needs to be
+        # updated afterwards, and nothing at all if the repo file is unchanged.
+        freshness = self.get_package_index_freshness(conn.host)
+        sources_hash = self.get_package_sources_hash(conn) if freshness is not None else None
+        if freshness is not None and not self.is_package_index_fresh(conn.host, sources_hash):
+            freshness = None
+
+        self.put_repo_key(configs, conn, task_configs)
 
         # Add the repo source.list.d file.
         remote_temp_file_path = os.path.join("/var/tmp/", task_configs["repo_file_name"])
@@ -35,35 +75,236 @@ class Debian(Distribution):
             "/etc/apt/sources.list.d", task_configs["repo_file_name"]
         )
 
-        conn.put(local=StringIO(task_configs["repo_file_contents"]), remote=remote_temp_file_path)
+        conn.put(local=StringIO(repo_file_contents), remote=remote_temp_file_path)
         conn.run(f"mv -f {remote_temp_file_path} {remote_target_file_path}")
         conn.run(f"chown root: {remote_target_file_path}")
-        conn.run("apt-get update")
+        if not update_packages or self.package_closure is not None:
+            return
+        if freshness is not None and self.get_package_sources_hash(conn) == sources_hash:
+            logging.info(
+                f"Repo file unchanged, package index is fresh; host={conn.host}, "
+                f"repo_file_name={task_configs['repo_file_name']}"
+            )
+            return
+        if freshness is None or not self.update_package_source(
+            conn, remote_target_file_path, freshness["package_index_updated_at"]
+        ):
+            self.update_packages(conn)
+
+    def compare_package_versions(self, version_a: str, version_b: str) -> int:
+        # The dpkg algorithm: the epochs are compared as integers, then the upstream versions and
+        # the revisions with compare_version_parts.
+        def split(version: str) -> tuple[int, str, str]:
+            epoch, _, rest = version.rpartition(":") if ":" in version else ("0", "", version)
+            upstream, _, revision = rest.rpartition("-") if "-" in rest else (rest, "", "0")
+            return int(epoch or 0), upstream, revision
+
+        epoch_a, upstream_a, revision_a = split(version_a)
+        epoch_b, upstream_b, revision_b = split(version_b)
+        if epoch_a != epoch_b:
+            return epoch_a - epoch_b
+        return Debian.compare_version_parts(upstream_a, upstream_b) or Debian.compare_version_parts(
+            revision_a, revision_b
+        )
+
+    @staticmethod
+    def compare_version_parts(a: str, b: str) -> int:
+        """
+        Compares an upstream version or a revision, alternating between the leading non-digits,
+        in which a tilde sorts before anything, even the end of the part, and letters sort before
+        the other characters, and the leading digits, which are compared as integers.
+        """
+
+        def order(c: str) -> int:
+            if c == "~":
+                return -1
+            if c.isalpha():
+                return ord(c)
+            return ord(c) + 256
+
+        i = j = 0
+        while i < len(a) or j < len(b):
+            while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+                ac = order(a[i]) if i < len(a) and not a[i].isdigit() else 0
+                bc = order(b[j]) if j < len(b) and not b[j].isdigit() else 0
+                if ac != bc:
+                    return ac - bc
+                i += 1
+                j += 1
+            digits_i = i
+            while i < len(a) and a[i].isdigit():
+                i += 1
+            digits_j = j
+            while j < len(b) and b[j].isdigit():
+                j += 1
+            diff = int(a[digits_i:i] or 0) - int(b[digits_j:j] or 0)
+            if diff:
+                return diff
+        return 0
 
     def get_architecture(self, conn: Connection) -> str:
-        r = conn.run("dpkg --print-architecture")
+        r = conn.run(self.get_architecture_cmd())
         if r.failed:
             raise Exit("Unable go get architecture")
         return r.stdout.strip()
 
+    def get_architecture_cmd(self) -> str:
+        return "dpkg --print-architecture"
+
     def get_install_local_packages_cmd(self, packages: str) -> str:
         return self.get_install_packages_cmd(packages)
 
     def get_install_packages_cmd(self, packages: str) -> str:
         return f"apt-get install -y {packages}"
 
+    def get_installed_packages_cmd(self, packages: str = None) -> str:
+        cmd = "dpkg-query -W -f='${Package}\\t${db:Status-Abbrev}\\t${Version}\\n'"
+        return f"{cmd} {packages}" if packages else cmd
+
+    def get_package_sources_cmd(self) -> str:
+        return "cat /etc/apt/sources.list /etc/apt/sources.list.d/* 2>/dev/null"
+
+    def get_package_sources_hash_cmd(self) -> str:
+        return f"{self.get_package_sources_cmd()} | sha256sum | cut -d ' ' -f 1"
+
+    def get_package_uris_cmd(self, packages: str) -> str:
+        # An empty dpkg status file makes apt resolve the closure as if nothing was installed.
+        return f"apt-get install -qq --print-uris -o Dir::State::status=/dev/null {packages}"
+
+    def get_package_lock_holders_cmd(self) -> str:
+        # Process names are truncated to 15 characters
+        return "pgrep -a -x 'apt|apt-get|aptitude|dpkg|unattended-upgr|apt.systemd.dai'"
+
+    def get_package_spec(self, package: str, version: str = None) -> str:
+        return f"{package}={version}" if version is not None else package
+
     def get_release(self, conn: Connection) -> None:
-        r = conn.run("lsb_release -cs")
+        r = conn.run(self.get_release_cmd())
         if r.failed:
             raise Exit("Unable get release")
         return r.stdout.strip()
 
+    def get_release_cmd(self) -> str:
+        return "lsb_release -cs"
+
     def get_remove_packages_cmd(self, packages: str) -> str:
         return f"apt-get remove -y --purge {packages}"
 
+    def get_repo_key(self, configs: Configs, key_url: str) -> bytes:
+        if key_url not in self.repo_keys and configs.repo_key_cache is not None:
+            self.repo_keys[key_url] = configs.repo_key_cache.get_key(
+                configs.get_http_session(), key_url
+            )
+        elif key_url not in self.repo_keys:
+            r = Utils.requests_retry(configs=configs, url=key_url)
+            self.repo_keys[key_url] = Utils.dearmor_pgp_key(r.content)
+        return self.repo_keys[key_url]
+
+    def get_update_package_source_cmd(self, source_file_path: str) -> str:
+        # Limit apt to the single source list file and do not delete the lists of the other sources
+        return (
+            f"apt-get update -o Dir::Etc::sourcelist={source_file_path} "
+            "-o Dir::Etc::sourceparts=- -o APT::Get::List-Cleanup=0"
+        )
+
+    def get_unsafe_io_packages_cmd(self, packages_cmd: str) -> str:
+        # eatmydata, when installed, disables every sync of the transaction, including those of
+        # the maintainer scripts; otherwise dpkg only skips its own per-file syncs.
+        return f"$(command -v eatmydata) {packages_cmd} -o Dpkg::Options::=--force-unsafe-io"
+
     def get_update_packages_cmd(self) -> str:
         return "apt-get update"
 
+    def remove_package_manager_profile(self, conn: Connection) -> None:
+        conn.run(f"rm -f {Debian.APT_PROFILE_CONF_PATH}")
+
+    def remove_package_proxy(self, conn: Connection) -> None:
+        conn.run(f"rm -f {Debian.APT_PROXY_CONF_PATH}")
+
+    def pause_package_timers(self, conn: Connection, paused_timers: list[str]) -> None:
+        r = conn.run(f"systemctl is-active {' '.join(Debian.APT_TIMERS)}", warn=True, hide=True)
+        states = r.stdout.split()
+        timers = [t for t, s in zip(Debian.APT_TIMERS, states) if s == "active"]
+        if not timers:
+            return
+
+        for timer in timers:
+            conn.run(f"systemctl mask --runtime --now {timer}")
+            paused_timers.append(timer)
+        conn.run(f"systemctl mask --runtime {' '.join(Debian.APT_TIMER_SERVICES)}")
+        logging.info(f"Paused package timers; host={conn.host}, timers={timers}")
+
+    def put_repo_key(self, configs: Configs, conn: Connection, task_configs: dict) -> None:
+        """
+        Pushes the dearmored signing key of the repo to the host, unless the host already has an
+        identical copy of it.
+        """
+        key_contents = self.get_repo_key(configs, task_configs["key_url"])
+        key_hash = hashlib.sha256(key_contents).hexdigest()
+        remote_target_gpg_file_path = os.path.join(
+            "/etc/apt/trusted.gpg.d", task_configs["key_file_name"]
+        )
+        r = conn.run(f"sha256sum {remote_target_gpg_file_path}", warn=True, hide=True)
+        if not r.failed and r.stdout.split(" ", 1)[0] == key_hash:
+            logging.info(f"Repo key unchanged, skipping; host={conn.host}, key_hash={key_hash}")
+            return
+
+        remote_gpg_temp_file_path = os.path.join("/var/tmp/", task_configs["key_file_name"])
+        conn.put(local=BytesIO(key_contents), remote=remote_gpg_temp_file_path)
+        conn.run(f"chmod 644 {remote_gpg_temp_file_path}")
+        conn.run(f"chown root: {remote_gpg_temp_file_path}")
+        conn.run(f"mv -f {remote_gpg_temp_file_path} {remote_target_gpg_file_path}")
+
+    def resume_package_timers(self, conn: Connection, timers: list[str]) -> None:
+        if not timers:
+            return
+        conn.run(f"systemctl unmask --runtime {' '.join(timers + Debian.APT_TIMER_SERVICES)}")
+        conn.run(f"systemctl start {' '.join(timers)}")
+        logging.info(f"Resumed package timers; host={conn.host}, timers={timers}")
+
+    @staticmethod
+    def render_apt_profile(profile: dict) -> str:
+        lines = []
+        for key, value in profile.items():
+            if type(value) is bool:
+                value = str(value).lower()
+            lines.append(f'{Debian.APT_PROFILE_OPTIONS.get(key, key)} "{value}";\n')
+        return "".join(lines)
+
+    def set_package_manager_profile(self, conn: Connection, profile: dict) -> None:
+        conn.put(
+            local=StringIO(Debian.render_apt_profile(profile)),
+            remote=Debian.APT_PROFILE_CONF_PATH,
+        )
+        conn.run(f"chown root: {Debian.APT_PROFILE_CONF_PATH}")
+
+    def set_package_proxy(self, conn: Connection, proxy_url: str) -> None:
+        conn.put(
+            local=StringIO(f'Acquire::http::Proxy "{proxy_url}";\n'),
+            remote=Debian.APT_PROXY_CONF_PATH,
+        )
+        conn.run(f"chown root: {Debian.APT_PROXY_CONF_PATH}")
+
+    def update_package_source(
+        self, conn: Connection, source_file_path: str, updated_at: float
+    ) -> bool:
+        """
+        Updates the package index for only the provided source list file.  The package index is
+        then only as fresh as it was before the source was added, so updated_at is retained.
+        Returns False if the update failed, in which case a full update is required.
+        """
+        r = conn.run(self.get_update_package_source_cmd(source_file_path), warn=True)
+        if r.failed:
+            logging.warning(
+                "Unable to update single package source, falling back to a full update; "
+                f"host={conn.host}, source_file_path={source_file_path}"
+            )
+            return False
+        self.save_package_index_freshness(
+            conn.host, updated_at, self.get_package_sources_hash(conn)
+        )
+        return True
+
     def install_cert(
         self,
         ctx: Context,
@@ -82,6 +323,45 @@ class Debian(Distribution):
             cert_validation_string=cert_validation_string,
         )
 
+    def parse_package_uris(self, cmd_stdout: str) -> list[dict]:
+        retval = []
+        for line in cmd_stdout.splitlines():
+            # 'http://deb.debian.org/debian/pool/main/g/gimp/gimp_2.10.34-1_amd64.deb' \
+            #   gimp_2.10.34-1_amd64.deb 5186016 SHA256:8a6f...
+            result = re.match(r"^'(\S+)' (\S+\.deb) (\d+) (\w+):(\w+)$", line.strip())
+            if not result:
+                continue
+            url, file_name, size, hash_name, checksum = result.groups()
+            package, version, _ = file_name.removesuffix(".deb").split("_")
+            retval.append(
+                dict(
+                    url=url,
+                    file_name=file_name,
+                    size=int(size),
+                    hash_algo=Debian.APT_HASH_ALGOS.get(hash_name, hash_name.upper()),
+                    checksum=checksum,
+                    package=package,
+                    version=unquote(version),
+                )
+            )
+        return retval
+
+    def parse_package_spec(self, package_spec: str) -> tuple[str, str]:
+        package, _, version = package_spec.partition("=")
+        return package, version if version else None
+
+    def parse_installed_packages(self, cmd_stdout: str) -> dict[str, str]:
+        retval = {}
+        for line in cmd_stdout.splitlines():
+            tokens = line.split("\t")
+            if len(tokens) != 3:
+                continue
+            package, status, version = tokens
+            # The db:Status-Abbrev for a package that is installed and configured is "ii "
+            if status.startswith("ii"):
+                retval[package] = version
+        return retval
+
     def verify_package(
         self,
         ctx: Context,
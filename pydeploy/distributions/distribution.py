@@ -1,23 +1,85 @@
 import tempfile
 import logging
+import threading
+import time
 from abc import ABC, abstractmethod
 from string import Template
 from fabric import Connection
 from invoke import Context
+from invoke.exceptions import Exit
 from tempfile import TemporaryDirectory
 from pydeploy.configs import Configs
 from pydeploy.enums import PackageCommand
+from pydeploy.host_classes import HostClasses
+from pydeploy.plan import PlanConnection
+from pydeploy.state import StateDb
+from pydeploy.utils import Utils
 
 
 class Distribution(ABC):
+    # Increment the VERSION in a concrete distribution class whenever a change to it alters the
+    # result of applying a task, so that hosts are no longer considered up to date.
+    VERSION = 1
+
     GNUPG_CONF_DIR = "/etc/gnupg"
     GNUPG_CONF_FILE_PATH = f"{GNUPG_CONF_DIR}/gpg.conf"
     GNUPG_CONF_ALLOW_WEAK_DIGEST_ALGO = "allow-weak-digest-algos"
 
+    # Bounds of the backoff with which wait_for_package_lock polls the host.
+    PACKAGE_LOCK_POLL_MAX_SEC = 30
+    PACKAGE_LOCK_TIMEOUT_SEC = 900
+
+    # The number of hosts whose package managers are prepared, or restored, concurrently.
+    PACKAGE_MANAGER_MAX_WORKERS = 32
+
     def __init__(self, configs: Configs) -> None:
         super().__init__()
         self.configs = configs
 
+        # The StateDb, set by Tasks.load_configs, in which the package index freshness of each host
+        # is persisted across runs.
+        self.state = None
+
+        # Dict of host to a dict with the time at which the package index of the host was last
+        # updated and the hash of the package sources at that time.
+        self.package_index_freshness = {}
+
+        # Dict of host to the snapshot of the packages installed on the host; a dict of package
+        # name to version, which is None for packages installed during the run without a pin.
+        self.installed_packages = {}
+
+        # The PackageClosure, set by Tasks.load_configs when run with --offline-packages, through
+        # which packages are installed instead of from the package repos.
+        self.package_closure = None
+
+        # Set by Tasks.load_configs when run with --unsafe-package-io, in which case all of the
+        # package commands of the run are applied without syncing each file to disk.
+        self.unsafe_package_io = False
+
+        # The equivalence classes of the hosts, through which the artifacts that depend only on the
+        # release and the architecture of a host are shared with the other hosts of its class.
+        self.host_classes = HostClasses(self)
+
+        # Set by Tasks.load_configs, unless run with --plan, in which case the package manager of
+        # each host is prepared by prepare_package_manager before the first package command of the
+        # run on the host.
+        self.prepare_package_managers = False
+
+        # The package_manager_profile from the configs, set by Tasks.load_configs, with which
+        # prepare_package_manager configures the package manager of each host.
+        self.package_manager_profile = None
+
+        # Dict of host to the dict with the conn, the paused timers and whether the profile was
+        # set of each host whose package manager was prepared in this run, which
+        # restore_package_managers reverts.
+        self.prepared_package_managers = {}
+        self.package_manager_locks = {}
+        self.package_manager_locks_lock = threading.Lock()
+
+        # The AptProxy, set by Tasks.start_apt_proxy when run with --apt-proxy, to which the
+        # sources of each repo added by add_repo are allowed.
+        self.package_proxy = None
+
     def add_gpg_config(self, conn: Connection, config: str) -> bool:
         # Check to see if there is already a gnugp dir
         pre_existing_dir = self.directory_exists(conn, Distribution.GNUPG_CONF_DIR)
@@ -38,24 +100,43 @@ class Distribution(ABC):
             # Just remove the config we added
             conn.run(f"sed -i '/{config}/d' {Distribution.GNUPG_CONF_FILE_PATH}")
 
-    def add_repo(self, configs: Configs, conn: Connection, task: str) -> None:
+    def add_repo(
+        self, configs: Configs, conn: Connection, task: str, update_packages: bool = True
+    ) -> None:
+        """
+        Adds the package repo defined in the task configs.  The package index is updated unless
+        update_packages is False, in which case the change to the package sources causes the index
+        to be updated before the next install.
+        """
         task_configs = self.configs.get_task_configs(task)
+        self.prepare_package_manager(conn)
 
-        # Determine the architecture and the release and expand the repo file contents and then
-        # add the expanded value to the cfg dict.
-        repo_file_dict = dict(
-            architecture=self.get_architecture(conn),
-            release=self.get_release(conn),
-        )
-        repo_file_contents = Template(task_configs["repo_file_template"]).safe_substitute(
-            repo_file_dict
+        # Determine the architecture and the release and expand the repo file contents, once per
+        # host class.  The expanded value is not added to the task configs, which are part of the
+        # inputs of the task, so that they are the same before and after the repo is added.
+        repo_file_contents = self.host_classes.get_artifact(
+            conn,
+            f"repo_file_contents:{task}",
+            lambda facts: Distribution.render_repo_file(
+                task_configs=task_configs,
+                architecture=facts["architecture"],
+                release=facts["release"],
+            ),
         )
-        task_configs["repo_file_contents"] = repo_file_contents
 
-        self.add_repo_impl(configs, conn, task_configs)
+        if self.package_proxy is not None:
+            self.package_proxy.allow_sources(repo_file_contents)
+        self.add_repo_impl(configs, conn, task_configs, repo_file_contents, update_packages)
 
     @abstractmethod
-    def add_repo_impl(self, configs: Configs, conn: Connection, task_configs: dict) -> None:
+    def add_repo_impl(
+        self,
+        configs: Configs,
+        conn: Connection,
+        task_configs: dict,
+        repo_file_contents: str,
+        update_packages: bool = True,
+    ) -> None:
         pass
 
     def add_user_to_group(self, conn: Connection, user: str, groups) -> None:
@@ -78,6 +159,7 @@ class Distribution(ABC):
         package_command: PackageCommand,
         packages,
         local_packages: bool = False,
+        unsafe_io: bool = False,
     ) -> None:
         if type(packages) != list:
             packages = [packages]
@@ -93,11 +175,35 @@ class Distribution(ABC):
         if package_command == PackageCommand.REMOVE:
             cmd = self.get_remove_packages_cmd(packages=packages_str)
 
-        conn.run(self.get_update_packages_cmd())
+        # Trades crash safety for speed: the package manager does not sync each file that it
+        # writes, and the whole transaction is instead synced to disk once it completes.  A crash
+        # of the host during the transaction can leave corrupt files behind.
+        unsafe_io = unsafe_io or self.unsafe_package_io
+        if unsafe_io:
+            cmd = self.get_unsafe_io_packages_cmd(cmd)
+
+        if isinstance(conn, PlanConnection):
+            conn.add_packages(package_command, packages)
+
+        self.prepare_package_manager(conn)
+
+        # The package closure provides all of the package files so the index is never updated.
+        if self.package_closure is None:
+            self.update_packages(conn)
         r = conn.run(cmd)
+        if unsafe_io:
+            conn.run("sync")
         if not r.failed:
             logging.info(f"Success; package_command={package_command.name}, packages={packages}")
 
+    @abstractmethod
+    def compare_package_versions(self, version_a: str, version_b: str) -> int:
+        """
+        Returns a negative int, 0, or a positive int if version_a of a package is respectively
+        older than, the same as, or newer than version_b, according to the package manager.
+        """
+        pass
+
     def directory_exists(self, conn: Connection, path: str) -> bool:
         r = conn.run(f"test -d {path}", warn=True)
         return r.return_code == 0
@@ -110,6 +216,10 @@ class Distribution(ABC):
     def get_architecture(self, conn: Connection) -> str:
         pass
 
+    @abstractmethod
+    def get_architecture_cmd(self) -> str:
+        pass
+
     @abstractmethod
     def get_install_packages_cmd(self, packages: str) -> str:
         pass
@@ -118,21 +228,178 @@ class Distribution(ABC):
     def get_install_local_packages_cmd(self, packages: str) -> str:
         pass
 
+    def get_installed_packages(self, conn: Connection) -> dict[str, str]:
+        """
+        Returns the snapshot of the packages installed on the host, which is taken with a single
+        command the first time that it is required in the run and kept up to date thereafter.
+        """
+        if conn.host not in self.installed_packages:
+            r = conn.run(self.get_installed_packages_cmd(), warn=True, hide=True)
+            self.installed_packages[conn.host] = (
+                {} if r.failed else self.parse_installed_packages(r.stdout)
+            )
+        return self.installed_packages[conn.host]
+
+    @abstractmethod
+    def get_installed_packages_cmd(self, packages: str = None) -> str:
+        """
+        Returns the command that lists the installed packages, limited to the provided
+        space-separated packages, whose output is parsed by parse_installed_packages.
+        """
+        pass
+
+    @abstractmethod
+    def get_package_lock_holders_cmd(self) -> str:
+        """
+        Returns the command that lists the processes that hold, or are about to take, the lock of
+        the package manager and exits with a non-zero status if there are none.
+        """
+        pass
+
+    @abstractmethod
+    def get_package_spec(self, package: str, version: str = None) -> str:
+        """
+        Returns the package argument for the install command that pins the package to the
+        version, if provided.
+        """
+        pass
+
     @abstractmethod
     def get_release(self, conn: Connection) -> None:
         pass
 
+    @abstractmethod
+    def get_release_cmd(self) -> str:
+        pass
+
     @abstractmethod
     def get_remove_packages_cmd(self, packages: str) -> str:
         pass
 
+    @abstractmethod
+    def get_unsafe_io_packages_cmd(self, packages_cmd: str) -> str:
+        """
+        Returns the packages_cmd modified so that the package manager does not sync the files that
+        it writes to disk.
+        """
+        pass
+
+    def get_package_index_freshness(self, host: str) -> dict:
+        """
+        Returns the dict with the package_index_updated_at time and package_sources_hash of the
+        last update of the package index of the host in this run or, if there was none and it is
+        within package_index_max_age_sec, in a previous run; else None.
+        """
+        freshness = self.package_index_freshness.get(host)
+        max_age_sec = self.configs.package_index_max_age_sec
+        if freshness is None and max_age_sec > 0 and self.state is not None:
+            facts = self.state.get_host_facts(host)
+            if "package_index_updated_at" in facts:
+                updated_at = float(facts["package_index_updated_at"])
+                if time.time() - updated_at <= max_age_sec:
+                    freshness = dict(
+                        package_index_updated_at=updated_at,
+                        package_sources_hash=facts.get("package_sources_hash"),
+                    )
+        return freshness
+
+    def get_pending_packages(self, conn: Connection, packages, versions: dict = None) -> dict:
+        """
+        Returns the dict of package name to pinned version, or None, of the packages that are not
+        installed on the host, see install_package.
+        """
+        if type(packages) != list:
+            packages = [packages]
+        versions = versions or {}
+
+        installed_packages = self.get_installed_packages(conn)
+        retval = {}
+        for package_spec in packages:
+            package, version = self.parse_package_spec(package_spec)
+            version = versions.get(package, version)
+            if package in installed_packages and (
+                version is None or installed_packages[package] == str(version)
+            ):
+                continue
+            retval[package] = version
+        return retval
+
+    @abstractmethod
+    def get_package_uris_cmd(self, packages: str) -> str:
+        """
+        Returns the command that outputs the urls of the package files of the full dependency
+        closure of the packages, as if no packages were installed, which is parsed by
+        parse_package_uris.
+        """
+        pass
+
+    def get_package_manager_lock(self, host: str) -> threading.Lock:
+        with self.package_manager_locks_lock:
+            if host not in self.package_manager_locks:
+                self.package_manager_locks[host] = threading.Lock()
+            return self.package_manager_locks[host]
+
+    def get_package_sources(self, conn: Connection) -> str:
+        r = conn.run(self.get_package_sources_cmd(), hide=True)
+        return r.stdout
+
+    @abstractmethod
+    def get_package_sources_cmd(self) -> str:
+        """
+        Returns the command that outputs the contents of all of the package sources configured on
+        the host.
+        """
+        pass
+
+    def get_package_sources_hash(self, conn: Connection) -> str:
+        r = conn.run(self.get_package_sources_hash_cmd(), hide=True)
+        return r.stdout.strip()
+
+    @abstractmethod
+    def get_package_sources_hash_cmd(self) -> str:
+        """
+        Returns the command that outputs a hash of the contents of all of the package sources
+        configured on the host.
+        """
+        pass
+
     def get_task_configs(self, task: str) -> dict:
         return self.configs.get_task_configs(task)
 
+    def get_task_input_hash(self, task: str, inputs: dict = None) -> str:
+        """
+        Returns the hash of the effective inputs of a task: the merged task configs, the task
+        arguments and artifact versions provided in the inputs dict, and the distro class version.
+        """
+        return StateDb.config_hash(
+            dict(
+                task_configs=self.configs.configs.get(task),
+                inputs=inputs,
+                distro=self.get_version(),
+            )
+        )
+
+    def get_version(self) -> str:
+        return f"{type(self).__name__}-{self.VERSION}-{self.configs.distro_version}"
+
     @abstractmethod
     def get_update_packages_cmd(self) -> str:
         pass
 
+    def update_packages(self, conn: Connection) -> None:
+        """
+        Updates the package index of the host, unless it is still fresh and none of the package
+        sources have changed since it was last updated.
+        """
+        self.prepare_package_manager(conn)
+        sources_hash = self.get_package_sources_hash(conn)
+        if self.is_package_index_fresh(conn.host, sources_hash):
+            logging.info(f"Package index is fresh, skipping update; host={conn.host}")
+            return
+
+        conn.run(self.get_update_packages_cmd())
+        self.save_package_index_freshness(conn.host, time.time(), sources_hash)
+
     @abstractmethod
     def install_cert(
         self,
@@ -145,21 +412,57 @@ class Distribution(ABC):
     ) -> bool:
         pass
 
-    def install_local_package(self, conn: Connection, packages_paths: list[str]) -> None:
+    def install_local_package(
+        self, conn: Connection, packages_paths: list[str], unsafe_io: bool = False
+    ) -> None:
         self._apply_packages_command(
             conn=conn,
             package_command=PackageCommand.INSTALL,
             packages=packages_paths,
             local_packages=True,
+            unsafe_io=unsafe_io,
         )
 
-    def install_package(self, conn: Connection, packages) -> None:
+    def install_package(
+        self, conn: Connection, packages, versions: dict = None, unsafe_io: bool = False
+    ) -> None:
+        """
+        Installs the packages that are not already installed on the host.  A package can be pinned
+        to a version either in its spec, see get_package_spec, or with the optional dict of package
+        name to version, in which case it is installed unless that exact version is installed.
+
+        With unsafe_io, or when the whole run is with --unsafe-package-io, the package manager does
+        not sync each file that it writes; see _apply_packages_command.
+        """
+        pending_packages = self.get_pending_packages(conn, packages, versions)
+        if not pending_packages:
+            logging.info(f"Packages already installed, skipping; host={conn.host}")
+            return
+
+        package_specs = [self.get_package_spec(p, v) for p, v in pending_packages.items()]
+        if self.package_closure is not None:
+            self.package_closure.install(conn, package_specs, unsafe_io)
+            return
+
         self._apply_packages_command(
             conn=conn,
             package_command=PackageCommand.INSTALL,
-            packages=packages,
+            packages=package_specs,
             local_packages=False,
+            unsafe_io=unsafe_io,
         )
+        self.get_installed_packages(conn).update(
+            {p: str(v) if v is not None else None for p, v in pending_packages.items()}
+        )
+
+    def is_package_index_fresh(self, host: str, sources_hash: str) -> bool:
+        """
+        Returns True if the package index of the host was updated with the same package sources
+        earlier in this run or, when package_index_max_age_sec is greater than 0, within the last
+        package_index_max_age_sec seconds according to the state db.
+        """
+        freshness = self.get_package_index_freshness(host)
+        return freshness is not None and freshness["package_sources_hash"] == sources_hash
 
     def is_cert_in_cert_bundle(
         self, conn: Connection, ca_certs_bundle_path: str, cert_validation_string: str
@@ -183,12 +486,173 @@ class Distribution(ABC):
             )
             return False
 
+    @abstractmethod
+    def pause_package_timers(self, conn: Connection, paused_timers: list[str]) -> None:
+        """
+        Stops and masks, until resume_package_timers is called or the host reboots, the timers of
+        the host that run the package manager in the background.  Each of the timers that was
+        active, which are the ones to restart, is appended to paused_timers as soon as it is
+        masked, so that the timers masked before a failure are still resumed.
+        """
+        pass
+
+    @abstractmethod
+    def parse_package_uris(self, cmd_stdout: str) -> list[dict]:
+        """
+        Parses the output of get_package_uris_cmd into a list of dicts, one per package file, with
+        the url, file_name, size, hash_algo (the name of a HashAlgo), checksum, package and
+        version keys.
+        """
+        pass
+
+    @abstractmethod
+    def parse_package_spec(self, package_spec: str) -> tuple[str, str]:
+        """
+        Parses a package spec into a tuple of the package name and the pinned version, or None.
+        """
+        pass
+
+    @abstractmethod
+    def parse_installed_packages(self, cmd_stdout: str) -> dict[str, str]:
+        """
+        Parses the output of the get_installed_packages_cmd into a dict of package name to the
+        installed version.  Packages that are known but not installed are omitted.
+        """
+        pass
+
+    @abstractmethod
+    def set_package_manager_profile(self, conn: Connection, profile: dict) -> None:
+        """
+        Configures the package manager of the host with the profile, the package_manager_profile
+        dict from the configs, until remove_package_manager_profile is called.
+        """
+        pass
+
+    @abstractmethod
+    def set_package_proxy(self, conn: Connection, proxy_url: str) -> None:
+        """
+        Configures the package manager of the host to download packages through the http proxy
+        until remove_package_proxy is called.
+        """
+        pass
+
+    def save_package_index_freshness(self, host: str, updated_at: float, sources_hash: str) -> None:
+        freshness = dict(package_index_updated_at=updated_at, package_sources_hash=sources_hash)
+        self.package_index_freshness[host] = freshness
+        if self.state is not None:
+            self.state.save_host_facts(host, freshness)
+
+    @abstractmethod
+    def resume_package_timers(self, conn: Connection, timers: list[str]) -> None:
+        pass
+
+    @abstractmethod
+    def remove_package_manager_profile(self, conn: Connection) -> None:
+        pass
+
+    @abstractmethod
+    def remove_package_proxy(self, conn: Connection) -> None:
+        pass
+
+    def prepare_package_manager(self, conn: Connection) -> None:
+        """
+        Pauses the timers that run the package manager of the host in the background and waits
+        for any package manager process already running to complete, so that the tasks do not
+        contend for the package manager lock, and configures the package manager with the
+        package_manager_profile, if any.  This is done once per host in the run, other than the
+        wait for the lock which is retried until it succeeds, and only if
+        prepare_package_managers is set, so that the hosts to which no packages are applied, for
+        example by a read-only task, are left untouched.  restore_package_managers reverts it.
+        """
+        if not self.prepare_package_managers or isinstance(conn, PlanConnection):
+            return
+        with self.get_package_manager_lock(conn.host):
+            prepared = self.prepared_package_managers.get(conn.host)
+            if prepared is None:
+                prepared = dict(conn=conn, timers=[], profiled=False, lock_released=False)
+                self.prepared_package_managers[conn.host] = prepared
+                try:
+                    self.pause_package_timers(conn, prepared["timers"])
+                except Exception as e:
+                    logging.warning(f"Unable to pause package timers; host={conn.host}, e={e}")
+                if self.package_manager_profile:
+                    try:
+                        self.set_package_manager_profile(conn, self.package_manager_profile)
+                        prepared["profiled"] = True
+                    except Exception as e:
+                        logging.warning(
+                            f"Unable to configure package manager profile; host={conn.host}, e={e}"
+                        )
+
+            # A timeout waiting for the lock fails the package command, and so the task, of the
+            # host, and the lock is waited for again before the next package command on the host.
+            if not prepared["lock_released"]:
+                self.wait_for_package_lock(conn)
+                prepared["lock_released"] = True
+
     def remove_package(self, conn: Connection, packages) -> None:
         self._apply_packages_command(
             conn=conn,
             package_command=PackageCommand.REMOVE,
             packages=packages,
         )
+        if conn.host in self.installed_packages:
+            for package in packages if type(packages) == list else [packages]:
+                self.installed_packages[conn.host].pop(package, None)
+
+    def restore_package_managers(self) -> None:
+        """
+        Removes the package manager profile and resumes the package timers, concurrently, of all
+        of the hosts whose package manager was prepared in this run.
+        """
+
+        def restore(prepared: dict) -> None:
+            conn = prepared["conn"]
+            if prepared["profiled"]:
+                try:
+                    self.remove_package_manager_profile(conn)
+                except Exception as e:
+                    logging.warning(
+                        f"Unable to remove package manager profile; host={conn.host}, e={e}"
+                    )
+            try:
+                self.resume_package_timers(conn, prepared["timers"])
+            except Exception as e:
+                logging.warning(f"Unable to resume package timers; host={conn.host}, e={e}")
+
+        Utils.map_concurrently(
+            restore,
+            list(self.prepared_package_managers.values()),
+            max_workers=Distribution.PACKAGE_MANAGER_MAX_WORKERS,
+        )
+        self.prepared_package_managers = {}
+
+    @staticmethod
+    def render_repo_file(task_configs: dict, architecture: str, release: str) -> str:
+        repo_file_dict = dict(architecture=architecture, release=release)
+        return Template(task_configs["repo_file_template"]).safe_substitute(repo_file_dict)
+
+    def wait_for_package_lock(
+        self, conn: Connection, timeout_sec: float = PACKAGE_LOCK_TIMEOUT_SEC
+    ) -> None:
+        """
+        Waits, with an exponential backoff, for any package manager process on the host to
+        complete.  Raises Exit if it does not complete within timeout_sec.
+        """
+        started_at = time.time()
+        poll_sec = 1
+        while True:
+            r = conn.run(self.get_package_lock_holders_cmd(), warn=True, hide=True)
+            if r.failed:
+                return
+            if time.time() - started_at >= timeout_sec:
+                raise Exit(f"Timed out waiting for the package manager lock; host={conn.host}")
+            logging.info(
+                f"Waiting for the package manager lock; host={conn.host}, "
+                f"holders={r.stdout.split()}, poll_sec={poll_sec}"
+            )
+            time.sleep(poll_sec)
+            poll_sec = min(poll_sec * 2, Distribution.PACKAGE_LOCK_POLL_MAX_SEC)
 
     @abstractmethod
     def verify_package(
@@ -5,7 +5,7 @@ from io import StringIO
 from fabric import Connection
 from invoke import Context
 from tempfile import TemporaryDirectory
-from pydeploy.utils import Utils, HashAlgo
+from pydeploy.utils import Utils, GitHubReleaseInfo, HashAlgo
 
 
 class Docker(object):
@@ -41,6 +41,10 @@ class Docker(object):
         "amd64": "x86_64",
     }
 
+    DOCKER_DAEMON_JSON_PATH = "/etc/docker/daemon.json"
+
+    # The host fact in which the args of the daemon.json last written to each host are recorded.
+    HOST_FACT_DAEMON_JSON_ARGS = "docker_daemon_json_args"
     DOCKER_DAEMON_JSON_DEFAULT = {
         "bip": DOCKER_DAEMON_JSON_BIP_DEFAULT,
         "fixed-cidr": DOCKER_DAEMON_JSON_FIXED_CIDR_DEFAULT,
@@ -52,6 +56,26 @@ class Docker(object):
         ],
     }
 
+    @staticmethod
+    def get_daemon_json(
+        docker_bip: str = DOCKER_DAEMON_JSON_BIP_DEFAULT,
+        docker_fixed_cidr: str = DOCKER_DAEMON_JSON_FIXED_CIDR_DEFAULT,
+        docker_default_addr_pools_base: str = DOCKER_DAEMON_JSON_ADDR_POOLS_BASE_DEFAULT,
+        docker_default_addr_pools_size: int = DOCKER_DAEMON_JSON_ADDR_POOLS_SIZE_DEFAULT,
+        docker_insecure_registries: str = None,
+    ) -> dict:
+        daemon_json = copy.deepcopy(Docker.DOCKER_DAEMON_JSON_DEFAULT)
+        daemon_json["bip"] = docker_bip
+        daemon_json["fixed-cidr"] = docker_fixed_cidr
+        daemon_json["default-address-pools"][0]["base"] = docker_default_addr_pools_base
+        daemon_json["default-address-pools"][0]["size"] = docker_default_addr_pools_size
+
+        if docker_insecure_registries:
+            # Split on the ',' and create a list
+            docker_insecure_registries_entries = docker_insecure_registries.split(",")
+            daemon_json["insecure-registries"] = docker_insecure_registries_entries
+        return daemon_json
+
     @staticmethod
     def get_docker_mapped_architecture(architecture) -> str:
         if architecture in Docker.DOCKER_ARCH_MAP:
@@ -60,54 +84,76 @@ class Docker(object):
             return architecture
 
     @staticmethod
-    def get_dependencies(ctx: Context, temp_dir: TemporaryDirectory, architectures: set) -> dict:
-        configs = ctx.distro.configs
-        task_configs = ctx.distro.get_task_configs("install-docker")
-
-        # For each of the architectures download the required docker-compose binary.
-        retval_architectures = {}
+    def get_compose_checksums(ctx: Context, architectures: set) -> dict:
+        """
+        Returns a dict of mapped architecture to the sha256sum of the latest docker-compose binary
+        by only fetching the release metadata and the hashes files, and not the binaries themselves.
+        """
+        retval = {}
+        session = ctx.distro.configs.get_http_session()
         for architecture in architectures:
-            # Get the correct architecture string
             mapped_architecture = Docker.get_docker_mapped_architecture(architecture)
+            github_release_info = Docker.get_compose_release_info(ctx, mapped_architecture)
+            r = session.get(url=github_release_info.hashes_url)
+            if not r.ok:
+                raise Exception(
+                    "Unable to get docker-compose hashes file; "
+                    f"hashes_url={github_release_info.hashes_url}, r={r}"
+                )
+            retval[mapped_architecture] = r.text.split()[0]
+        return retval
 
-            # Hit the github repo and figure out the URL of the latest version, plus the sha256 sums.
-            # In this case, we dynamically generate the artifact and hashes regex
-            binary_filename = f"docker-compose-linux-{mapped_architecture}"
-            hashes_filename = f"{binary_filename}.sha256"
-            verify = ctx.distro.configs.is_request_verify()
-            github_release_info = Utils.get_github_release_info(
-                url=task_configs["github_release_url"],
-                artifact_regex=binary_filename,
-                hashes_regex=hashes_filename,
-                verify=verify,
-            )
+    @staticmethod
+    def get_compose_release_info(ctx: Context, mapped_architecture: str) -> GitHubReleaseInfo:
+        task_configs = ctx.distro.get_task_configs("install-docker")
 
-            # Download the artifact and then validate the checksum
-            artifact_local_path, hashes_local_path = Utils.download_github_artifact_and_checksum(
-                configs=configs, github_release_info=github_release_info, temp_dir=temp_dir
-            )
+        # Hit the github repo and figure out the URL of the latest version, plus the sha256 sums.
+        # In this case, we dynamically generate the artifact and hashes regex
+        binary_filename = f"docker-compose-linux-{mapped_architecture}"
+        hashes_filename = f"{binary_filename}.sha256"
+        return Utils.get_github_release_info(
+            configs=ctx.distro.configs,
+            url=task_configs["github_release_url"],
+            artifact_regex=binary_filename,
+            hashes_regex=hashes_filename,
+        )
 
-            # Validate the checksum for the downloaded file
-            hashes_line_pattern = f".*{github_release_info.artifact_filename}.*"
-            if not Utils.file_checksum_with_checksum_file(
-                file_path=artifact_local_path,
-                hashes_file_path=hashes_local_path,
-                hashes_file_pattern=hashes_line_pattern,
-                hashes_line_token=0,
-                hash_algo=HashAlgo.SHA256SUM,
-            ):
-                raise Exception(
-                    f"checking sha256sum on file mismatch; "
-                    f"artifact_local_path={artifact_local_path}, "
-                    f"hashes_local_path={hashes_local_path}, "
-                )
+    @staticmethod
+    def get_compose_release_tag(ctx: Context) -> str:
+        # The release tag is the same for all of the architectures
+        mapped_architecture = Docker.get_docker_mapped_architecture("amd64")
+        return Docker.get_compose_release_info(ctx, mapped_architecture).tag_name
 
-            arch_artifacts = {
+    @staticmethod
+    def get_dependencies(ctx: Context, temp_dir: TemporaryDirectory, architectures: set) -> dict:
+        configs = ctx.distro.configs
+
+        # For each of the architectures download the required docker-compose binary.
+        def get_arch_artifacts(mapped_architecture: str) -> dict:
+            github_release_info = Docker.get_compose_release_info(ctx, mapped_architecture)
+
+            # Download the artifact, which is validated against the checksum in the hashes file
+            artifact_local_path, _ = Utils.download_github_artifact_and_checksum(
+                configs=configs,
+                github_release_info=github_release_info,
+                temp_dir=temp_dir,
+                hashes_line_token=0,
+            )
+            return {
                 "binary_filename": github_release_info.artifact_filename,
                 "binary_local_file_path": artifact_local_path,
             }
-            retval_architectures[mapped_architecture] = arch_artifacts
 
+        # The architectures are fetched concurrently.
+        mapped_architectures = sorted(
+            {Docker.get_docker_mapped_architecture(a) for a in architectures}
+        )
+        retval_architectures = dict(
+            zip(
+                mapped_architectures,
+                Utils.map_concurrently(get_arch_artifacts, mapped_architectures),
+            )
+        )
         return {"architectures": retval_architectures}
 
     @staticmethod
@@ -121,6 +167,7 @@ class Docker(object):
         docker_default_addr_pools_base: str,
         docker_default_addr_pools_size: int,
         docker_insecure_registries: str,
+        install_compose: bool = True,
     ):
         # Add the docker repo and install the packages
         ctx.distro.add_repo(configs=ctx.configs, conn=conn, task="install-docker")
@@ -132,40 +179,60 @@ class Docker(object):
         # contains artifacts specific to each architecture. The architecture that is returned by the
         # OS may not necessarily match the string that the docker maintainers have used for the
         # specific binary so we resolve it via our map.
-        docker_dependencies = dependencies["install-docker"]
-        os_arch = ctx.distro.get_architecture(conn)
-        architecture = Docker.get_docker_mapped_architecture(os_arch)
-        architecture_dependencies = docker_dependencies["architectures"][architecture]
-
-        binary_file_remote_file_path = os.path.join("/var/tmp/", architecture_dependencies["binary_filename"])
-        conn.put(architecture_dependencies["binary_local_file_path"], binary_file_remote_file_path)
-        conn.run(f"chmod +x {binary_file_remote_file_path}")
-        conn.run(f"mv -f {binary_file_remote_file_path} /usr/local/bin/")
-        # Remove a possibly pre-existing symlink and then add it
-        conn.run(f"rm -f /usr/local/bin/docker-compose")
-        conn.run(
-            f"ln -s /usr/local/bin/{architecture_dependencies['binary_filename']} /usr/local/bin/docker-compose"
-        )
+        # If the probe determined that the host already has the latest docker-compose binary there
+        # will not be any dependencies for it.
+        if install_compose:
+            docker_dependencies = dependencies["install-docker"]
+            os_arch = ctx.distro.get_architecture(conn)
+            architecture = Docker.get_docker_mapped_architecture(os_arch)
+            architecture_dependencies = docker_dependencies["architectures"][architecture]
+
+            binary_file_remote_file_path = os.path.join(
+                "/var/tmp/", architecture_dependencies["binary_filename"]
+            )
+            conn.put(
+                architecture_dependencies["binary_local_file_path"], binary_file_remote_file_path
+            )
+            conn.run(f"chmod +x {binary_file_remote_file_path}")
+            conn.run(f"mv -f {binary_file_remote_file_path} /usr/local/bin/")
+            # Remove a possibly pre-existing symlink and then add it
+            conn.run(f"rm -f /usr/local/bin/docker-compose")
+            conn.run(
+                f"ln -s /usr/local/bin/{architecture_dependencies['binary_filename']} /usr/local/bin/docker-compose"
+            )
 
         # Customize and then write out the docker daemon.json file.  Put it on the remote host and
         # then restart docker.
-        daemon_json = copy.deepcopy(Docker.DOCKER_DAEMON_JSON_DEFAULT)
-        daemon_json["bip"] = docker_bip
-        daemon_json["fixed-cidr"] = docker_fixed_cidr
-        daemon_json["default-address-pools"][0]["base"] = docker_default_addr_pools_base
-        daemon_json["default-address-pools"][0]["size"] = docker_default_addr_pools_size
-
-        if docker_insecure_registries:
-            # Split on the ',' and create a list
-            docker_insecure_registries_entries = docker_insecure_registries.split(",")
-            daemon_json["insecure-registries"] = docker_insecure_registries_entries
-
+        daemon_json_args = dict(
+            docker_bip=docker_bip,
+            docker_fixed_cidr=docker_fixed_cidr,
+            docker_default_addr_pools_base=docker_default_addr_pools_base,
+            docker_default_addr_pools_size=docker_default_addr_pools_size,
+            docker_insecure_registries=docker_insecure_registries,
+        )
+        daemon_json = Docker.get_daemon_json(**daemon_json_args)
         daemon_json_str = json.dumps(daemon_json, indent=2)
-        target_daemon_json_path = "/etc/docker/daemon.json"
+        target_daemon_json_path = Docker.DOCKER_DAEMON_JSON_PATH
         conn.put(StringIO(daemon_json_str), target_daemon_json_path)
         conn.run(f"chown root: {target_daemon_json_path}")
+
+        # Record the args so that the drift task expects the daemon.json written to the host.
+        ctx.state.save_host_facts(
+            conn.host, {Docker.HOST_FACT_DAEMON_JSON_ARGS: json.dumps(daemon_json_args)}
+        )
         conn.run("systemctl restart docker")
 
         # Add the specified docker use to the docker group
         if docker_user:
             ctx.distro.add_user_to_group(conn=conn, user=docker_user, groups="docker")
+
+    @staticmethod
+    def is_compose_install_required(
+        ctx: Context, conn: Connection, architecture: str, expected_checksums: dict
+    ) -> bool:
+        mapped_architecture = Docker.get_docker_mapped_architecture(architecture)
+        binary_path = f"/usr/local/bin/docker-compose-linux-{mapped_architecture}"
+        r = conn.run(f"sha256sum {binary_path}", warn=True)
+        if r.failed:
+            return True
+        return r.stdout.split()[0] != expected_checksums[mapped_architecture]
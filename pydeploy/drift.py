@@ -0,0 +1,361 @@
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fabric import Connection
+from invoke import Context
+from pydeploy.distributions.distribution import Distribution
+from pydeploy.docker import Docker
+from pydeploy.java import Java
+from pydeploy.os import OS
+from pydeploy.state import TaskStatus
+
+logging.basicConfig(
+    format="%(asctime)s,%(levelname)s,%(module)s,%(message)s",
+    level=logging.INFO,
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+class DriftStatus(object):
+    OK = "ok"
+    DRIFT = "drift"
+    ERROR = "error"
+
+
+class Drift(object):
+    """
+    Read-only comparison of each host against the desired state implied by the merged configs.
+
+    All of the facts for a host are gathered with a single batched probe script whose output is
+    split into sections, so that a scan costs one ssh session and one remote command per host.
+    """
+
+    APT_SOURCES_DIR = "/etc/apt/sources.list.d"
+    PARALLELISM_DEFAULT = 64
+    PROBE_MISSING = "@@pydeploy-drift-missing"
+    PROBE_SECTION_PREFIX = "@@pydeploy-drift:"
+
+    SECTION_ARCHITECTURE = "architecture"
+    SECTION_CA_BUNDLE = "ca-bundle-subjects"
+    SECTION_DOCKER_DAEMON_JSON = "docker-daemon-json"
+    SECTION_INOTIFY = "sysctl-inotify"
+    SECTION_PACKAGES = "packages"
+    SECTION_RELEASE = "release"
+    SECTION_REPO_PREFIX = "repo:"
+    SECTION_TOOL_PREFIX = "tool:"
+
+    @staticmethod
+    def check(check: str, name: str, expected, actual) -> dict:
+        return {
+            "check": check,
+            "name": name,
+            "expected": expected,
+            "actual": actual,
+            "status": DriftStatus.OK if expected == actual else DriftStatus.DRIFT,
+        }
+
+    @staticmethod
+    def compare(distro: Distribution, desired_state: dict, sections: dict[str, str]) -> list[dict]:
+        """
+        Compares the parsed probe output for a single host with the desired state and returns a
+        list of check result dicts.
+        """
+        retval = []
+
+        installed_packages = distro.parse_installed_packages(
+            sections.get(Drift.SECTION_PACKAGES) or ""
+        )
+        for package in desired_state["packages"]:
+            retval.append(Drift.check("package", package, True, package in installed_packages))
+
+        for task, tool in desired_state["tools"].items():
+            actual = sections.get(f"{Drift.SECTION_TOOL_PREFIX}{task}")
+            if actual is not None:
+                actual = tool["parser"](actual)
+            retval.append(Drift.check("tool", task, tool["expected"], actual))
+
+        daemon_json = sections.get(Drift.SECTION_DOCKER_DAEMON_JSON)
+        if daemon_json is not None:
+            try:
+                daemon_json = json.loads(daemon_json)
+            except json.JSONDecodeError:
+                pass
+        retval.append(
+            Drift.check(
+                "docker-daemon-json",
+                Docker.DOCKER_DAEMON_JSON_PATH,
+                desired_state["docker_daemon_json"],
+                daemon_json,
+            )
+        )
+
+        inotify = sections.get(Drift.SECTION_INOTIFY)
+        retval.append(
+            Drift.check(
+                "sysctl",
+                OS.INOTIFY_MAX_USER_WATCHES_KEY,
+                str(desired_state["max_user_watches"]),
+                inotify.strip() if inotify is not None else None,
+            )
+        )
+
+        # The repo files are templated with the architecture and the release of each host
+        architecture = (sections.get(Drift.SECTION_ARCHITECTURE) or "").strip()
+        release = (sections.get(Drift.SECTION_RELEASE) or "").strip()
+        for repo_file_name, task_configs in desired_state["repos"].items():
+            expected = Distribution.render_repo_file(task_configs, architecture, release)
+            actual = sections.get(f"{Drift.SECTION_REPO_PREFIX}{repo_file_name}")
+            retval.append(
+                Drift.check(
+                    "repo-file",
+                    repo_file_name,
+                    expected.strip(),
+                    actual.strip() if actual is not None else None,
+                )
+            )
+
+        if desired_state["cert_validation_strings"]:
+            subjects = (sections.get(Drift.SECTION_CA_BUNDLE) or "").lower()
+            for cert_validation_string in desired_state["cert_validation_strings"]:
+                retval.append(
+                    Drift.check(
+                        "ca-bundle",
+                        cert_validation_string,
+                        True,
+                        cert_validation_string.lower() in subjects,
+                    )
+                )
+
+        return retval
+
+    @staticmethod
+    def get_desired_daemon_json(state, host: str) -> dict:
+        """
+        Returns the docker daemon.json last written to the host by install-docker, built from its
+        args recorded in the state db, or the one written with the default args if install-docker
+        has not recorded any for the host.
+        """
+        daemon_json_args = state.get_host_facts(host).get(Docker.HOST_FACT_DAEMON_JSON_ARGS)
+        if daemon_json_args is None:
+            return Docker.get_daemon_json()
+        return Docker.get_daemon_json(**json.loads(daemon_json_args))
+
+    @staticmethod
+    def get_desired_max_user_watches(state, host: str, default: int) -> int:
+        """
+        Returns the max_user_watches last applied to the host by setup-inotify, from the inputs of
+        its last successful result in the state db, or the default if none were recorded.
+        """
+        result = state.get_last_result(host, "setup-inotify", TaskStatus.SUCCESS)
+        if result is None or result["inputs"] is None:
+            return default
+        return json.loads(result["inputs"]).get("max_user_watches", default)
+
+    @staticmethod
+    def get_desired_state(ctx: Context, cert_validation_strings: list[str] = None) -> dict:
+        configs = ctx.distro.configs.configs
+
+        def task_configs(task: str) -> dict:
+            return configs[task] if task in configs else {}
+
+        # Each tool is described by the command that will output its installed version, the
+        # expected version and a parser that extracts the version from the output of the command.
+        tools = {}
+        if "version" in task_configs("install-maven"):
+            tools["install-maven"] = dict(
+                cmd=f"readlink -e {Java.MAVEN_SYMLINK_PATH}",
+                expected=str(task_configs("install-maven")["version"]),
+                parser=lambda s: s.strip().removeprefix("/usr/local/apache-maven-"),
+            )
+        if "version" in task_configs("install-gradle"):
+            tools["install-gradle"] = dict(
+                cmd=f"readlink -e {Java.GRADLE_SYMLINK_PATH}",
+                expected=str(task_configs("install-gradle")["version"]),
+                parser=lambda s: s.strip().removeprefix("/usr/local/gradle-"),
+            )
+        if "version" in task_configs("install-helm"):
+            tools["install-helm"] = dict(
+                cmd="helm version --template '{{.Version}}'",
+                expected=str(task_configs("install-helm")["version"]),
+                parser=lambda s: s.strip().removeprefix("v"),
+            )
+        if "version" in task_configs("install-intellij"):
+            version = task_configs("install-intellij")["version"]
+            tools["install-intellij"] = dict(
+                cmd=f"cat {Java.INTELLIJ_PRODUCT_INFO_PATH}",
+                expected=str(version),
+                parser=Drift.parse_intellij_product_info,
+            )
+
+        repos = {}
+        for task, cfgs in configs.items():
+            if type(cfgs) is dict and "repo_file_name" in cfgs and "repo_file_template" in cfgs:
+                repos[cfgs["repo_file_name"]] = cfgs
+
+        return {
+            "packages": task_configs("install-packages").get("packages", []),
+            "tools": tools,
+            # The daemon.json and max_user_watches of each host are expected to be the ones applied
+            # with the args recorded for the host, see get_desired_daemon_json and
+            # get_desired_max_user_watches.
+            "docker_daemon_json": Docker.get_daemon_json(),
+            "max_user_watches": task_configs("setup-inotify").get(
+                "max_user_watches", OS.INOTIFY_MAX_USER_WATCHES_DEFAULT
+            ),
+            "repos": repos,
+            "ca_certs_bundle_path": task_configs("install-cert").get("ca_certs_bundle_path"),
+            "cert_validation_strings": cert_validation_strings or [],
+        }
+
+    @staticmethod
+    def get_probe_script(distro: Distribution, desired_state: dict) -> str:
+        """
+        Generates a single shell script that gathers every fact required by compare.  Each fact is
+        preceded by a section header line and files that do not exist are reported with the
+        PROBE_MISSING marker so that they can be distinguished from empty files.
+        """
+        lines = []
+
+        def section(name: str, cmd: str) -> None:
+            lines.append(f"echo '{Drift.PROBE_SECTION_PREFIX}{name}'")
+            lines.append(f"{cmd} 2>/dev/null || echo '{Drift.PROBE_MISSING}'")
+
+        def file_section(name: str, path: str) -> None:
+            section(name, f"cat {path}")
+
+        section(Drift.SECTION_ARCHITECTURE, distro.get_architecture_cmd())
+        section(Drift.SECTION_RELEASE, distro.get_release_cmd())
+        if desired_state["packages"]:
+            packages = " ".join(desired_state["packages"])
+            # The query exits non-zero if any of the packages is unknown, but still lists the rest.
+            lines.append(f"echo '{Drift.PROBE_SECTION_PREFIX}{Drift.SECTION_PACKAGES}'")
+            lines.append(f"{distro.get_installed_packages_cmd(packages)} 2>/dev/null")
+        for task, tool in desired_state["tools"].items():
+            section(f"{Drift.SECTION_TOOL_PREFIX}{task}", tool["cmd"])
+        file_section(Drift.SECTION_DOCKER_DAEMON_JSON, Docker.DOCKER_DAEMON_JSON_PATH)
+        section(Drift.SECTION_INOTIFY, f"sysctl -n {OS.INOTIFY_MAX_USER_WATCHES_KEY}")
+        for repo_file_name in desired_state["repos"]:
+            file_section(
+                f"{Drift.SECTION_REPO_PREFIX}{repo_file_name}",
+                f"{Drift.APT_SOURCES_DIR}/{repo_file_name}",
+            )
+        if desired_state["cert_validation_strings"] and desired_state["ca_certs_bundle_path"]:
+            section(
+                Drift.SECTION_CA_BUNDLE,
+                "awk -v cmd='openssl x509 -noout -subject' '/BEGIN/{close(cmd)};{print | cmd}' "
+                f"< {desired_state['ca_certs_bundle_path']}",
+            )
+        return "\n".join(lines)
+
+    @staticmethod
+    def parse_intellij_product_info(cmd_stdout: str) -> str:
+        try:
+            return json.loads(cmd_stdout).get("version")
+        except json.JSONDecodeError:
+            return None
+
+    @staticmethod
+    def parse_probe_output(cmd_stdout: str) -> dict[str, str]:
+        """
+        Splits the output of the probe script into a dict of section name to the section contents.
+        Sections for which the probe reported PROBE_MISSING map to None.
+        """
+        retval = {}
+        name = None
+        section_lines = []
+
+        def close_section() -> None:
+            if name is None:
+                return
+            if section_lines and section_lines[-1] == Drift.PROBE_MISSING:
+                retval[name] = None
+            else:
+                retval[name] = "\n".join(section_lines)
+
+        for line in cmd_stdout.splitlines():
+            if line.startswith(Drift.PROBE_SECTION_PREFIX):
+                close_section()
+                name = line[len(Drift.PROBE_SECTION_PREFIX) :]
+                section_lines = []
+            else:
+                section_lines.append(line)
+        close_section()
+        return retval
+
+    @staticmethod
+    def scan(
+        ctx: Context,
+        parallelism: int = PARALLELISM_DEFAULT,
+        cert_validation_strings: list[str] = None,
+    ) -> dict:
+        """
+        Scans all of the hosts in parallel and returns a machine-readable report dict.
+        """
+        start = time.time()
+        desired_state = Drift.get_desired_state(ctx, cert_validation_strings)
+        probe_script = Drift.get_probe_script(ctx.distro, desired_state)
+
+        hosts = {}
+        connections = ctx.configs.connections
+        with ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+            futures = {
+                executor.submit(
+                    Drift.scan_host,
+                    ctx.distro,
+                    conn,
+                    dict(
+                        desired_state,
+                        docker_daemon_json=Drift.get_desired_daemon_json(ctx.state, host),
+                        max_user_watches=Drift.get_desired_max_user_watches(
+                            ctx.state, host, desired_state["max_user_watches"]
+                        ),
+                    ),
+                    probe_script,
+                ): host
+                for host, conn in connections.items()
+            }
+            for future in as_completed(futures):
+                hosts[futures[future]] = future.result()
+
+        # Persist the observed facts and tool versions so that they can be queried later without
+        # touching the fleet.
+        summary = {DriftStatus.OK: 0, DriftStatus.DRIFT: 0, DriftStatus.ERROR: 0}
+        for host, host_report in hosts.items():
+            summary[host_report["status"]] += 1
+            if host_report["status"] == DriftStatus.ERROR:
+                continue
+            ctx.state.save_host_facts(host, host_report["facts"])
+            for check in host_report["checks"]:
+                if check["check"] == "tool":
+                    ctx.state.save_tool_version(host, check["name"], check["actual"])
+        return {
+            "generated_at": int(start),
+            "duration_sec": round(time.time() - start, 3),
+            "summary": summary,
+            "hosts": dict(sorted(hosts.items())),
+        }
+
+    @staticmethod
+    def scan_host(
+        distro: Distribution, conn: Connection, desired_state: dict, probe_script: str
+    ) -> dict:
+        try:
+            r = conn.run(probe_script, warn=True, hide=True)
+        except Exception as e:
+            logger.error(f"Unable to probe host for drift; host={conn.host}, e={e}")
+            return {"status": DriftStatus.ERROR, "error": str(e), "checks": []}
+
+        sections = Drift.parse_probe_output(r.stdout)
+        checks = Drift.compare(distro, desired_state, sections)
+        drifted = any(c["status"] == DriftStatus.DRIFT for c in checks)
+        return {
+            "status": DriftStatus.DRIFT if drifted else DriftStatus.OK,
+            "facts": {
+                "architecture": (sections.get(Drift.SECTION_ARCHITECTURE) or "").strip(),
+                "release": (sections.get(Drift.SECTION_RELEASE) or "").strip(),
+            },
+            "checks": checks,
+        }
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import logging
+import os
+import requests
+import sys
+import threading
+import time
+from requests import Response
+from tempfile import NamedTemporaryFile
+
+logging.basicConfig(
+    format="%(asctime)s,%(levelname)s,%(module)s,%(message)s",
+    level=logging.INFO,
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+class GitHubReleaseCache(object):
+    """
+    Persistent cache of the release json documents fetched from the GitHub API.
+
+    Each release json is stored with its ETag and revalidated with If-None-Match on its first use in
+    a run.  GitHub does not count the 304 responses to those requests against the API rate limit.
+    Within a run the release json is then served from memory, so the API is requested at most once
+    per url no matter how many tasks and architectures need the release.
+
+    Requests are authenticated with the token, if one is provided, for its higher rate limit.  When
+    the rate limit is exhausted, requests are retried once it resets if that is within
+    RATE_LIMIT_MAX_WAIT_SEC.  Otherwise the stored release json is used, if there is one.
+    """
+
+    CACHE_DIR_DEFAULT = os.path.join(os.path.expanduser("~"), ".pydeploy", "github-releases")
+    MAX_ATTEMPTS = 3
+    RATE_LIMIT_MAX_WAIT_SEC = 300
+
+    def __init__(self, cache_dir: str = CACHE_DIR_DEFAULT, token: str = None) -> None:
+        self.cache_dir = cache_dir
+        self.token = token
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Dict of url to the release json fetched, or revalidated, in this run.
+        self.releases = {}
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def get_cache_path(self, url: str) -> str:
+        return os.path.join(
+            self.cache_dir, f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+        )
+
+    def get_headers(self, stored: dict) -> dict:
+        headers = {"Accept": "application/vnd.github+json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if stored is not None and stored.get("etag"):
+            headers["If-None-Match"] = stored["etag"]
+        return headers
+
+    def get_lock(self, url: str) -> threading.Lock:
+        with self.locks_lock:
+            if url not in self.locks:
+                self.locks[url] = threading.Lock()
+            return self.locks[url]
+
+    @staticmethod
+    def get_rate_limit_wait_sec(r: Response) -> float:
+        """
+        Returns the number of seconds to wait before retrying the request of the response, if it
+        was rejected by the rate limit of the API, otherwise None.
+        """
+        if r.status_code not in (403, 429):
+            return None
+        if r.headers.get("Retry-After"):
+            return float(r.headers["Retry-After"])
+        if r.headers.get("X-RateLimit-Remaining") == "0" and r.headers.get("X-RateLimit-Reset"):
+            return max(float(r.headers["X-RateLimit-Reset"]) - time.time(), 0) + 1
+        return None
+
+    def get_release_json(self, session: requests.Session, url: str) -> dict:
+        with self.get_lock(url):
+            if url not in self.releases:
+                self.releases[url] = self.fetch_release_json(session, url)
+            return self.releases[url]
+
+    def fetch_release_json(self, session: requests.Session, url: str) -> dict:
+        stored = self.load(url)
+        for attempt in range(1, GitHubReleaseCache.MAX_ATTEMPTS + 1):
+            r = session.get(url=url, headers=self.get_headers(stored))
+            if r.status_code == 304 and stored is not None:
+                logger.info(f"GitHub release not modified; url={url}")
+                return stored["release"]
+            if r.ok:
+                release_json = r.json()
+                self.store(url, r.headers.get("ETag"), release_json)
+                if r.headers.get("X-RateLimit-Remaining") == "0":
+                    logger.warning(
+                        f"GitHub API rate limit exhausted; url={url}, "
+                        f"reset={r.headers.get('X-RateLimit-Reset')}"
+                    )
+                return release_json
+
+            wait_sec = GitHubReleaseCache.get_rate_limit_wait_sec(r)
+            can_retry = (
+                wait_sec is not None
+                and wait_sec <= GitHubReleaseCache.RATE_LIMIT_MAX_WAIT_SEC
+                and attempt < GitHubReleaseCache.MAX_ATTEMPTS
+            )
+            if wait_sec is not None and not can_retry and stored is not None:
+                logger.warning(f"GitHub API rate limited, using the stored release; url={url}")
+                return stored["release"]
+            if not can_retry:
+                raise Exception(f"Unable to get github release info json; url={url}, r={r}")
+            logger.warning(
+                f"GitHub API rate limited, retrying; url={url}, wait_sec={wait_sec}, "
+                f"attempt={attempt}"
+            )
+            time.sleep(wait_sec)
+
+    def load(self, url: str) -> dict:
+        cache_path = self.get_cache_path(url)
+        if not os.path.exists(cache_path):
+            return None
+        with open(cache_path, "r") as f:
+            return json.load(f)
+
+    def store(self, url: str, etag: str, release_json: dict) -> None:
+        with NamedTemporaryFile("w", dir=self.cache_dir, delete=False) as f:
+            json.dump(dict(url=url, etag=etag, release=release_json), f)
+        os.replace(f.name, self.get_cache_path(url))
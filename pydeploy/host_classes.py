@@ -0,0 +1,62 @@
+import logging
+import sys
+from fabric import Connection
+from pydeploy.state import StateDb
+
+logging.basicConfig(
+    format="%(asctime)s,%(levelname)s,%(module)s,%(message)s",
+    level=logging.INFO,
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+class HostClasses(object):
+    """
+    Groups the hosts of a run into equivalence classes of hosts that share the same distro
+    implementation, release, architecture and merged configs.  Artifacts that depend only on those,
+    such as rendered repo files, are computed once per class and shared by all of its members.
+
+    The architecture and the release of each host are probed only once per run.
+    """
+
+    def __init__(self, distro) -> None:
+        self.distro = distro
+        self.config_hash = None
+
+        # Dict of host to the dict of the facts of the host that determine its class.
+        self.host_facts = {}
+
+        # Dict of host class to a dict of artifact name to artifact.
+        self.artifacts = {}
+
+    def get_artifact(self, conn: Connection, name: str, factory):
+        """
+        Returns the artifact for the class of the host, calling factory with the facts of the host
+        only for the first member of the class that requires it.
+        """
+        host_class = self.get_host_class(conn)
+        class_artifacts = self.artifacts.setdefault(host_class, {})
+        if name not in class_artifacts:
+            class_artifacts[name] = factory(self.get_host_facts(conn))
+        return class_artifacts[name]
+
+    def get_host_class(self, conn: Connection) -> tuple:
+        if self.config_hash is None:
+            self.config_hash = StateDb.config_hash(self.distro.configs.configs)
+        facts = self.get_host_facts(conn)
+        return (
+            self.distro.get_version(),
+            facts["release"],
+            facts["architecture"],
+            self.config_hash,
+        )
+
+    def get_host_facts(self, conn: Connection) -> dict:
+        if conn.host not in self.host_facts:
+            self.host_facts[conn.host] = dict(
+                architecture=self.distro.get_architecture(conn),
+                release=self.distro.get_release(conn),
+            )
+            logger.info(f"Host facts; host={conn.host}, facts={self.host_facts[conn.host]}")
+        return self.host_facts[conn.host]
@@ -0,0 +1,52 @@
+import logging
+import requests
+import sys
+from requests.adapters import HTTPAdapter
+
+logging.basicConfig(
+    format="%(asctime)s,%(levelname)s,%(module)s,%(message)s",
+    level=logging.INFO,
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that applies a default timeout to the requests that do not set their own.
+    """
+
+    def __init__(self, timeout_sec: float, **kwargs) -> None:
+        self.timeout_sec = timeout_sec
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(
+            request, timeout=self.timeout_sec if timeout is None else timeout, **kwargs
+        )
+
+
+class HttpSession(object):
+    """
+    Creates the requests.Session through which all of the outbound HTTP(S) requests of a run are
+    made, so that connections to the same host are kept alive and reused, rather than paying for a
+    new TCP and TLS handshake on every request, and so that the TLS verification, timeout and proxy
+    settings are the same for all of them.
+    """
+
+    # Large enough for the concurrent segments of a download to each keep a connection to the host.
+    POOL_MAXSIZE = 16
+
+    @staticmethod
+    def create(verify: bool, timeout_sec: float, proxy: str = None) -> requests.Session:
+        session = requests.Session()
+        session.verify = verify
+        if proxy:
+            session.proxies.update(http=proxy, https=proxy)
+        adapter = TimeoutHTTPAdapter(timeout_sec, pool_maxsize=HttpSession.POOL_MAXSIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        logger.info(
+            f"Created http session; verify={verify}, timeout_sec={timeout_sec}, proxy={proxy}"
+        )
+        return session
@@ -1,5 +1,5 @@
+import json
 import os
-import requests
 from string import Template
 from invoke import Context, Exit
 from fabric import Connection
@@ -16,6 +16,8 @@ class Java(object):
 Add the following to your .bashrc and then add $GRADLE_HOME/bin' to your path
   export GRADLE_HOME=/usr/local/gradle"""
 
+    GRADLE_SYMLINK_PATH = "/usr/local/gradle"
+    INTELLIJ_PRODUCT_INFO_PATH = "/usr/local/intellij/product-info.json"
     INTELLIJ_ARCH_MAP = {
         # Intellij does not include the architecture string in the version for x86_64 architecture
         "amd64": "",
@@ -27,12 +29,18 @@ Add the following to your .bashrc and then add '$JAVA_HOME/bin' to your path
   export JAVA_HOME=$(readlink -f $(which java) | sed 's|/bin/java||')"""
 
     MAVEN_DOWNLOAD_URL_FMT = "https://archive.apache.org/dist/maven/maven-3/$version/binaries"
+    # The current releases are also served from the ASF CDN, which is much faster than the archive.
+    MAVEN_MIRROR_URL_FMTS = [
+        "https://dlcdn.apache.org/maven/maven-3/$version/binaries",
+        MAVEN_DOWNLOAD_URL_FMT,
+    ]
     MAVEN_DOWNLOAD_FILE_FMT = "apache-maven-$version-bin.tar.gz"
     MAVEN_FEEDBACK = """Apache Maven has been installed.`
 Add the following to your .bashrc and then add $MAVEN_HOME/bin' to your path
   export MAVEN_HOME=/usr/local/apache-maven"""
 
     MAVEN_DEPENDENCY_TARBALL_PATH = "maven_tarball_path"
+    MAVEN_SYMLINK_PATH = "/usr/local/apache-maven"
 
     @staticmethod
     def get_java_home(ctx: Context = None, conn: Connection = None) -> str:
@@ -84,6 +92,8 @@ Add the following to your .bashrc and then add $MAVEN_HOME/bin' to your path
     ) -> None:
         if dependencies is None:
             dependencies = Java.install_gradle_get_dependencies(ctx=ctx, version=version)
+        if version is None:
+            version = str(ctx.distro.get_task_configs("install-gradle")["version"])
 
         target_parent_dir = "/usr/local"
         target_dir = os.path.join(target_parent_dir, f"gradle-{version}")
@@ -115,39 +125,39 @@ Add the following to your .bashrc and then add $MAVEN_HOME/bin' to your path
         if version is None:
             version = str(task_configs["version"])
 
-        # Get the the gradle versions JSON document and get the details for the version that we want
-        # to install.
-        r = requests.get(
-            task_configs["versions_url"], verify=ctx.distro.configs.is_request_verify()
-        )
-        versions_json = r.json()
-        version_json = None
-        for version_entry in versions_json:
-            if version_entry["version"] == version:
-                version_json = version_entry
-                break
-        if version_json is None:
-            raise Exception(
-                "Unable to find version data in output from the versions url for gradle; "
-                f"version={version}, version_json={version_json}"
+        # Get the download and checksum urls of the version that we want to install from the index
+        # of the gradle versions JSON document.
+        if configs.version_index is not None:
+            download_url, checksum_url = configs.version_index.get_version(
+                configs.get_http_session(), "gradle", task_configs["versions_url"], version
             )
+        else:
+            r = configs.get_http_session().get(task_configs["versions_url"])
+            versions_json = r.json()
+            version_json = None
+            for version_entry in versions_json:
+                if version_entry["version"] == version:
+                    version_json = version_entry
+                    break
+            if version_json is None:
+                raise Exception(
+                    "Unable to find version data in output from the versions url for gradle; "
+                    f"version={version}, version_json={version_json}"
+                )
+            download_url = version_json["downloadUrl"]
+            checksum_url = version_json["checksumUrl"]
 
-        zipfile_file_name = version_json["downloadUrl"].split("/")[-1]
+        zipfile_file_name = download_url.split("/")[-1]
         zipfile_local_file_path = os.path.join(temp_dir.name, zipfile_file_name)
+        r = configs.get_http_session().get(url=checksum_url)
+        shasum = r.text.strip()
         Utils.download_file(
             configs=configs,
-            url=version_json["downloadUrl"],
+            url=download_url,
             target_local_path=zipfile_local_file_path,
+            checksum=shasum,
+            hash_algo=HashAlgo.SHA256SUM,
         )
-        r = requests.get(url=version_entry["checksumUrl"], verify=configs.is_request_verify())
-        shasum = r.text.strip()
-        if not Utils.file_checksum(
-            file_path=zipfile_local_file_path, checksum=shasum, hash_algo=HashAlgo.SHA256SUM
-        ):
-            retval["errors"] = [
-                f"Downloaded file checksum does not match; zipfile_local_file_path={zipfile_local_file_path}, shasum={shasum}"
-            ]
-            return retval
         retval[Java.GRADLE_DEPENDENCY_COMPRESSED_FILE_PATH] = zipfile_local_file_path
         retval[Java.GRADLE_DEPENDENCY_COMPRESSED_FILE_NAME] = zipfile_file_name
         return retval
@@ -159,8 +169,7 @@ Add the following to your .bashrc and then add $MAVEN_HOME/bin' to your path
         task_configs = ctx.distro.get_task_configs("install-intellij")
         version = version if version is not None else task_configs["version"]
 
-        retval_architectures = {}
-        for architecture in architectures:
+        def get_arch_artifacts(architecture: str) -> dict:
             # IntelliJ does not have a consistent way of naming their packages/urls.  They only add the
             # architecture if it is aarch64, AFAIK.  So, we lookup the architecture that IntelliJ uses
             # and then based on the result generate a string that we will use for the
@@ -184,30 +193,35 @@ Add the following to your .bashrc and then add $MAVEN_HOME/bin' to your path
             )
             gz_download_file_name = gz_download_url.split("/")[-1]
             local_gz_download_file_path = os.path.join(temp_dir.name, gz_download_file_name)
+            mirror_urls = [
+                Template(url_template).substitute(version_and_architecture=version_and_architecture)
+                for url_template in task_configs.get("mirror_url_templates", [])
+            ]
+
+            # The checksum always comes from the url_template, whichever mirror the tarball comes
+            # from.
+            shasum_url = f"{gz_download_url}.sha256"
+            r = ctx.distro.configs.get_http_session().get(shasum_url)
+            shasum = r.text.split()[0]
             Utils.download_file(
                 configs=ctx.distro.configs,
                 url=gz_download_url,
                 target_local_path=local_gz_download_file_path,
-            )
-            shasum_url = f"{gz_download_url}.sha256"
-            r = requests.get(shasum_url, verify=ctx.distro.configs.is_request_verify())
-            shasum = r.text.split()[0]
-            if not Utils.file_checksum(
-                file_path=local_gz_download_file_path,
                 checksum=shasum,
                 hash_algo=HashAlgo.SHA256SUM,
-            ):
-                raise Exception(
-                    "Downloaded file checksum does not match; "
-                    f"gz_download_path={local_gz_download_file_path}, shasum={shasum}"
-                )
+                mirror_urls=[url for url in mirror_urls if url != gz_download_url],
+            )
 
-            arch_artifacts = {
+            return {
                 "filename": gz_download_file_name,
                 "local_file_path": local_gz_download_file_path,
             }
-            retval_architectures[architecture] = arch_artifacts
 
+        # The architectures are fetched concurrently.
+        architectures = sorted(architectures)
+        retval_architectures = dict(
+            zip(architectures, Utils.map_concurrently(get_arch_artifacts, architectures))
+        )
         return {"architectures": retval_architectures}
 
     @staticmethod
@@ -227,6 +241,54 @@ Add the following to your .bashrc and then add $MAVEN_HOME/bin' to your path
             symlink_path=target_symlink,
         )
 
+    @staticmethod
+    def is_gradle_install_required(
+        ctx: Context, conn: Connection, architecture: str, version: str = None
+    ) -> bool:
+        if version is None:
+            version = str(ctx.distro.get_task_configs("install-gradle")["version"])
+        return not Java.is_symlinked_install_current(
+            conn, symlink_path=Java.GRADLE_SYMLINK_PATH, target_dir=f"/usr/local/gradle-{version}"
+        )
+
+    @staticmethod
+    def is_intellij_install_required(
+        ctx: Context, conn: Connection, architecture: str, version: str = None
+    ) -> bool:
+        task_configs = ctx.distro.get_task_configs("install-intellij")
+        version = version if version is not None else task_configs["version"]
+
+        # Each IntelliJ distribution includes a product-info.json file at the root of the unpacked
+        # directory that includes the version of the distribution.
+        r = conn.run(f"cat {Java.INTELLIJ_PRODUCT_INFO_PATH}", warn=True)
+        if r.failed:
+            return True
+        try:
+            product_info = json.loads(r.stdout)
+        except json.JSONDecodeError:
+            return True
+        return product_info.get("version") != str(version)
+
+    @staticmethod
+    def is_maven_install_required(
+        ctx: Context, conn: Connection, architecture: str, version: str = None
+    ) -> bool:
+        if version is None:
+            version = ctx.distro.get_task_configs("install-maven")["version"]
+        return not Java.is_symlinked_install_current(
+            conn,
+            symlink_path=Java.MAVEN_SYMLINK_PATH,
+            target_dir=f"/usr/local/apache-maven-{version}",
+        )
+
+    @staticmethod
+    def is_symlinked_install_current(conn: Connection, symlink_path: str, target_dir: str) -> bool:
+        # readlink -e will fail if any component of the path, including the target, does not exist.
+        r = conn.run(f"readlink -e {symlink_path}", warn=True)
+        if r.failed:
+            return False
+        return r.stdout.strip() == target_dir
+
     @staticmethod
     def _install_java_adoptium_eclipse_temurin(
         ctx: Context, conn: Connection, version: int
@@ -291,21 +353,24 @@ Add the following to your .bashrc and then add $MAVEN_HOME/bin' to your path
         gz_file_name = Template(Java.MAVEN_DOWNLOAD_FILE_FMT).substitute(version=version)
 
         gz_file_url = f"{base_url}/{gz_file_name}"
-        shasum_file_url = f"{base_url}/{gz_file_name}.sha512"
         gz_downloaded_file_path = os.path.join(temp_dir.name, gz_file_name)
+        mirror_urls = [
+            f"{Template(url_fmt).substitute(version=version)}/{gz_file_name}"
+            for url_fmt in task_configs.get("mirror_url_templates", Java.MAVEN_MIRROR_URL_FMTS)
+        ]
+
+        # The checksum always comes from the ASF archive, whichever mirror the tarball comes from.
+        shasum_file_url = f"{base_url}/{gz_file_name}.sha512"
+        r = configs.get_http_session().get(shasum_file_url)
+        shasum = r.content.strip().decode("utf-8")
         Utils.download_file(
             configs=configs,
             url=gz_file_url,
             target_local_path=gz_downloaded_file_path,
+            checksum=shasum,
+            hash_algo=HashAlgo.SHA512SUM,
+            mirror_urls=[url for url in mirror_urls if url != gz_file_url],
         )
-        r = requests.get(shasum_file_url, verify=ctx.distro.configs.is_request_verify())
-        shasum = r.content.strip().decode("utf-8")
-        if not Utils.file_checksum(
-            file_path=gz_downloaded_file_path, checksum=shasum, hash_algo=HashAlgo.SHA512SUM
-        ):
-            retval["errors"] = [
-                f"Downloaded file checksum does not match; gz_download_path={gz_downloaded_file_path}, shasum={shasum}"
-            ]
         retval[Java.MAVEN_DEPENDENCY_TARBALL_PATH] = gz_downloaded_file_path
 
         if managed_temp_dir:
@@ -1,9 +1,8 @@
 import os
-import requests
 from fabric import Connection
 from invoke import Context
 from tempfile import TemporaryDirectory
-from pydeploy.utils import  HashAlgo, ArchiveType, Utils
+from pydeploy.utils import HashAlgo, ArchiveType, Utils
 
 
 class Kubernetes(object):
@@ -15,38 +14,31 @@ class Kubernetes(object):
         task_configs = ctx.distro.get_task_configs("install-helm")
 
         # For each of the architectures download the required tarball
-        retval_architectures = {}
-        for architecture in architectures:
+        def get_arch_artifacts(architecture: str) -> dict:
             tarball_file_name = f"helm-v{task_configs['version']}-linux-{architecture}.tar.gz"
             tarball_url = f"{task_configs['base_url']}/{tarball_file_name}"
             tarball_local_file_path = os.path.join(temp_dir.name, tarball_file_name)
+            shasum_file_name = f"{tarball_file_name}.sha256sum"
+            r = configs.get_http_session().get(f"{task_configs['base_url']}/{shasum_file_name}")
+            shasum = r.text.split()[0]
             Utils.download_file(
                 configs=ctx.distro.configs,
                 url=tarball_url,
                 target_local_path=tarball_local_file_path,
+                checksum=shasum,
+                hash_algo=HashAlgo.SHA256SUM,
             )
 
-            shasum_file_name = f"{tarball_file_name}.sha256sum"
-            r = requests.get(
-                f"{task_configs['base_url']}/{shasum_file_name}",
-                verify=configs.is_request_verify(),
-            )
-            shasum = r.text.split()[0]
-            if not Utils.file_checksum(
-                file_path=tarball_local_file_path, checksum=shasum, hash_algo=HashAlgo.SHA256SUM
-            ):
-                raise Exception(
-                    f"Checksum for helm tarball did not match expected checksum; "
-                    f"file_path={tarball_local_file_path}, check_sum={shasum}, "
-                    f"hash_algo={HashAlgo.SHA256SUM}"
-                )
-
-            arch_artifacts = {
+            return {
                 "filename": tarball_file_name,
                 "local_file_path": tarball_local_file_path,
             }
-            retval_architectures[architecture] = arch_artifacts
 
+        # The architectures are fetched concurrently.
+        architectures = sorted(architectures)
+        retval_architectures = dict(
+            zip(architectures, Utils.map_concurrently(get_arch_artifacts, architectures))
+        )
         return {"architectures": retval_architectures}
 
     @staticmethod
@@ -73,3 +65,10 @@ class Kubernetes(object):
         conn.run(f"chown root: {target_binary_path}")
         conn.run(f"rm -rf {unpacked_dir_path} {tarball_remote_file_path}")
 
+    @staticmethod
+    def is_helm_install_required(ctx: Context, conn: Connection, architecture: str) -> bool:
+        task_configs = ctx.distro.get_task_configs("install-helm")
+        r = conn.run("helm version --template '{{.Version}}'", warn=True)
+        if r.failed:
+            return True
+        return r.stdout.strip() != f"v{task_configs['version']}"
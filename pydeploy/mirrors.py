@@ -0,0 +1,99 @@
+import logging
+import requests
+import sys
+import threading
+import time
+from pydeploy.utils import Utils
+
+logging.basicConfig(
+    format="%(asctime)s,%(levelname)s,%(module)s,%(message)s",
+    level=logging.INFO,
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+class Mirrors(object):
+    """
+    Orders the mirrors from which the same artifact can be downloaded, fastest first.
+
+    The first PROBE_BYTES of the artifact are requested from all of the mirrors at once.  The
+    mirrors are ordered by the time each took to respond, and the mirrors that failed are put last
+    in their original order.  The downloader tries them in that order and falls back to the next
+    one when a download fails.  The order is computed once per run for each set of mirrors, and the
+    chosen mirror is recorded in the state db.
+
+    Mirrors are only used for the artifact itself.  Its checksum must still come from a trusted
+    source.
+    """
+
+    PROBE_BYTES = 1024
+    PROBE_TIMEOUT_SEC = 5
+
+    def __init__(self, configs, state=None) -> None:
+        # We cannot include the type-hint for the configs parameter because it would otherwise cause
+        # a circular import.
+        self.configs = configs
+        self.state = state
+
+        # Dict of the tuple of the urls of the mirrors to the list of the urls, fastest first.
+        self.ordered_urls = {}
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def get_lock(self, key: tuple) -> threading.Lock:
+        with self.locks_lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+    def get_ordered_urls(self, urls: list[str]) -> list[str]:
+        """
+        Returns the urls of the same artifact on each of its mirrors, fastest first.  The first of
+        the urls is the one by which the artifact is known.
+        """
+        key = tuple(urls)
+        with self.get_lock(key):
+            if key not in self.ordered_urls:
+                self.ordered_urls[key] = self.race(urls)
+            return self.ordered_urls[key]
+
+    def probe(self, url: str) -> float:
+        """
+        Returns the number of seconds the mirror took to return the first PROBE_BYTES of the
+        artifact at the url, or None if it failed to.
+        """
+        headers = {"Range": f"bytes=0-{Mirrors.PROBE_BYTES - 1}"}
+        started_at = time.monotonic()
+        try:
+            with self.configs.get_http_session().get(
+                url, headers=headers, stream=True, timeout=Mirrors.PROBE_TIMEOUT_SEC
+            ) as r:
+                if r.status_code not in (200, 206):
+                    logger.info(f"Mirror probe failed; url={url}, status_code={r.status_code}")
+                    return None
+                # Mirrors that ignore the range still only have the first bytes read.
+                next(r.iter_content(chunk_size=Mirrors.PROBE_BYTES), b"")
+        except requests.RequestException as e:
+            logger.info(f"Mirror probe failed; url={url}, error={e}")
+            return None
+        return time.monotonic() - started_at
+
+    def race(self, urls: list[str]) -> list[str]:
+        probe_secs = Utils.map_concurrently(self.probe, urls, max_workers=len(urls))
+        reachable = sorted(
+            (probe_sec, i) for i, probe_sec in enumerate(probe_secs) if probe_sec is not None
+        )
+        ordered_urls = [urls[i] for _, i in reachable] + [
+            url for url, probe_sec in zip(urls, probe_secs) if probe_sec is None
+        ]
+        if reachable:
+            probe_sec = round(reachable[0][0], 3)
+            logger.info(
+                f"Chose mirror; url={urls[0]}, mirror_url={ordered_urls[0]}, probe_sec={probe_sec}"
+            )
+            if self.state is not None:
+                self.state.save_mirror_choice(urls[0], ordered_urls[0], probe_sec)
+        else:
+            logger.warning(f"No mirror responded to the probe; urls={urls}")
+        return ordered_urls
@@ -0,0 +1,154 @@
+import logging
+import sys
+from pydeploy.configs import Configs
+from pydeploy.distributions.distribution import Distribution
+from pydeploy.utils import Utils
+
+logging.basicConfig(
+    format="%(asctime)s,%(levelname)s,%(module)s,%(message)s",
+    level=logging.INFO,
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+class PackageBatch(object):
+    """
+    Installs the packages of all of the tasks selected in a multi-task run with a single package
+    index update and a single install transaction per host, before any of the tasks run.
+
+    Each task is batched with the inputs that it is skipped by, see Distribution.get_task_input_hash,
+    from the values of its arguments.  On each host only the tasks that the host is not skipped for
+    are batched, unless run with --force, and the hosts are batched concurrently.
+
+    The repos of the tasks are added first.  The tasks themselves still install their own packages
+    afterwards, which is a no-op for the packages installed by the batch.  If the batched install
+    fails on a host the failure is recorded for the host as the package-batch task and the tasks
+    install their packages individually, so that the failure is attributed to the task to which
+    the failing package belongs.
+    """
+
+    TASK = "package-batch"
+
+    @staticmethod
+    def apply(
+        distro: Distribution, configs: Configs, state, task_inputs: dict[str, dict]
+    ) -> list[str]:
+        """
+        Batches the packages of the tasks on each of the hosts, and returns the hosts on which the
+        batched install failed.  The task_inputs is the dict of each of the tasks to its inputs.
+        """
+        task_packages = PackageBatch.get_task_packages(configs, list(task_inputs))
+        if len(task_packages) < 2:
+            return []
+
+        host_task_packages = {}
+        for host in configs.connections:
+            pending_task_packages = PackageBatch.get_pending_task_packages(
+                distro, configs, state, host, task_packages, task_inputs
+            )
+            if len(pending_task_packages) >= 2:
+                host_task_packages[host] = pending_task_packages
+        if not host_task_packages:
+            return []
+
+        def apply_host(host: str) -> bool:
+            try:
+                with state.record(host, PackageBatch.TASK):
+                    PackageBatch.apply_host(
+                        distro, configs, configs.connections[host], host_task_packages[host]
+                    )
+            except Exception as e:
+                logger.error(
+                    "Batched package install failed, packages will be installed by each task; "
+                    f"host={host}, e={e}"
+                )
+                return False
+            return True
+
+        logger.info(
+            f"Installing the packages of tasks in one batch; tasks={list(task_packages)}, "
+            f"hosts={len(host_task_packages)}"
+        )
+        hosts = list(host_task_packages)
+        succeeded = Utils.map_concurrently(
+            apply_host, hosts, max_workers=Distribution.PACKAGE_MANAGER_MAX_WORKERS
+        )
+        failed_hosts = [host for host, success in zip(hosts, succeeded) if not success]
+        if failed_hosts:
+            logger.error(f"Batched package install failed; failed_hosts={failed_hosts}")
+        return failed_hosts
+
+    @staticmethod
+    def apply_host(
+        distro: Distribution, configs: Configs, conn, task_packages: dict[str, list[str]]
+    ) -> None:
+        # Tasks whose packages are all installed are left out, as are tasks whose repo could not
+        # be added; those will fail when they are run.
+        packages = []
+        versions = {}
+        unsafe_io = False
+        for task, packages_of_task in task_packages.items():
+            task_configs = configs.configs[task]
+            task_versions = task_configs.get("package_versions") or {}
+            if not distro.get_pending_packages(conn, packages_of_task, task_versions):
+                continue
+            if "repo_file_template" in task_configs:
+                try:
+                    distro.add_repo(configs=configs, conn=conn, task=task, update_packages=False)
+                except Exception as e:
+                    logger.warning(f"Unable to add repo; host={conn.host}, task={task}, e={e}")
+                    continue
+            packages.extend(p for p in packages_of_task if p not in packages)
+            versions.update(task_versions)
+            unsafe_io = unsafe_io or bool(task_configs.get("unsafe_package_io"))
+
+        if packages:
+            distro.install_package(
+                conn=conn, packages=packages, versions=versions, unsafe_io=unsafe_io
+            )
+
+    @staticmethod
+    def get_pending_task_packages(
+        distro: Distribution,
+        configs: Configs,
+        state,
+        host: str,
+        task_packages: dict,
+        task_inputs: dict[str, dict],
+    ) -> dict[str, list[str]]:
+        """
+        Returns the dict of task to packages of only those of the tasks that will be applied to
+        the host; the same tasks that WorkstationSetup.get_hosts_to_apply returns the host for.
+        """
+        if configs.force:
+            return dict(task_packages)
+        return {
+            task: packages
+            for task, packages in task_packages.items()
+            if not state.is_applied(
+                host, task, distro.get_task_input_hash(task, task_inputs.get(task))
+            )
+        }
+
+    @staticmethod
+    def get_task_packages(configs: Configs, tasks: list[str]) -> dict[str, list[str]]:
+        """
+        Returns the dict of task to the list of packages defined in its task configs for each of
+        the tasks that has a fixed set of packages.  Tasks whose packages are templates hydrated
+        with task arguments, for example the java version, are excluded.
+        """
+        retval = {}
+        for task in tasks:
+            task_configs = configs.configs.get(task)
+            if type(task_configs) is not dict:
+                continue
+            packages = task_configs.get("packages", task_configs.get("package"))
+            if packages is None:
+                continue
+            if type(packages) != list:
+                packages = [packages]
+            if any("$" in str(p) for p in packages):
+                continue
+            retval[task] = [str(p) for p in packages]
+        return retval
@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from fabric import Connection
+from pydeploy.configs import Configs
+from pydeploy.state import StateDb
+from pydeploy.utils import HashAlgo, Utils
+
+logging.basicConfig(
+    format="%(asctime)s,%(levelname)s,%(module)s,%(message)s",
+    level=logging.INFO,
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+class PackageClosure(object):
+    """
+    Installs packages on hosts without the package manager of the host touching the network.
+
+    The full dependency closure of a set of packages is resolved once per run for each distro
+    release and architecture, against the freshly updated package index of the first host of that
+    release and architecture that requires it and as if none of its packages were installed.  A
+    closure resolved by a previous run is only reused within package_index_max_age_sec, so that
+    later runs pick up the updates published since.  The package files are downloaded once by the
+    deployment server, verified against the checksums from the package index, and kept in the
+    local closures dir.
+
+    Each host is pushed only the package files of the packages that it does not have installed, or
+    has installed at an older version, which are installed with install_local_package.  A package
+    that the host has installed at a newer version is never downgraded.
+    """
+
+    CLOSURES_DIR_DEFAULT = os.path.join(os.path.expanduser("~"), ".pydeploy", "package-closures")
+    REMOTE_DIR = "/var/cache/pydeploy/packages"
+
+    def __init__(self, configs: Configs, distro, closures_dir: str = CLOSURES_DIR_DEFAULT) -> None:
+        self.configs = configs
+        self.distro = distro
+        self.closures_dir = closures_dir
+
+        # Dict of manifest path to the closure resolved, or loaded, in this run.
+        self.closures = {}
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def get_closure(self, conn: Connection, packages: list[str], release_dir: str) -> list[dict]:
+        """
+        Returns the list of the package file dicts, see Distribution.parse_package_uris, of the
+        closure of the packages, downloading any package files that are not already in the
+        release_dir for the release and the architecture of the host.
+        """
+        manifest_path = os.path.join(release_dir, f"{StateDb.config_hash(sorted(packages))}.json")
+        # Hosts of the same release and architecture that are installed concurrently wait for the
+        # first of them to resolve the closure and download the package files that they share.
+        with self.get_lock(release_dir):
+            if manifest_path not in self.closures:
+                closure = self.load_closure(manifest_path)
+                if closure is None:
+                    closure = self.resolve_closure(conn, packages, release_dir, manifest_path)
+                self.closures[manifest_path] = closure
+            return self.closures[manifest_path]
+
+    def get_lock(self, key: str) -> threading.Lock:
+        with self.locks_lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+    def get_release_dir(self, conn: Connection) -> str:
+        facts = self.distro.host_classes.get_host_facts(conn)
+        return os.path.join(self.closures_dir, f"{facts['release']}-{facts['architecture']}")
+
+    def get_pending_package_files(self, conn: Connection, closure: list[dict]) -> list[dict]:
+        """
+        Returns the package files of the closure that are to be installed on the host: those of
+        the packages that are not installed, or are installed at an older version.
+        """
+        installed_packages = self.distro.get_installed_packages(conn)
+        retval = []
+        for package_file in closure:
+            package = package_file["package"]
+            if package not in installed_packages:
+                retval.append(package_file)
+                continue
+            # The version of a package installed during the run without a pin is not known.
+            installed_version = installed_packages[package]
+            if installed_version is None:
+                continue
+            comparison = self.distro.compare_package_versions(
+                installed_version, package_file["version"]
+            )
+            if comparison < 0:
+                logger.info(
+                    f"Upgrading installed package to the closure version; host={conn.host}, "
+                    f"package={package}, installed_version={installed_version}, "
+                    f"version={package_file['version']}"
+                )
+                retval.append(package_file)
+            elif comparison > 0:
+                logger.info(
+                    f"Installed package is newer than the closure version, not downgrading; "
+                    f"host={conn.host}, package={package}, "
+                    f"installed_version={installed_version}, version={package_file['version']}"
+                )
+        return retval
+
+    def install(self, conn: Connection, packages: list[str], unsafe_io: bool = False) -> None:
+        release_dir = self.get_release_dir(conn)
+        installed_packages = self.distro.get_installed_packages(conn)
+        package_files = self.get_pending_package_files(
+            conn, self.get_closure(conn, packages, release_dir)
+        )
+        if not package_files:
+            return
+
+        conn.run(f"mkdir -p {PackageClosure.REMOTE_DIR}")
+        remote_paths = []
+        for package_file in package_files:
+            remote_path = os.path.join(PackageClosure.REMOTE_DIR, package_file["file_name"])
+            conn.put(os.path.join(release_dir, package_file["file_name"]), remote_path)
+            remote_paths.append(remote_path)
+        self.distro.install_local_package(conn, remote_paths, unsafe_io)
+        conn.run(f"rm -f {' '.join(remote_paths)}")
+
+        installed_packages.update({p["package"]: p["version"] for p in package_files})
+
+    def load_closure(self, manifest_path: str) -> list[dict]:
+        """
+        Returns the closure in the manifest resolved by a previous run, or None if there is none
+        that was resolved within package_index_max_age_sec.
+        """
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        # Manifests written before the resolution time was recorded are always stale.
+        if type(manifest) is not dict:
+            return None
+        if time.time() - manifest["resolved_at"] > self.configs.package_index_max_age_sec:
+            return None
+        return manifest["package_files"]
+
+    def resolve_closure(
+        self, conn: Connection, packages: list[str], release_dir: str, manifest_path: str
+    ) -> list[dict]:
+        logger.info(f"Resolving package closure; host={conn.host}, packages={packages}")
+        self.distro.update_packages(conn)
+        r = conn.run(self.distro.get_package_uris_cmd(" ".join(packages)), hide=True)
+        closure = self.distro.parse_package_uris(r.stdout)
+
+        os.makedirs(release_dir, exist_ok=True)
+        for package_file in closure:
+            local_path = os.path.join(release_dir, package_file["file_name"])
+            if os.path.exists(local_path):
+                continue
+            # When planning, the size of each package file is known from the package index, and
+            # nothing is written to the closures dir.
+            if self.configs.plan is not None:
+                self.configs.plan.add_download(
+                    package_file["url"], local_path, package_file["size"]
+                )
+                continue
+            temp_path = f"{local_path}.part"
+            Utils.download_file(
+                self.configs,
+                package_file["url"],
+                temp_path,
+                checksum=package_file["checksum"],
+                hash_algo=HashAlgo[package_file["hash_algo"]],
+            )
+            os.replace(temp_path, local_path)
+
+        if self.configs.plan is None:
+            with open(manifest_path, "w") as f:
+                json.dump(dict(resolved_at=time.time(), package_files=closure), f)
+        return closure
@@ -0,0 +1,218 @@
+import logging
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+from invoke.runners import Result
+from pydeploy.enums import PackageCommand
+from pydeploy.state import StateDb, TaskStatus
+
+logging.basicConfig(
+    format="%(asctime)s,%(levelname)s,%(module)s,%(message)s",
+    level=logging.INFO,
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+class PlanConnection(object):
+    """
+    Stand-in for a fabric Connection that records the commands and file transfers that a task
+    would perform on the host instead of executing them.
+
+    Commands that match one of the responders return the stdout generated by the responder.  Any
+    other command run with warn=True is treated as a probe of the host, the result of which cannot
+    be known without contacting it, and fails; which the tasks interpret as "not installed".  All
+    remaining commands succeed with empty output.
+    """
+
+    def __init__(self, host: str, responders: list = None, download_sizes: dict = None) -> None:
+        self.host = host
+        self.responders = responders or []
+
+        # Dict of the local path of each planned download, which is not actually downloaded, to
+        # the size of the file.
+        self.download_sizes = download_sizes if download_sizes is not None else {}
+        self.task = None
+        self.records = {}
+
+    def _get_record(self) -> dict:
+        if self.task not in self.records:
+            self.records[self.task] = Plan.create_task_record()
+        return self.records[self.task]
+
+    def add_packages(self, package_command: PackageCommand, packages: list[str]) -> None:
+        self._get_record()["packages"][package_command.name.lower()].extend(packages)
+
+    def put(self, local, remote=None, **kwargs) -> None:
+        if hasattr(local, "getvalue"):
+            local_path = None
+            size = len(local.getvalue())
+        else:
+            local_path = local
+            size = self.download_sizes.get(local)
+            if size is None:
+                size = os.path.getsize(local)
+        self._get_record()["puts"].append(
+            dict(local_path=local_path, remote_path=remote, bytes=size)
+        )
+
+    def run(self, command: str, warn: bool = False, **kwargs) -> Result:
+        self._get_record()["commands"].append(command)
+        for pattern, responder in self.responders:
+            match = re.search(pattern, command)
+            if match:
+                return Result(stdout=responder(match), command=command, exited=0)
+        return Result(command=command, exited=1 if warn else 0)
+
+    def sudo(self, command: str, user: str = None, **kwargs) -> Result:
+        prefix = f"sudo -u {user} " if user else "sudo "
+        return self.run(f"{prefix}{command}", **kwargs)
+
+
+class Plan(object):
+    """
+    Dry-run of a set of tasks against the facts about each host cached in the state db.
+
+    A Plan replaces the StateDb in the task namespace for the duration of a --plan run.  Reads are
+    delegated to the state db while every write is discarded, so that neither the hosts nor the
+    state db are modified.  The commands, file transfers and packages of each task on each host are
+    collected from the PlanConnection instances that replace the fabric connections.
+    """
+
+    UNKNOWN_DIR_NAME = "pydeploy-plan-unknown"
+
+    def __init__(self, state: StateDb, distro, hosts: list[str]) -> None:
+        self.state = state
+        self.started_at = time.time()
+        self.downloads = []
+        self.download_sizes = {}
+        self.mirror_choices = []
+        self.errors = {}
+        self.skipped = {}
+        self.connections = {}
+        for host in hosts:
+            facts = state.get_host_facts(host)
+            if "architecture" not in facts or "release" not in facts:
+                self.errors[host] = "No cached facts for host; run the drift task to cache them"
+                continue
+            self.connections[host] = PlanConnection(
+                host, Plan.get_responders(distro, facts), self.download_sizes
+            )
+
+    def __getattr__(self, name: str):
+        # Delegate all of the read-only queries to the state db.
+        return getattr(self.state, name)
+
+    def add_download(self, url: str, local_path: str, size: int = None) -> None:
+        """
+        Records the download of the file at the url to the local_path.  The size is provided for
+        the files that are not actually downloaded, see Utils.plan_download.
+        """
+        if size is None:
+            size = os.path.getsize(local_path)
+        else:
+            self.download_sizes[local_path] = size
+        self.downloads.append(dict(url=url, bytes=size))
+
+    @staticmethod
+    def create_task_record() -> dict:
+        return dict(
+            commands=[],
+            puts=[],
+            packages={
+                PackageCommand.INSTALL.name.lower(): [],
+                PackageCommand.REMOVE.name.lower(): [],
+            },
+        )
+
+    def get_report(self) -> dict:
+        hosts = {}
+        total_estimated_duration_sec = 0.0
+        for host, conn in self.connections.items():
+            tasks = {}
+            for task, task_record in conn.records.items():
+                if task is None:
+                    continue
+                estimated_duration_sec = self.state.get_mean_duration(task, host)
+                if estimated_duration_sec is not None:
+                    total_estimated_duration_sec += estimated_duration_sec
+                tasks[task] = dict(task_record, estimated_duration_sec=estimated_duration_sec)
+            for task in self.skipped.get(host, []):
+                tasks[task] = dict(status=TaskStatus.SKIPPED)
+
+            # Commands that were run outside of any task are the probes used to select the hosts
+            # to which each task is applied.
+            probes = conn.records.get(None, Plan.create_task_record())["commands"]
+            hosts[host] = dict(
+                probes=probes,
+                tasks=tasks,
+                push_bytes=sum(
+                    put["bytes"]
+                    for task_record in tasks.values()
+                    for put in task_record.get("puts", [])
+                ),
+                estimated_duration_sec=sum(
+                    t.get("estimated_duration_sec") or 0.0 for t in tasks.values()
+                ),
+            )
+        for host, error in self.errors.items():
+            hosts[host] = dict(error=error)
+
+        return {
+            "generated_at": int(self.started_at),
+            "downloads": self.downloads,
+            "download_bytes": sum(d["bytes"] for d in self.downloads),
+            "mirrors": self.mirror_choices,
+            "estimated_duration_sec": round(total_estimated_duration_sec, 3),
+            "hosts": dict(sorted(hosts.items())),
+        }
+
+    @staticmethod
+    def get_responders(distro, facts: dict) -> list:
+        """
+        Returns the list of (regex, responder) tuples that answer the commands, whose output the
+        tasks depend on, from the cached facts or with the output of a successful execution.
+        """
+        return [
+            (f"^{re.escape(distro.get_architecture_cmd())}$", lambda m: facts["architecture"]),
+            (f"^{re.escape(distro.get_release_cmd())}$", lambda m: facts["release"]),
+            (r"^tar -t\S* ", lambda m: f"{Plan.UNKNOWN_DIR_NAME}/\n"),
+            (r"^apt-get update ", lambda m: ""),
+            (r"^debsig-verify ", lambda m: ""),
+            (r"^dpkg-sig --verify ", lambda m: "GOODSIG"),
+            (r"\| grep -i (\S+)$", lambda m: m.group(1)),
+        ]
+
+    @contextmanager
+    def record(self, host: str, task: str, **kwargs):
+        """
+        Attributes the operations on the host in the wrapped block to the task.  Errors are
+        recorded in the plan for the host and task instead of being raised.
+        """
+        conn = self.connections[host]
+        conn.task = task
+        try:
+            yield
+        except Exception as e:
+            logger.warning(f"Unable to plan task; host={host}, task={task}, e={e}")
+            conn._get_record()["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            conn.task = None
+
+    def save_host_facts(self, host: str, facts: dict) -> None:
+        pass
+
+    def save_mirror_choice(self, url: str, mirror_url: str, probe_sec: float) -> None:
+        self.mirror_choices.append(dict(url=url, mirror_url=mirror_url, probe_sec=probe_sec))
+
+    def save_task_result(self, host: str, task: str, status: str, *args, **kwargs) -> None:
+        if status == TaskStatus.SKIPPED:
+            self.skipped.setdefault(host, []).append(task)
+
+    def save_tool_version(self, host: str, tool: str, version: str) -> None:
+        pass
+
+    def start_run(self, argv: list[str] = None) -> None:
+        pass
@@ -1,18 +1,37 @@
+import json
+import sys
+from contextlib import nullcontext, redirect_stdout
 from invoke import Argument, Program
+from pydeploy.artifact_cache import ArtifactCache
+from pydeploy.state import StateDb
+from pydeploy.utils import Utils
+from pydeploy.version_index import VersionIndex
 
 
 class PyDeployProgram(Program):
 
+    ARG_APT_PROXY = "apt-proxy"
+    ARG_ARTIFACT_CACHE_MAX_MB = "artifact-cache-max-mb"
     ARG_PYDEPLOY_CONFIG_PATH_LONG = "pydeploy-config-dir"
     ARG_CONFIG_PATH_LONG = "config-path"
     ARG_CONFIG_PATH_SHORT = "c"
+    ARG_FORCE = "force"
+    ARG_GITHUB_TOKEN = "github-token"
     ARG_HOSTS = "hosts"
+    ARG_HTTP_PROXY = "http-proxy"
+    ARG_HTTP_TIMEOUT_SEC = "http-timeout-sec"
+    ARG_OFFLINE_PACKAGES = "offline-packages"
+    ARG_PACKAGE_INDEX_MAX_AGE_SEC = "package-index-max-age-sec"
+    ARG_PLAN = "plan"
     ARG_HOSTS_CONNECTION_USER_LONG = "hosts-connection-user"
     ARG_HOSTS_CONNECTION_USER_SHORT = "u"
     ARG_REQUESTS_DISABLE_WARNINGS_LONG = "requests-disable-warnings"
     ARG_REQUESTS_DISABLE_WARNINGS_SHORT = "r"
     ARG_SSH_PORT = "ssh-port"
     ARG_SSH_IDENTITY_FILE = "ssh-identity-file"
+    ARG_STATE_DB_PATH = "state-db-path"
+    ARG_UNSAFE_PACKAGE_IO = "unsafe-package-io"
+    ARG_VERSION_INDEX_MAX_AGE_SEC = "version-index-max-age-sec"
 
     def __init__(
         self,
@@ -36,9 +55,30 @@ class PyDeployProgram(Program):
             binary_names=binary_names,
         )
 
+        # Set by Tasks.load_configs when run with --plan
+        self.plan = None
+
+        # Callables, registered by Tasks.load_configs, that are called once all of the tasks have
+        # run, whether or not they succeeded, in the reverse order of their registration.
+        self.finalizers = []
+
     def core_args(self):
         core_args = super(PyDeployProgram, self).core_args()
         extra_args = [
+            Argument(
+                name=PyDeployProgram.ARG_APT_PROXY,
+                help="HOST:PORT at which the hosts can reach this deployment server.  If provided, a caching apt proxy is served on HOST:PORT for the duration of the run and the hosts are configured to download packages from http sources through it, default=None",
+                kind=str,
+                default=None,
+                optional=True,
+            ),
+            Argument(
+                name=PyDeployProgram.ARG_ARTIFACT_CACHE_MAX_MB,
+                help=f"The size, in MB, above which the least recently used artifacts are evicted from the cache of downloaded artifacts in {ArtifactCache.CACHE_DIR_DEFAULT}.  0 disables the cache, default=10240",
+                kind=int,
+                default=10240,
+                optional=True,
+            ),
             Argument(
                 name=PyDeployProgram.ARG_PYDEPLOY_CONFIG_PATH_LONG,
                 help="Fully qualified path to the PyDeploy base config directory. You should clone this directory prior to running these tasks.",
@@ -52,12 +92,40 @@ class PyDeployProgram(Program):
                 help="Fully qualified path to the PyDeploy config yaml file",
                 optional=False,
             ),
+            Argument(
+                name=PyDeployProgram.ARG_FORCE,
+                help="Apply the task(s) to all hosts, even those for which the inputs of the task have not changed since it was last successfully applied, default=False",
+                kind=bool,
+                default=False,
+                optional=True,
+            ),
+            Argument(
+                name=PyDeployProgram.ARG_GITHUB_TOKEN,
+                help="The token with which to authenticate the requests to the GitHub API, for its higher rate limit.  If not provided, the GITHUB_TOKEN environment variable is used, if set, default=None",
+                kind=str,
+                default=None,
+                optional=True,
+            ),
             Argument(
                 name=PyDeployProgram.ARG_HOSTS,
                 help="CSV of host names against which to run the specified task",
                 kind=str,
                 optional=True,
             ),
+            Argument(
+                name=PyDeployProgram.ARG_HTTP_PROXY,
+                help="URL of the proxy through which this deployment server makes its outbound HTTP(S) requests.  If not provided, the HTTP_PROXY and HTTPS_PROXY environment variables are honored, default=None",
+                kind=str,
+                default=None,
+                optional=True,
+            ),
+            Argument(
+                name=PyDeployProgram.ARG_HTTP_TIMEOUT_SEC,
+                help="The timeout, in seconds, for connecting to a server and for each read from it, of the outbound HTTP(S) requests of this deployment server, default=30",
+                kind=int,
+                default=30,
+                optional=True,
+            ),
             Argument(
                 names=(
                     PyDeployProgram.ARG_HOSTS_CONNECTION_USER_LONG,
@@ -68,6 +136,27 @@ class PyDeployProgram(Program):
                 optional=True,
                 default="root",
             ),
+            Argument(
+                name=PyDeployProgram.ARG_OFFLINE_PACKAGES,
+                help="Resolve the full dependency closure of the packages once per distro release and architecture, download and verify the package files on this deployment server, and install them on the hosts from the pushed files so that the package manager of the hosts never touches the network, default=False",
+                kind=bool,
+                default=False,
+                optional=True,
+            ),
+            Argument(
+                name=PyDeployProgram.ARG_PACKAGE_INDEX_MAX_AGE_SEC,
+                help="The age, in seconds, below which a package index updated in a previous run, with the same package sources, is not updated again. The package index is never updated more than once in a run unless the package sources change, default=0",
+                kind=int,
+                default=0,
+                optional=True,
+            ),
+            Argument(
+                name=PyDeployProgram.ARG_PLAN,
+                help="Do not apply the task(s); instead print to stdout, with the logs on stderr, a json report of the commands, file transfers and packages that would be applied to each host, based on the host facts cached in the state db, and the estimated duration, default=False",
+                kind=bool,
+                default=False,
+                optional=True,
+            ),
             Argument(
                 names=(
                     PyDeployProgram.ARG_REQUESTS_DISABLE_WARNINGS_LONG,
@@ -92,5 +181,41 @@ class PyDeployProgram(Program):
                 default=None,
                 optional=True,
             ),
+            Argument(
+                name=PyDeployProgram.ARG_STATE_DB_PATH,
+                help=f"The path to the SQLite database in which the per-host results of each run are persisted, default={StateDb.DB_PATH_DEFAULT}",
+                kind=str,
+                default=StateDb.DB_PATH_DEFAULT,
+                optional=True,
+            ),
+            Argument(
+                name=PyDeployProgram.ARG_UNSAFE_PACKAGE_IO,
+                help="Install and remove packages without syncing each file to disk, followed by a single sync once each package transaction completes.  Trades crash safety for speed and is meant for the initial setup of hosts, default=False",
+                kind=bool,
+                default=False,
+                optional=True,
+            ),
+            Argument(
+                name=PyDeployProgram.ARG_VERSION_INDEX_MAX_AGE_SEC,
+                help=f"The age, in seconds, below which the index of the versions of a tool, such as gradle, built from its version manifest in ~/.pydeploy/version-indexes, is used without requesting the manifest again.  An older index is revalidated with a conditional request, default={VersionIndex.MAX_AGE_SEC_DEFAULT}",
+                kind=int,
+                default=VersionIndex.MAX_AGE_SEC_DEFAULT,
+                optional=True,
+            ),
         ]
         return core_args + extra_args
+
+    def execute(self):
+        # When planning, the report is the only output on stdout so that it can be parsed; the logs
+        # and anything else that the tasks print go to stderr.
+        planning = self.core[0].args[PyDeployProgram.ARG_PLAN].value
+        if planning:
+            Utils.log_to_stderr()
+        try:
+            with redirect_stdout(sys.stderr) if planning else nullcontext():
+                super().execute()
+        finally:
+            for finalizer in reversed(self.finalizers):
+                finalizer()
+        if self.plan is not None:
+            print(json.dumps(self.plan.get_report(), indent=2))
@@ -0,0 +1,76 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import requests
+import sys
+from pydeploy.utils import Utils
+from tempfile import NamedTemporaryFile
+
+logging.basicConfig(
+    format="%(asctime)s,%(levelname)s,%(module)s,%(message)s",
+    level=logging.INFO,
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+class RepoKeyCache(object):
+    """
+    Persistent cache of the dearmored signing keys of the package repos.
+
+    Each key is stored, dearmored, with the validators of the response from which it was fetched
+    and is revalidated with a conditional request on its first use in a run, so that an unchanged
+    key is neither downloaded nor dearmored again while a rotated key is picked up.
+    """
+
+    CACHE_DIR_DEFAULT = os.path.join(os.path.expanduser("~"), ".pydeploy", "repo-keys")
+
+    def __init__(self, cache_dir: str = CACHE_DIR_DEFAULT) -> None:
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_cache_path(self, url: str) -> str:
+        return os.path.join(
+            self.cache_dir, f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+        )
+
+    def get_key(self, session: requests.Session, url: str) -> bytes:
+        stored = self.load(url)
+        headers = {}
+        if stored is not None:
+            if stored.get("etag"):
+                headers["If-None-Match"] = stored["etag"]
+            if stored.get("last_modified"):
+                headers["If-Modified-Since"] = stored["last_modified"]
+        r = session.get(url=url, headers=headers)
+        if r.status_code == 304 and stored is not None:
+            logger.info(f"Repo key not modified; url={url}")
+            return base64.b64decode(stored["key"])
+        if not r.ok:
+            raise Exception(f"Unable to get repo key; url={url}, r={r}")
+
+        key_contents = Utils.dearmor_pgp_key(r.content)
+        self.store(url, r.headers.get("ETag"), r.headers.get("Last-Modified"), key_contents)
+        return key_contents
+
+    def load(self, url: str) -> dict:
+        cache_path = self.get_cache_path(url)
+        if not os.path.exists(cache_path):
+            return None
+        with open(cache_path, "r") as f:
+            return json.load(f)
+
+    def store(self, url: str, etag: str, last_modified: str, key_contents: bytes) -> None:
+        with NamedTemporaryFile("w", dir=self.cache_dir, delete=False) as f:
+            json.dump(
+                dict(
+                    url=url,
+                    etag=etag,
+                    last_modified=last_modified,
+                    key=base64.b64encode(key_contents).decode("ascii"),
+                ),
+                f,
+            )
+        os.replace(f.name, self.get_cache_path(url))
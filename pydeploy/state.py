@@ -0,0 +1,351 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+
+logging.basicConfig(
+    format="%(asctime)s,%(levelname)s,%(module)s,%(message)s",
+    level=logging.INFO,
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+class TaskStatus(object):
+    SUCCESS = "success"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+
+
+class StateDb(object):
+    """
+    Local SQLite database, on the deployment server, that persists the per-host results of each run
+    so that questions about the fleet can be answered without connecting to any of the hosts.
+
+    A new sqlite connection is opened for each operation so that an instance can be shared between
+    the threads that operate on different hosts.
+    """
+
+    DB_PATH_DEFAULT = os.path.join(os.path.expanduser("~"), ".pydeploy", "state.db")
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id TEXT PRIMARY KEY,
+            started_at REAL NOT NULL,
+            argv TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS task_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL,
+            host TEXT NOT NULL,
+            task TEXT NOT NULL,
+            status TEXT NOT NULL,
+            version TEXT,
+            config_hash TEXT,
+            input_hash TEXT,
+            inputs TEXT,
+            started_at REAL NOT NULL,
+            duration_sec REAL,
+            error TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS task_results_host_idx ON task_results (host, task)",
+        """
+        CREATE INDEX IF NOT EXISTS task_results_task_status_idx
+            ON task_results (task, status, started_at)
+        """,
+        "CREATE INDEX IF NOT EXISTS task_results_version_idx ON task_results (task, version)",
+        """
+        CREATE TABLE IF NOT EXISTS tool_versions (
+            host TEXT NOT NULL,
+            tool TEXT NOT NULL,
+            version TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (host, tool)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS tool_versions_version_idx ON tool_versions (tool, version)",
+        """
+        CREATE TABLE IF NOT EXISTS mirror_choices (
+            run_id TEXT NOT NULL,
+            url TEXT NOT NULL,
+            mirror_url TEXT NOT NULL,
+            probe_sec REAL,
+            chosen_at REAL NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS host_facts (
+            host TEXT NOT NULL,
+            fact TEXT NOT NULL,
+            value TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (host, fact)
+        )
+        """,
+    ]
+
+    def __init__(self, db_path: str = DB_PATH_DEFAULT) -> None:
+        self.db_path = db_path
+        self.run_id = str(uuid.uuid4())
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            for statement in StateDb.SCHEMA:
+                db.execute(statement)
+
+            # Add the input_hash and inputs columns to databases created before they were
+            # introduced.
+            columns = [row["name"] for row in db.execute("PRAGMA table_info(task_results)")]
+            for column in ["input_hash", "inputs"]:
+                if column not in columns:
+                    db.execute(f"ALTER TABLE task_results ADD COLUMN {column} TEXT")
+
+    @contextmanager
+    def _connect(self):
+        # Commits on success, rolls back on an exception, and always closes the connection.
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def config_hash(value) -> str:
+        """
+        Returns a stable sha256 hex digest of any json serializable value.
+        """
+        serialized = json.dumps(value, sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def get_failed_hosts(self, task: str, since_sec: float) -> list[str]:
+        """
+        Returns the hosts on which the task failed at, or after, the since_sec epoch timestamp.
+        """
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT DISTINCT host FROM task_results "
+                "WHERE task = ? AND status = ? AND started_at >= ? ORDER BY host",
+                (task, TaskStatus.FAILED, since_sec),
+            ).fetchall()
+        return [row["host"] for row in rows]
+
+    def get_mirror_choices(self, run_id: str = None) -> list[dict]:
+        """
+        Returns the mirrors chosen in the run, by default the current one, see save_mirror_choice.
+        """
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT url, mirror_url, probe_sec FROM mirror_choices "
+                "WHERE run_id = ? ORDER BY chosen_at",
+                (run_id if run_id is not None else self.run_id,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_host_facts(self, host: str) -> dict[str, str]:
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT fact, value FROM host_facts WHERE host = ?", (host,)
+            ).fetchall()
+        return {row["fact"]: row["value"] for row in rows}
+
+    def get_hosts_with_tool_version(self, tool: str, version: str) -> list[str]:
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT host FROM tool_versions WHERE tool = ? AND version = ? ORDER BY host",
+                (tool, str(version)),
+            ).fetchall()
+        return [row["host"] for row in rows]
+
+    def get_last_result(self, host: str, task: str, status: str = None) -> dict:
+        """
+        Returns the most recent task_results row for the host and task, optionally limited to the
+        provided status, as a dict or None if there is no such result.
+        """
+        query = "SELECT * FROM task_results WHERE host = ? AND task = ?"
+        params = [host, task]
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY started_at DESC, id DESC LIMIT 1"
+        with self._connect() as db:
+            row = db.execute(query, params).fetchone()
+        return dict(row) if row is not None else None
+
+    def get_mean_duration(self, task: str, host: str = None) -> float:
+        """
+        Returns the mean duration of the successful applications of the task to the host, falling
+        back to the mean across all hosts, or None if the task has never succeeded.
+        """
+        with self._connect() as db:
+            for query, params in [
+                (" AND host = ?", (task, TaskStatus.SUCCESS, host)),
+                ("", (task, TaskStatus.SUCCESS)),
+            ]:
+                if query and host is None:
+                    continue
+                row = db.execute(
+                    "SELECT AVG(duration_sec) AS mean_duration_sec FROM task_results "
+                    f"WHERE task = ? AND status = ?{query}",
+                    params,
+                ).fetchone()
+                if row["mean_duration_sec"] is not None:
+                    return row["mean_duration_sec"]
+        return None
+
+    def is_applied(self, host: str, task: str, input_hash: str) -> bool:
+        """
+        Returns True if the most recent, non-skipped, application of the task to the host succeeded
+        with the same input_hash.
+        """
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT status, input_hash FROM task_results "
+                "WHERE host = ? AND task = ? AND status != ? "
+                "ORDER BY started_at DESC, id DESC LIMIT 1",
+                (host, task, TaskStatus.SKIPPED),
+            ).fetchone()
+        return (
+            row is not None
+            and row["status"] == TaskStatus.SUCCESS
+            and row["input_hash"] == input_hash
+        )
+
+    @contextmanager
+    def record(
+        self,
+        host: str,
+        task: str,
+        version: str = None,
+        task_configs: dict = None,
+        input_hash: str = None,
+        inputs: dict = None,
+    ):
+        """
+        Context manager that times the wrapped block and persists its result for the host and
+        task, along with the inputs from which the input_hash was computed.  Exceptions are
+        recorded as failures and then re-raised.
+        """
+        started_at = time.time()
+        config_hash = StateDb.config_hash(task_configs) if task_configs is not None else None
+        try:
+            yield
+        except BaseException as e:
+            self.save_task_result(
+                host=host,
+                task=task,
+                status=TaskStatus.FAILED,
+                started_at=started_at,
+                duration_sec=time.time() - started_at,
+                version=version,
+                config_hash=config_hash,
+                input_hash=input_hash,
+                inputs=inputs,
+                error=f"{type(e).__name__}: {e}",
+            )
+            raise
+        self.save_task_result(
+            host=host,
+            task=task,
+            status=TaskStatus.SUCCESS,
+            started_at=started_at,
+            duration_sec=time.time() - started_at,
+            version=version,
+            config_hash=config_hash,
+            input_hash=input_hash,
+            inputs=inputs,
+        )
+
+    def start_run(self, argv: list[str] = None) -> None:
+        """
+        Records the start of a run, to which all subsequently saved task results are attributed.
+        """
+        argv = argv if argv is not None else sys.argv
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO runs (run_id, started_at, argv) VALUES (?, ?, ?)",
+                (self.run_id, time.time(), json.dumps(argv)),
+            )
+
+    def save_host_facts(self, host: str, facts: dict) -> None:
+        now = time.time()
+        with self._connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO host_facts (host, fact, value, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(host, fact, str(value), now) for fact, value in facts.items()],
+            )
+
+    def save_mirror_choice(self, url: str, mirror_url: str, probe_sec: float) -> None:
+        """
+        Records the mirror from which the artifact known by the url is downloaded in this run.
+        """
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO mirror_choices (run_id, url, mirror_url, probe_sec, chosen_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.run_id, url, mirror_url, probe_sec, time.time()),
+            )
+
+    def save_task_result(
+        self,
+        host: str,
+        task: str,
+        status: str,
+        started_at: float,
+        duration_sec: float = None,
+        version: str = None,
+        config_hash: str = None,
+        input_hash: str = None,
+        inputs: dict = None,
+        error: str = None,
+    ) -> None:
+        version = str(version) if version is not None else None
+        inputs = json.dumps(inputs, sort_keys=True, default=str) if inputs is not None else None
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO task_results "
+                "(run_id, host, task, status, version, config_hash, input_hash, inputs, "
+                "started_at, duration_sec, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.run_id,
+                    host,
+                    task,
+                    status,
+                    version,
+                    config_hash,
+                    input_hash,
+                    inputs,
+                    started_at,
+                    duration_sec,
+                    error,
+                ),
+            )
+            if status == TaskStatus.SUCCESS and version is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO tool_versions (host, tool, version, updated_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (host, task, version, time.time()),
+                )
+
+    def save_tool_version(self, host: str, tool: str, version: str) -> None:
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO tool_versions (host, tool, version, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (host, tool, str(version) if version is not None else None, time.time()),
+            )
@@ -1,8 +1,22 @@
 import importlib
+import logging
+import os
 from invoke import task
 from invoke.parser import ParserContext
+from pydeploy.apt_proxy import AptProxy
+from pydeploy.artifact_cache import ArtifactCache
+from pydeploy.github_release_cache import GitHubReleaseCache
+from pydeploy.mirrors import Mirrors
 from pydeploy.program import PyDeployProgram
 from pydeploy.configs import Configs
+from pydeploy.package_batch import PackageBatch
+from pydeploy.package_closure import PackageClosure
+from pydeploy.plan import Plan
+from pydeploy.repo_key_cache import RepoKeyCache
+from pydeploy.state import StateDb
+from pydeploy.utils import Utils
+from pydeploy.version_index import VersionIndex
+from types import SimpleNamespace
 
 
 class Tasks(object):
@@ -10,19 +24,128 @@ class Tasks(object):
     PROGRAM = None
     NAMESPACE = None
 
+    # Dict of task name to the function that returns the inputs of the task, see
+    # Distribution.get_task_input_hash, given the context and the arguments of the task.  Only the
+    # tasks whose inputs are not simply their arguments register one, with Tasks.inputs.
+    TASK_INPUTS = {}
+
+    # Tasks that only read the hosts.  When only these are selected, load_configs leaves out the
+    # setup that modifies the hosts: the package manager preparation, the apt proxy and the
+    # package batch.
+    READ_ONLY_TASKS = {"drift"}
+
     @staticmethod
     def get_config_value(core_args: ParserContext, key: str) -> any:
         arg = core_args[0].args[key]
         return arg.value
 
+    @staticmethod
+    def is_read_only() -> bool:
+        """
+        Returns True if all of the tasks selected for this run are in READ_ONLY_TASKS.
+        """
+        return all(t.name in Tasks.READ_ONLY_TASKS for t in Tasks.PROGRAM.tasks)
+
+    @staticmethod
+    def get_task_inputs(ctx, task_args: ParserContext) -> dict:
+        """
+        Returns the inputs of the selected task from the values of its parsed arguments; the same
+        inputs that the task itself passes to get_hosts_to_apply.  None for a task without
+        arguments.
+        """
+        args = task_args.as_kwargs
+        if task_args.name in Tasks.TASK_INPUTS:
+            return Tasks.TASK_INPUTS[task_args.name](ctx, **args)
+        return args or None
+
+    @staticmethod
+    def inputs(task_name: str):
+        """
+        Decorator that registers the function as the one that returns the inputs of the task with
+        the task_name, see TASK_INPUTS.
+        """
+
+        def register(fn):
+            Tasks.TASK_INPUTS[task_name] = fn
+            return fn
+
+        return register
+
+    @staticmethod
+    def start_apt_proxy(configs: Configs, distro) -> None:
+        """
+        Starts the caching apt proxy, on the address at which the hosts reach it, and configures all
+        of the hosts to use it for their package sources, and registers the finalizer that reverts
+        the hosts' configuration and stops the proxy at the end of the run.
+        """
+        bind_address, port = configs.apt_proxy.rsplit(":", 1)
+        apt_proxy = AptProxy(
+            bind_address=bind_address.strip("[]"),
+            port=int(port),
+            session=configs.get_http_session(),
+        )
+        apt_proxy.start()
+        distro.package_proxy = apt_proxy
+
+        proxied_connections = {}
+        for host, conn in configs.connections.items():
+            try:
+                apt_proxy.allow_sources(distro.get_package_sources(conn))
+                distro.set_package_proxy(conn, f"http://{configs.apt_proxy}")
+                proxied_connections[host] = conn
+            except Exception as e:
+                logging.warning(f"Unable to configure package proxy; host={host}, e={e}")
+
+        def finalize() -> None:
+            for host, conn in proxied_connections.items():
+                try:
+                    distro.remove_package_proxy(conn)
+                except Exception as e:
+                    logging.warning(f"Unable to remove package proxy; host={host}, e={e}")
+            distro.package_proxy = None
+            apt_proxy.stop()
+
+        Tasks.PROGRAM.finalizers.append(finalize)
+
+    @staticmethod
+    def apply_package_batch(configs: Configs, distro, state) -> None:
+        """
+        Batches the packages of the selected tasks, each with the inputs from its parsed arguments
+        so that the batch skips the same hosts as the task.  A task whose inputs can not be
+        determined is left out of the batch.
+        """
+        selected_tasks = {t.name: t for t in Tasks.PROGRAM.tasks}
+        task_packages = PackageBatch.get_task_packages(configs, list(selected_tasks))
+        if len(task_packages) < 2:
+            return
+
+        # The inputs functions only use the configs, the distro and the state of the context.
+        ctx = SimpleNamespace(configs=configs, distro=distro, state=state)
+        task_inputs = {}
+        for task_name in task_packages:
+            try:
+                task_inputs[task_name] = Tasks.get_task_inputs(ctx, selected_tasks[task_name])
+            except Exception as e:
+                logging.warning(
+                    f"Unable to determine the task inputs, not batching; task={task_name}, e={e}"
+                )
+        PackageBatch.apply(distro, configs, state, task_inputs)
+
     @task
     def load_configs(_):
         """
         Will return an updated Collection (namespace) that includes a "configs" key which maps to a
-        Configs instance and a "distro" key which maps to an instance of a concrete implementation
-        of the pydeploy.distributions.Distribution class.
+        Configs instance, a "distro" key which maps to an instance of a concrete implementation
+        of the pydeploy.distributions.Distribution class, and a "state" key which maps to the
+        StateDb instance in which the per-host results of the run are persisted, or to the Plan
+        instance when run with --plan.
         """
 
+        # The read-only tasks report on stdout, so the logs go to stderr instead.
+        read_only = Tasks.is_read_only()
+        if read_only:
+            Utils.log_to_stderr()
+
         # Read the custom core arguments from the Program instance
         core = Tasks.PROGRAM.core
         pydeploy_config_dir = Tasks.get_config_value(
@@ -41,6 +164,26 @@ class Tasks(object):
         requests_disable_warnings = Tasks.get_config_value(
             core, PyDeployProgram.ARG_REQUESTS_DISABLE_WARNINGS_LONG
         )
+        state_db_path = Tasks.get_config_value(core, PyDeployProgram.ARG_STATE_DB_PATH)
+        force = Tasks.get_config_value(core, PyDeployProgram.ARG_FORCE)
+        package_index_max_age_sec = Tasks.get_config_value(
+            core, PyDeployProgram.ARG_PACKAGE_INDEX_MAX_AGE_SEC
+        )
+        plan = Tasks.get_config_value(core, PyDeployProgram.ARG_PLAN)
+        apt_proxy = Tasks.get_config_value(core, PyDeployProgram.ARG_APT_PROXY)
+        offline_packages = Tasks.get_config_value(core, PyDeployProgram.ARG_OFFLINE_PACKAGES)
+        unsafe_package_io = Tasks.get_config_value(core, PyDeployProgram.ARG_UNSAFE_PACKAGE_IO)
+        artifact_cache_max_mb = Tasks.get_config_value(
+            core, PyDeployProgram.ARG_ARTIFACT_CACHE_MAX_MB
+        )
+        http_proxy = Tasks.get_config_value(core, PyDeployProgram.ARG_HTTP_PROXY)
+        http_timeout_sec = Tasks.get_config_value(core, PyDeployProgram.ARG_HTTP_TIMEOUT_SEC)
+        github_token = Tasks.get_config_value(core, PyDeployProgram.ARG_GITHUB_TOKEN)
+        if github_token is None:
+            github_token = os.environ.get("GITHUB_TOKEN")
+        version_index_max_age_sec = Tasks.get_config_value(
+            core, PyDeployProgram.ARG_VERSION_INDEX_MAX_AGE_SEC
+        )
 
         configs = Configs(
             pydeploy_config_dir=pydeploy_config_dir,
@@ -50,8 +193,26 @@ class Tasks(object):
             hosts_ssh_port=hosts_ssh_port,
             hosts_ssh_identity_file=hosts_ssh_identity_file,
             requests_disable_warnings=requests_disable_warnings,
+            state_db_path=state_db_path,
+            force=force,
+            package_index_max_age_sec=package_index_max_age_sec,
+            apt_proxy=apt_proxy,
+            offline_packages=offline_packages,
+            unsafe_package_io=unsafe_package_io,
+            artifact_cache_max_mb=artifact_cache_max_mb,
+            http_proxy=http_proxy,
+            http_timeout_sec=http_timeout_sec,
+            github_token=github_token,
+            version_index_max_age_sec=version_index_max_age_sec,
         )
         configs.init()
+        configs.github_release_cache = GitHubReleaseCache(token=configs.github_token)
+        configs.repo_key_cache = RepoKeyCache()
+        configs.version_index = VersionIndex(max_age_sec=configs.version_index_max_age_sec)
+        if configs.artifact_cache_max_mb > 0:
+            configs.artifact_cache = ArtifactCache(
+                max_bytes=configs.artifact_cache_max_mb * 1024 * 1024
+            )
 
         # Dynamically instantiate our distribution class instance
         distro_module_name = f"pydeploy.distributions.{configs.distro.name.lower()}"
@@ -59,5 +220,33 @@ class Tasks(object):
         distro_class = getattr(importlib.import_module(distro_module_name), distro_class_name)
         distro = distro_class(configs)
 
-        # Update the namespace with the configs, and the distro instance
-        Tasks.NAMESPACE.configure({"configs": configs, "distro": distro})
+        state = StateDb(db_path=configs.state_db_path)
+
+        # When planning, the Plan stands in for both the connections and the state db so that
+        # neither the hosts nor the state db are modified.
+        if plan:
+            state = Plan(state, distro, configs.hosts)
+            configs.plan = state
+            configs.connections = state.connections
+            Tasks.PROGRAM.plan = state
+        state.start_run()
+        distro.state = state
+        configs.mirrors = Mirrors(configs, state)
+        if not plan and not read_only:
+            # The package managers of the hosts are only prepared once packages are applied to
+            # them, see Distribution.prepare_package_manager.
+            distro.prepare_package_managers = True
+            distro.package_manager_profile = configs.configs.get("package_manager_profile")
+            Tasks.PROGRAM.finalizers.append(distro.restore_package_managers)
+        if configs.apt_proxy and not plan and not read_only:
+            Tasks.start_apt_proxy(configs, distro)
+        if configs.offline_packages:
+            distro.package_closure = PackageClosure(configs, distro)
+        distro.unsafe_package_io = configs.unsafe_package_io
+
+        # Install the packages of all of the tasks selected for this run in one batch per host.
+        if not read_only:
+            Tasks.apply_package_batch(configs, distro, state)
+
+        # Update the namespace with the configs, the distro, and the state db instances
+        Tasks.NAMESPACE.configure({"configs": configs, "distro": distro, "state": state})
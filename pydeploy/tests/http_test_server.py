@@ -0,0 +1,48 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pydeploy.http_session import HttpSession
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    """
+    Base class for the request handlers of the test servers, which do not log the requests.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpServerTestCase(unittest.TestCase):
+    """
+    Base class for the tests that make requests to local http servers.  The servers, http
+    sessions and temp dirs that it provides are cleaned up after each test.
+    """
+
+    def start_server(self, handler_class) -> tuple[ThreadingHTTPServer, str]:
+        """
+        Serves the requests with the handler_class on an ephemeral local port in a background
+        thread and returns the server and its base url.
+        """
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+    def get_configs(self, **kwargs) -> MagicMock:
+        """
+        Returns a mock Configs, with the provided attributes, whose http session makes real
+        requests.
+        """
+        configs = MagicMock(**kwargs)
+        configs.get_http_session.return_value = HttpSession.create(verify=True, timeout_sec=5)
+        self.addCleanup(configs.get_http_session.return_value.close)
+        return configs
+
+    def get_temp_dir(self) -> TemporaryDirectory:
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        return temp_dir
@@ -0,0 +1,105 @@
+import os
+import requests
+import threading
+from http_test_server import HttpServerTestCase, QuietHandler
+from pydeploy.apt_proxy import AptProxy
+
+MIRROR_FILES = {
+    "/debian/dists/bookworm/InRelease": b"Origin: Debian\n",
+    "/debian/pool/main/g/gimp/gimp_2.10.34-1_amd64.deb": b"!<arch>\n" + b"0" * 4096,
+    "/debian/pool/main/o/okular/okular_22.12.3-2_amd64.deb": b"!<arch>\n" + b"1" * 4096,
+    "/admin/secrets.deb": b"secret",
+}
+
+
+class MirrorHandler(QuietHandler):
+    requests = []
+
+    def do_GET(self):
+        MirrorHandler.requests.append(self.path)
+        if self.path not in MIRROR_FILES:
+            self.send_error(404)
+            return
+        body = MIRROR_FILES[self.path]
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class AptProxyTest(HttpServerTestCase):
+    def setUp(self):
+        MirrorHandler.requests = []
+        _, self.mirror_url = self.start_server(MirrorHandler)
+
+        self.temp_dir = self.get_temp_dir()
+        self.apt_proxy = AptProxy(
+            cache_dir=self.temp_dir.name, bind_address="127.0.0.1", port=0, max_bytes=6000
+        )
+        self.apt_proxy.allow_sources(f"deb [arch=amd64] {self.mirror_url}/debian bookworm main\n")
+        self.apt_proxy.start()
+        proxy_url = f"http://127.0.0.1:{self.apt_proxy.get_port()}"
+        self.proxies = {"http": proxy_url}
+
+    def tearDown(self):
+        self.apt_proxy.stop()
+
+    def get(self, path: str) -> requests.Response:
+        return requests.get(f"{self.mirror_url}{path}", proxies=self.proxies, timeout=10)
+
+    def test_packages_are_fetched_once(self):
+        path = "/debian/pool/main/g/gimp/gimp_2.10.34-1_amd64.deb"
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.get(path))) for _ in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual([200] * 8, [r.status_code for r in results])
+        for r in results:
+            self.assertEqual(MIRROR_FILES[path], r.content)
+        self.assertEqual([path], MirrorHandler.requests)
+
+    def test_indexes_are_passed_through(self):
+        path = "/debian/dists/bookworm/InRelease"
+        for _ in range(2):
+            r = self.get(path)
+            self.assertEqual(200, r.status_code)
+            self.assertEqual(MIRROR_FILES[path], r.content)
+        self.assertEqual([path, path], MirrorHandler.requests)
+
+    def test_missing_packages_are_not_cached(self):
+        path = "/debian/pool/main/o/okular/okular_22.12.3-1_amd64.deb"
+        for _ in range(2):
+            self.assertEqual(404, self.get(path).status_code)
+        self.assertEqual([path, path], MirrorHandler.requests)
+
+    def test_only_package_sources_are_proxied(self):
+        # Neither paths outside of the repositories, nor hosts that are not package sources
+        self.assertEqual(403, self.get("/admin/secrets.deb").status_code)
+        r = requests.get(
+            "http://example.com/debian/dists/bookworm/InRelease", proxies=self.proxies, timeout=10
+        )
+        self.assertEqual(403, r.status_code)
+        self.assertEqual([], MirrorHandler.requests)
+
+    def test_allow_sources(self):
+        self.apt_proxy.allow_sources(
+            "Types: deb\nURIs: http://Deb.Debian.org/debian https://example.com/debian\n"
+        )
+        self.assertTrue(self.apt_proxy.is_allowed("deb.debian.org", "/debian/pool/main/x.deb"))
+        self.assertFalse(self.apt_proxy.is_allowed("example.com", "/debian/pool/main/x.deb"))
+
+    def test_least_recently_used_packages_are_evicted(self):
+        gimp_path = "/debian/pool/main/g/gimp/gimp_2.10.34-1_amd64.deb"
+        okular_path = "/debian/pool/main/o/okular/okular_22.12.3-2_amd64.deb"
+        for path in [gimp_path, okular_path, okular_path, gimp_path]:
+            r = self.get(path)
+            self.assertEqual(MIRROR_FILES[path], r.content)
+        self.assertEqual([gimp_path, okular_path, gimp_path], MirrorHandler.requests)
+        self.assertFalse(
+            os.path.exists(self.apt_proxy.get_cache_path(f"{self.mirror_url}{okular_path}"))
+        )
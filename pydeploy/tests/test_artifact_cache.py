@@ -0,0 +1,97 @@
+import hashlib
+import os
+import threading
+import time
+import unittest
+from pydeploy.artifact_cache import ArtifactCache
+from pydeploy.utils import HashAlgo, Utils
+from tempfile import TemporaryDirectory
+
+URL = "https://example.com/artifact.tar.gz"
+
+
+class ArtifactCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.cache = ArtifactCache(cache_dir=os.path.join(self.temp_dir.name, "cache"))
+        self.downloads = []
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_downloader(self, contents: bytes, delay_sec: float = 0.0):
+        def download(path: str, hash_algos: list) -> dict:
+            self.downloads.append(path)
+            time.sleep(delay_sec)
+            with open(path, "wb") as f:
+                f.write(contents)
+            return {algo: Utils.get_file_hash(path, algo) for algo in hash_algos}
+
+        return download
+
+    def fetch(self, url: str, contents: bytes, file_name: str = "artifact", **kwargs) -> str:
+        target_local_path = os.path.join(self.temp_dir.name, file_name)
+        self.cache.fetch(
+            url,
+            hashlib.sha256(contents).hexdigest(),
+            HashAlgo.SHA256SUM,
+            target_local_path,
+            self.get_downloader(contents, **kwargs),
+        )
+        return target_local_path
+
+    def test_fetch(self):
+        for _ in range(2):
+            with open(self.fetch(URL, b"v1"), "rb") as f:
+                self.assertEqual(b"v1", f.read())
+        self.assertEqual(1, len(self.downloads))
+
+        # The same url with a different expected checksum is a different artifact
+        with open(self.fetch(URL, b"v2"), "rb") as f:
+            self.assertEqual(b"v2", f.read())
+        self.assertEqual(2, len(self.downloads))
+
+    def test_checksum_mismatch_is_not_cached(self):
+        target_local_path = os.path.join(self.temp_dir.name, "artifact")
+        with self.assertRaises(Exception):
+            self.cache.fetch(
+                URL,
+                hashlib.sha256(b"expected").hexdigest(),
+                HashAlgo.SHA256SUM,
+                target_local_path,
+                self.get_downloader(b"corrupt"),
+            )
+        self.assertFalse(os.path.exists(target_local_path))
+        self.assertIsNone(
+            self.cache.lookup(ArtifactCache.get_key(URL, hashlib.sha256(b"expected").hexdigest()))
+        )
+
+    def test_least_recently_used_are_evicted(self):
+        self.cache.max_bytes = 8
+        self.fetch(f"{URL}.a", b"aaaa", "a")
+        time.sleep(0.01)
+        self.fetch(f"{URL}.b", b"bbbb", "b")
+        time.sleep(0.01)
+        self.fetch(f"{URL}.a", b"aaaa", "a")
+        time.sleep(0.01)
+        self.fetch(f"{URL}.c", b"cccc", "c")
+
+        # b was the least recently used when c was added
+        self.assertEqual(3, len(self.downloads))
+        self.fetch(f"{URL}.a", b"aaaa", "a")
+        self.assertEqual(3, len(self.downloads))
+        self.fetch(f"{URL}.b", b"bbbb", "b")
+        self.assertEqual(4, len(self.downloads))
+
+    def test_concurrent_fetches_are_coalesced(self):
+        threads = [
+            threading.Thread(
+                target=self.fetch, args=(URL, b"v1", f"artifact-{i}"), kwargs=dict(delay_sec=0.1)
+            )
+            for i in range(4)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, len(self.downloads))
@@ -0,0 +1,341 @@
+import hashlib
+import os
+import time
+import unittest
+from invoke.exceptions import Exit
+from invoke.runners import Result
+from pydeploy.distributions.debian import Debian
+from pydeploy.state import StateDb
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock, patch
+
+REPO_TASK_CONFIGS = dict(
+    key_url="https://example.com/key.asc",
+    key_file_name="example.gpg",
+    repo_file_name="example.list",
+)
+REPO_FILE_CONTENTS = "deb https://example.com stable main"
+
+
+class DebianTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.state = StateDb(db_path=os.path.join(self.temp_dir.name, "state.db"))
+        self.sources_hash = "a1b2c3"
+        self.repo_files = {}
+        self.installed_packages = "gpg\tii \t2.2.40-1.1\nokular\trc \t4:22.12.3-1\n"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_conn(self) -> MagicMock:
+        def run(command, **kwargs):
+            if command == Debian(None).get_package_sources_hash_cmd():
+                return Result(stdout=f"{self.sources_hash}\n", command=command)
+            if command == Debian(None).get_installed_packages_cmd():
+                return Result(stdout=self.installed_packages, command=command)
+            return Result(command=command)
+
+        def put(local, remote):
+            # Adding, or changing, a repo file changes the package sources
+            repo_file_name = os.path.basename(remote)
+            if remote.endswith(".list") and self.repo_files.get(repo_file_name) != local.getvalue():
+                self.repo_files[repo_file_name] = local.getvalue()
+                self.sources_hash = f"{self.sources_hash}+{repo_file_name}"
+
+        conn = MagicMock(host="host-a")
+        conn.run.side_effect = run
+        conn.put.side_effect = put
+        return conn
+
+    def get_distro(self, package_index_max_age_sec: int = 0) -> Debian:
+        distro = Debian(MagicMock(package_index_max_age_sec=package_index_max_age_sec))
+        distro.state = self.state
+        return distro
+
+    def get_update_count(self, conn: MagicMock) -> int:
+        return [c.args[0] for c in conn.run.call_args_list].count("apt-get update")
+
+    def test_update_packages_once_per_run(self):
+        distro = self.get_distro()
+        conn = self.get_conn()
+        distro.install_package(conn, ["okular"])
+        distro.install_package(conn, ["debsig-verify"])
+        self.assertEqual(1, self.get_update_count(conn))
+
+        # A change to the package sources requires another update
+        self.sources_hash = "d4e5f6"
+        distro.install_package(conn, ["code"])
+        self.assertEqual(2, self.get_update_count(conn))
+
+    def test_update_packages_across_runs(self):
+        self.get_distro().install_package(self.get_conn(), ["okular"])
+
+        # By default, the freshness recorded by a previous run is not trusted
+        conn = self.get_conn()
+        self.get_distro().install_package(conn, ["okular"])
+        self.assertEqual(1, self.get_update_count(conn))
+
+        conn = self.get_conn()
+        self.get_distro(package_index_max_age_sec=3600).install_package(conn, ["okular"])
+        self.assertEqual(0, self.get_update_count(conn))
+
+        self.state.save_host_facts("host-a", {"package_index_updated_at": time.time() - 7200})
+        conn = self.get_conn()
+        self.get_distro(package_index_max_age_sec=3600).install_package(conn, ["okular"])
+        self.assertEqual(1, self.get_update_count(conn))
+
+    @patch("pydeploy.distributions.debian.Utils.requests_retry")
+    def test_add_repo_updates_only_the_new_source(self, requests_retry):
+        requests_retry.return_value = MagicMock(content=b"key")
+        distro = self.get_distro()
+        conn = self.get_conn()
+        distro.update_packages(conn)
+        distro.add_repo_impl(
+            MagicMock(repo_key_cache=None), conn, REPO_TASK_CONFIGS, REPO_FILE_CONTENTS
+        )
+        distro.install_package(conn, ["example"])
+
+        commands = [c.args[0] for c in conn.run.call_args_list]
+        self.assertEqual(1, commands.count("apt-get update"))
+        self.assertIn(
+            distro.get_update_package_source_cmd("/etc/apt/sources.list.d/example.list"), commands
+        )
+
+    @patch("pydeploy.distributions.debian.Utils.requests_retry")
+    def test_add_repo_unchanged(self, requests_retry):
+        requests_retry.return_value = MagicMock(content=b"key")
+        distro = self.get_distro()
+        conn = self.get_conn()
+        distro.update_packages(conn)
+        distro.add_repo_impl(
+            MagicMock(repo_key_cache=None), conn, REPO_TASK_CONFIGS, REPO_FILE_CONTENTS
+        )
+        distro.add_repo_impl(
+            MagicMock(repo_key_cache=None), conn, REPO_TASK_CONFIGS, REPO_FILE_CONTENTS
+        )
+
+        update_source_cmd = distro.get_update_package_source_cmd(
+            "/etc/apt/sources.list.d/example.list"
+        )
+        commands = [c.args[0] for c in conn.run.call_args_list]
+        self.assertEqual(1, commands.count(update_source_cmd))
+        self.assertEqual(1, commands.count("apt-get update"))
+
+        # A changed repo file is updated again
+        distro.add_repo_impl(
+            MagicMock(repo_key_cache=None), conn, REPO_TASK_CONFIGS, f"{REPO_FILE_CONTENTS} contrib"
+        )
+        commands = [c.args[0] for c in conn.run.call_args_list]
+        self.assertEqual(2, commands.count(update_source_cmd))
+
+    @patch("pydeploy.distributions.debian.Utils.requests_retry")
+    def test_add_repo_falls_back_to_full_update(self, requests_retry):
+        requests_retry.return_value = MagicMock(content=b"key")
+        distro = self.get_distro()
+        conn = self.get_conn()
+        distro.update_packages(conn)
+        run = conn.run.side_effect
+        conn.run.side_effect = lambda command, **kwargs: (
+            Result(command=command, exited=100)
+            if command.startswith("apt-get update -o")
+            else run(command, **kwargs)
+        )
+        distro.add_repo_impl(
+            MagicMock(repo_key_cache=None), conn, REPO_TASK_CONFIGS, REPO_FILE_CONTENTS
+        )
+        distro.install_package(conn, ["example"])
+        self.assertEqual(2, self.get_update_count(conn))
+
+    def test_install_package_skips_installed_packages(self):
+        distro = self.get_distro()
+        conn = self.get_conn()
+        distro.install_package(conn, ["gpg"])
+        distro.install_package(conn, ["gpg=2.2.40-1.1"])
+        distro.install_package(conn, "gpg", versions={"gpg": "2.2.40-1.1"})
+        self.assertEqual(0, self.get_update_count(conn))
+
+        distro.install_package(conn, ["gpg", "okular"], versions={"gpg": "2.2.27-2"})
+        distro.install_package(conn, ["okular"])
+        commands = [c.args[0] for c in conn.run.call_args_list]
+        self.assertEqual(1, commands.count(distro.get_installed_packages_cmd()))
+        self.assertEqual(["apt-get install -y gpg=2.2.27-2 okular"], commands[-1:])
+
+    def test_install_package_unsafe_io(self):
+        distro = self.get_distro()
+        conn = self.get_conn()
+        distro.install_package(conn, ["okular"], unsafe_io=True)
+        commands = [c.args[0] for c in conn.run.call_args_list]
+        self.assertEqual(
+            [
+                "$(command -v eatmydata) apt-get install -y okular"
+                " -o Dpkg::Options::=--force-unsafe-io",
+                "sync",
+            ],
+            commands[-2:],
+        )
+
+        # Enabled for the whole run
+        distro.unsafe_package_io = True
+        distro.remove_package(conn, ["okular"])
+        self.assertEqual("sync", conn.run.call_args_list[-1].args[0])
+
+    def test_compare_package_versions(self):
+        distro = self.get_distro()
+        for version_a, version_b, expected in [
+            ("2.10.34-1", "2.10.34-1", 0),
+            ("2.10.34-1", "2.10.36-1", -1),
+            ("2.10.34-1", "2.10.34-1+deb12u1", -1),
+            ("1:0.9", "2.0", 1),
+            ("1.0~rc1", "1.0", -1),
+            ("1.10", "1.9", 1),
+            ("1.0a", "1.0+", -1),
+        ]:
+            with self.subTest(version_a=version_a, version_b=version_b):
+                comparison = distro.compare_package_versions(version_a, version_b)
+                self.assertEqual(expected, (comparison > 0) - (comparison < 0))
+
+    def test_set_package_manager_profile(self):
+        conn = self.get_conn()
+        self.get_distro().set_package_manager_profile(
+            conn,
+            {"pipeline_depth": 10, "install_recommends": False, "Acquire::http::Timeout": 30},
+        )
+        local, remote = conn.put.call_args.kwargs.values()
+        self.assertEqual(Debian.APT_PROFILE_CONF_PATH, remote)
+        self.assertEqual(
+            'Acquire::http::Pipeline-Depth "10";\n'
+            'APT::Install-Recommends "false";\n'
+            'Acquire::http::Timeout "30";\n',
+            local.getvalue(),
+        )
+
+    @patch("pydeploy.distributions.debian.Utils.requests_retry")
+    def test_put_repo_key_once_per_run(self, requests_retry):
+        requests_retry.return_value = MagicMock(content=b"key")
+        distro = self.get_distro()
+        key_path = "/etc/apt/trusted.gpg.d/example.gpg"
+        for host, host_key in [("host-a", b"old-key"), ("host-b", b"key")]:
+            conn = self.get_conn()
+            conn.host = host
+            run = conn.run.side_effect
+            conn.run.side_effect = lambda command, key=host_key, **kwargs: (
+                Result(stdout=f"{hashlib.sha256(key).hexdigest()}  {key_path}\n", command=command)
+                if command == f"sha256sum {key_path}"
+                else run(command, **kwargs)
+            )
+            distro.put_repo_key(MagicMock(repo_key_cache=None), conn, REPO_TASK_CONFIGS)
+            pushed = [c.kwargs["local"].getvalue() for c in conn.put.call_args_list]
+            self.assertEqual([b"key"] if host == "host-a" else [], pushed)
+        self.assertEqual(1, requests_retry.call_count)
+
+    def test_pause_and_resume_package_timers(self):
+        distro = self.get_distro()
+        conn = self.get_conn()
+        conn.run.side_effect = lambda command, **kwargs: Result(
+            stdout="inactive\nactive\n" if command.startswith("systemctl is-active") else "",
+            command=command,
+        )
+        timers = []
+        distro.pause_package_timers(conn, timers)
+        self.assertEqual(["apt-daily-upgrade.timer"], timers)
+        distro.resume_package_timers(conn, timers)
+        commands = [c.args[0] for c in conn.run.call_args_list]
+        self.assertEqual(
+            [
+                "systemctl mask --runtime --now apt-daily-upgrade.timer",
+                "systemctl mask --runtime apt-daily.service apt-daily-upgrade.service",
+                "systemctl unmask --runtime apt-daily-upgrade.timer apt-daily.service"
+                " apt-daily-upgrade.service",
+                "systemctl start apt-daily-upgrade.timer",
+            ],
+            commands[1:],
+        )
+
+    def test_prepare_package_manager_on_first_package_command(self):
+        distro = self.get_distro()
+        distro.prepare_package_managers = True
+        distro.package_manager_profile = {"pipeline_depth": 10}
+        conns = [self.get_conn(), self.get_conn()]
+        for conn, host in zip(conns, ["host-a", "host-b"]):
+            conn.host = host
+            run = conn.run.side_effect
+            conn.run.side_effect = lambda command, run=run, **kwargs: (
+                Result(stdout="active\nactive\n", command=command)
+                if command.startswith("systemctl is-active")
+                else (
+                    Result(command=command, exited=1)
+                    if command == distro.get_package_lock_holders_cmd()
+                    else run(command, **kwargs)
+                )
+            )
+
+        # Only the host to which packages are applied is prepared, and only once.
+        distro.install_package(conns[0], ["okular"])
+        distro.install_package(conns[0], ["debsig-verify"])
+        self.assertEqual([], conns[1].run.call_args_list)
+        commands = [c.args[0] for c in conns[0].run.call_args_list]
+        for timer in Debian.APT_TIMERS:
+            self.assertEqual(1, commands.count(f"systemctl mask --runtime --now {timer}"))
+        self.assertLess(
+            commands.index(distro.get_package_lock_holders_cmd()), commands.index("apt-get update")
+        )
+        self.assertEqual(
+            [Debian.APT_PROFILE_CONF_PATH],
+            [c.kwargs["remote"] for c in conns[0].put.call_args_list],
+        )
+
+        distro.restore_package_managers()
+        commands = [c.args[0] for c in conns[0].run.call_args_list]
+        self.assertIn(f"rm -f {Debian.APT_PROFILE_CONF_PATH}", commands)
+        self.assertEqual(f"systemctl start {' '.join(Debian.APT_TIMERS)}", commands[-1])
+        self.assertEqual([], conns[1].put.call_args_list)
+        self.assertEqual([], conns[1].run.call_args_list)
+
+    def test_prepare_package_manager_failures(self):
+        distro = self.get_distro()
+        distro.prepare_package_managers = True
+        distro.wait_for_package_lock = MagicMock(side_effect=[Exit("timed out"), None])
+        conn = self.get_conn()
+
+        def run(command, **kwargs):
+            if command.startswith("systemctl is-active"):
+                return Result(stdout="active\nactive\n", command=command)
+            if command == f"systemctl mask --runtime --now {Debian.APT_TIMERS[1]}":
+                raise Exception("mask failed")
+            return Result(command=command)
+
+        conn.run.side_effect = run
+
+        # A timeout waiting for the package lock fails the package command, and the lock is waited
+        # for again before the next one.
+        with self.assertRaises(Exit):
+            distro.prepare_package_manager(conn)
+        distro.prepare_package_manager(conn)
+        distro.prepare_package_manager(conn)
+        self.assertEqual(2, distro.wait_for_package_lock.call_count)
+
+        # The timer that was masked before the masking failed is resumed.
+        self.assertEqual(
+            [Debian.APT_TIMERS[0]], distro.prepared_package_managers[conn.host]["timers"]
+        )
+        distro.restore_package_managers()
+        commands = [c.args[0] for c in conn.run.call_args_list]
+        self.assertEqual(f"systemctl start {Debian.APT_TIMERS[0]}", commands[-1])
+
+    @patch("pydeploy.distributions.distribution.time.sleep")
+    def test_wait_for_package_lock(self, sleep):
+        distro = self.get_distro()
+        conn = self.get_conn()
+        conn.run.side_effect = [
+            Result(stdout="812 unattended-upgr", exited=0),
+            Result(stdout="812 unattended-upgr", exited=0),
+            Result(exited=1),
+        ]
+        distro.wait_for_package_lock(conn)
+        self.assertEqual([1, 2], [c.args[0] for c in sleep.call_args_list])
+
+        conn.run.side_effect = None
+        conn.run.return_value = Result(stdout="812 dpkg", exited=0)
+        with self.assertRaises(Exit):
+            distro.wait_for_package_lock(conn, timeout_sec=0)
@@ -0,0 +1,137 @@
+import json
+import os
+import unittest
+from invoke.runners import Result
+from pydeploy.distributions.debian import Debian
+from pydeploy.drift import Drift, DriftStatus
+from pydeploy.docker import Docker
+from pydeploy.state import StateDb
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock
+
+PROBE_STDOUT = """@@pydeploy-drift:architecture
+amd64
+@@pydeploy-drift:release
+bookworm
+@@pydeploy-drift:packages
+gimp\tii \t2.10.34-1
+okular\tun \t
+@@pydeploy-drift:tool:install-maven
+/usr/local/apache-maven-3.6.3
+@@pydeploy-drift:docker-daemon-json
+@@pydeploy-drift-missing
+@@pydeploy-drift:sysctl-inotify
+524288
+@@pydeploy-drift:repo:vscode.list
+deb [arch=amd64] https://packages.microsoft.com/repos/code stable main
+"""
+
+
+class DriftTest(unittest.TestCase):
+    def get_desired_state(self) -> dict:
+        return {
+            "packages": ["gimp", "okular"],
+            "tools": {
+                "install-maven": dict(
+                    cmd="readlink -e /usr/local/apache-maven",
+                    expected="3.9.4",
+                    parser=lambda s: s.strip().removeprefix("/usr/local/apache-maven-"),
+                ),
+            },
+            "docker_daemon_json": Docker.get_daemon_json(),
+            "max_user_watches": 524288,
+            "repos": {
+                "vscode.list": {
+                    "repo_file_name": "vscode.list",
+                    "repo_file_template": "deb [arch=${architecture}] https://packages.microsoft.com/repos/code stable main",
+                },
+            },
+            "ca_certs_bundle_path": None,
+            "cert_validation_strings": [],
+        }
+
+    def test_parse_probe_output(self):
+        actual_result = Drift.parse_probe_output(PROBE_STDOUT)
+        self.assertEqual("amd64", actual_result["architecture"])
+        self.assertEqual("bookworm", actual_result["release"])
+        self.assertEqual("/usr/local/apache-maven-3.6.3", actual_result["tool:install-maven"])
+        self.assertIsNone(actual_result["docker-daemon-json"])
+        self.assertEqual("524288", actual_result["sysctl-inotify"])
+
+    def test_compare(self):
+        distro = Debian(MagicMock())
+        checks = Drift.compare(
+            distro, self.get_desired_state(), Drift.parse_probe_output(PROBE_STDOUT)
+        )
+        actual_result = {(c["check"], c["name"]): c["status"] for c in checks}
+        expected_result = {
+            ("package", "gimp"): DriftStatus.OK,
+            ("package", "okular"): DriftStatus.DRIFT,
+            ("tool", "install-maven"): DriftStatus.DRIFT,
+            ("docker-daemon-json", "/etc/docker/daemon.json"): DriftStatus.DRIFT,
+            ("sysctl", "fs.inotify.max_user_watches"): DriftStatus.OK,
+            ("repo-file", "vscode.list"): DriftStatus.OK,
+        }
+        self.assertEqual(expected_result, actual_result)
+
+    def test_get_probe_script_sections(self):
+        distro = Debian(MagicMock())
+        script = Drift.get_probe_script(distro, self.get_desired_state())
+        self.assertIn("dpkg-query -W", script)
+        self.assertIn("echo '@@pydeploy-drift:repo:vscode.list'", script)
+        self.assertIn("cat /etc/apt/sources.list.d/vscode.list", script)
+
+    def test_scan_expects_the_recorded_daemon_json(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        state = StateDb(db_path=os.path.join(temp_dir.name, "state.db"))
+        daemon_json_args = dict(
+            docker_bip="10.50.0.1/24",
+            docker_fixed_cidr="10.50.0.1/25",
+            docker_default_addr_pools_base="10.51.0.0/16",
+            docker_default_addr_pools_size=24,
+            docker_insecure_registries="registry.example.com:8443",
+        )
+        state.save_host_facts(
+            "host-a", {Docker.HOST_FACT_DAEMON_JSON_ARGS: json.dumps(daemon_json_args)}
+        )
+
+        # Both hosts have the daemon.json written by install-docker with the args of host-a.
+        daemon_json = json.dumps(Docker.get_daemon_json(**daemon_json_args))
+        probe_stdout = f"@@pydeploy-drift:docker-daemon-json\n{daemon_json}\n"
+        connections = {}
+        for host in ["host-a", "host-b"]:
+            connections[host] = MagicMock(host=host)
+            connections[host].run.return_value = Result(stdout=probe_stdout)
+        ctx = MagicMock(state=state, distro=Debian(MagicMock(configs={})))
+        ctx.configs.connections = connections
+
+        report = Drift.scan(ctx)
+        statuses = {
+            host: [c["status"] for c in host_report["checks"] if c["check"] == "docker-daemon-json"]
+            for host, host_report in report["hosts"].items()
+        }
+        self.assertEqual({"host-a": [DriftStatus.OK], "host-b": [DriftStatus.DRIFT]}, statuses)
+
+    def test_scan_expects_the_recorded_max_user_watches(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        state = StateDb(db_path=os.path.join(temp_dir.name, "state.db"))
+        with state.record("host-a", "setup-inotify", inputs=dict(max_user_watches="1048576")):
+            pass
+
+        # Both hosts have the max_user_watches applied by setup-inotify on host-a.
+        probe_stdout = "@@pydeploy-drift:sysctl-inotify\n1048576\n"
+        connections = {}
+        for host in ["host-a", "host-b"]:
+            connections[host] = MagicMock(host=host)
+            connections[host].run.return_value = Result(stdout=probe_stdout)
+        ctx = MagicMock(state=state, distro=Debian(MagicMock(configs={})))
+        ctx.configs.connections = connections
+
+        report = Drift.scan(ctx)
+        statuses = {
+            host: [c["status"] for c in host_report["checks"] if c["check"] == "sysctl"]
+            for host, host_report in report["hosts"].items()
+        }
+        self.assertEqual({"host-a": [DriftStatus.OK], "host-b": [DriftStatus.DRIFT]}, statuses)
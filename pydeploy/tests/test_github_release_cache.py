@@ -0,0 +1,65 @@
+import os
+import unittest
+from pydeploy.github_release_cache import GitHubReleaseCache
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock, patch
+
+URL = "https://api.github.com/repos/docker/compose/releases/latest"
+RELEASE_JSON = {"tag_name": "v2.24.0", "assets": []}
+
+
+def get_response(status_code: int, headers: dict = None, release_json: dict = None) -> MagicMock:
+    r = MagicMock(status_code=status_code, ok=200 <= status_code < 300, headers=headers or {})
+    r.json.return_value = release_json
+    return r
+
+
+class GitHubReleaseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.session = MagicMock()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_cache(self, token: str = None) -> GitHubReleaseCache:
+        return GitHubReleaseCache(cache_dir=self.temp_dir.name, token=token)
+
+    def test_revalidates_with_etag(self):
+        self.session.get.return_value = get_response(200, {"ETag": '"a1"'}, RELEASE_JSON)
+        cache = self.get_cache(token="t0ken")
+        self.assertEqual(RELEASE_JSON, cache.get_release_json(self.session, URL))
+        self.assertEqual(
+            "Bearer t0ken", self.session.get.call_args.kwargs["headers"]["Authorization"]
+        )
+
+        # Within a run the release is served from memory.
+        self.assertEqual(RELEASE_JSON, cache.get_release_json(self.session, URL))
+        self.assertEqual(1, self.session.get.call_count)
+
+        # The next run revalidates the stored release.
+        self.session.get.return_value = get_response(304)
+        self.assertEqual(RELEASE_JSON, self.get_cache().get_release_json(self.session, URL))
+        headers = self.session.get.call_args.kwargs["headers"]
+        self.assertEqual('"a1"', headers["If-None-Match"])
+        self.assertNotIn("Authorization", headers)
+
+    @patch("pydeploy.github_release_cache.time.sleep")
+    def test_rate_limited(self, sleep):
+        self.session.get.side_effect = [
+            get_response(403, {"X-RateLimit-Remaining": "0", "Retry-After": "5"}),
+            get_response(200, {"ETag": '"a1"'}, RELEASE_JSON),
+        ]
+        self.assertEqual(RELEASE_JSON, self.get_cache().get_release_json(self.session, URL))
+        sleep.assert_called_once_with(5.0)
+
+        # When the rate limit resets too far in the future the stored release is used, and without
+        # a stored release the request fails.
+        self.session.get.side_effect = None
+        self.session.get.return_value = get_response(429, {"Retry-After": "3600"})
+        self.assertEqual(RELEASE_JSON, self.get_cache().get_release_json(self.session, URL))
+        for file_name in os.listdir(self.temp_dir.name):
+            os.remove(os.path.join(self.temp_dir.name, file_name))
+        with self.assertRaises(Exception):
+            self.get_cache().get_release_json(self.session, URL)
+        self.assertEqual(1, sleep.call_count)
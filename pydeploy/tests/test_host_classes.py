@@ -0,0 +1,63 @@
+import unittest
+from invoke.runners import Result
+from pydeploy.distributions.debian import Debian
+from unittest.mock import MagicMock
+
+REPO_TASK_CONFIGS = dict(
+    repo_file_template="deb [arch=${architecture}] https://example.com ${release} main",
+)
+
+
+class HostClassesTest(unittest.TestCase):
+    def setUp(self):
+        self.distro = Debian(MagicMock(configs={"install-example": REPO_TASK_CONFIGS}))
+        self.distro.add_repo_impl = MagicMock()
+        self.distro.configs.get_task_configs.side_effect = lambda task: REPO_TASK_CONFIGS
+
+    def get_conn(self, host: str, architecture: str) -> MagicMock:
+        def run(command, **kwargs):
+            stdout = {
+                self.distro.get_architecture_cmd(): f"{architecture}\n",
+                self.distro.get_release_cmd(): "bookworm\n",
+            }.get(command, "")
+            return Result(stdout=stdout, command=command)
+
+        conn = MagicMock(host=host)
+        conn.run.side_effect = run
+        return conn
+
+    def test_artifacts_are_shared_within_a_class(self):
+        conns = [
+            self.get_conn("host-a", "amd64"),
+            self.get_conn("host-b", "amd64"),
+            self.get_conn("host-c", "arm64"),
+        ]
+        factory = MagicMock(side_effect=lambda facts: facts["architecture"])
+        self.assertEqual(
+            ["amd64", "amd64", "arm64"],
+            [self.distro.host_classes.get_artifact(c, "example", factory) for c in conns],
+        )
+        self.assertEqual(2, factory.call_count)
+        self.assertEqual(
+            self.distro.host_classes.get_host_class(conns[0]),
+            self.distro.host_classes.get_host_class(conns[1]),
+        )
+        self.assertNotEqual(
+            self.distro.host_classes.get_host_class(conns[0]),
+            self.distro.host_classes.get_host_class(conns[2]),
+        )
+
+        # The facts of each host are probed only once
+        self.assertEqual(2, conns[0].run.call_count)
+
+    def test_add_repo_renders_repo_file_per_class(self):
+        self.distro.package_proxy = MagicMock()
+        for host, architecture in [("host-a", "amd64"), ("host-b", "arm64")]:
+            self.distro.add_repo(MagicMock(), self.get_conn(host, architecture), "install-example")
+            repo_file_contents = f"deb [arch={architecture}] https://example.com bookworm main"
+            self.assertEqual(repo_file_contents, self.distro.add_repo_impl.call_args.args[3])
+            # The package proxy is allowed to proxy the sources of the repo
+            self.distro.package_proxy.allow_sources.assert_called_with(repo_file_contents)
+
+        # The task configs, which are hashed as the inputs of the task, are left unchanged.
+        self.assertNotIn("repo_file_contents", REPO_TASK_CONFIGS)
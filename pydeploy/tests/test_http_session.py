@@ -0,0 +1,48 @@
+import requests
+from http_test_server import HttpServerTestCase, QuietHandler
+from pydeploy.http_session import HttpSession
+from unittest.mock import patch
+
+
+class KeepAliveHandler(QuietHandler):
+    protocol_version = "HTTP/1.1"
+    client_ports = []
+
+    def do_GET(self):
+        KeepAliveHandler.client_ports.append(self.client_address[1])
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+
+class HttpSessionTest(HttpServerTestCase):
+    def setUp(self):
+        KeepAliveHandler.client_ports = []
+        _, server_url = self.start_server(KeepAliveHandler)
+        self.url = f"{server_url}/"
+        self.session = HttpSession.create(verify=False, timeout_sec=7, proxy="http://proxy:3128")
+        # The proxy would otherwise be used for the requests to the local server.
+        self.session.proxies.clear()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_connections_are_reused(self):
+        for _ in range(3):
+            self.assertEqual(b"ok", self.session.get(self.url).content)
+        self.assertEqual(1, len(set(KeepAliveHandler.client_ports)))
+
+    def test_settings(self):
+        session = HttpSession.create(verify=False, timeout_sec=7, proxy="http://proxy:3128")
+        self.assertFalse(session.verify)
+        self.assertEqual("http://proxy:3128", session.proxies["https"])
+
+        # Requests that do not set their own timeout get the default of the session.
+        with patch(
+            "requests.adapters.HTTPAdapter.send", side_effect=requests.ConnectionError
+        ) as send:
+            for timeout, expected_timeout in [(None, 7), (1, 1)]:
+                with self.assertRaises(requests.ConnectionError):
+                    self.session.get(self.url, timeout=timeout)
+                self.assertEqual(expected_timeout, send.call_args.kwargs["timeout"])
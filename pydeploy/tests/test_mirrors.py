@@ -0,0 +1,76 @@
+import hashlib
+import os
+import time
+from http_test_server import HttpServerTestCase, QuietHandler
+from pydeploy.mirrors import Mirrors
+from pydeploy.utils import Utils
+from unittest.mock import MagicMock
+
+CONTENTS = b"apache-maven" * 1024
+
+
+class MirrorHandler(QuietHandler):
+    def do_GET(self):
+        mirror = self.server.mirror
+        mirror["requests"].append(self.headers.get("Range"))
+        time.sleep(mirror["delay_sec"])
+        if mirror["status_code"] != 200 or (
+            mirror["fail_downloads"] and self.headers.get("Range") is None
+        ):
+            self.send_error(mirror["status_code"] if mirror["status_code"] != 200 else 500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(CONTENTS)))
+        self.end_headers()
+        self.wfile.write(CONTENTS)
+
+
+class MirrorsTest(HttpServerTestCase):
+    def setUp(self):
+        self.temp_dir = self.get_temp_dir()
+        self.configs = self.get_configs(artifact_cache=None, plan=None)
+        self.state = MagicMock()
+        self.configs.mirrors = Mirrors(self.configs, self.state)
+
+    def start_mirror(self, delay_sec=0.0, status_code=200, fail_downloads=False):
+        server, server_url = self.start_server(MirrorHandler)
+        server.mirror = dict(
+            delay_sec=delay_sec,
+            status_code=status_code,
+            fail_downloads=fail_downloads,
+            requests=[],
+        )
+        return f"{server_url}/apache-maven-bin.tar.gz", server.mirror
+
+    def test_get_ordered_urls(self):
+        slow_url, _ = self.start_mirror(delay_sec=0.3)
+        missing_url, _ = self.start_mirror(status_code=404)
+        fast_url, fast_mirror = self.start_mirror()
+
+        urls = [slow_url, missing_url, fast_url]
+        self.assertEqual(
+            [fast_url, slow_url, missing_url], self.configs.mirrors.get_ordered_urls(urls)
+        )
+        self.assertEqual([f"bytes=0-{Mirrors.PROBE_BYTES - 1}"], fast_mirror["requests"])
+        self.state.save_mirror_choice.assert_called_once()
+        self.assertEqual((slow_url, fast_url), self.state.save_mirror_choice.call_args.args[:2])
+
+        # The mirrors are raced only once per run.
+        self.configs.mirrors.get_ordered_urls(urls)
+        self.assertEqual(1, len(fast_mirror["requests"]))
+
+    def test_download_file_falls_back_to_next_mirror(self):
+        url, mirror = self.start_mirror(delay_sec=0.3)
+        failing_url, failing_mirror = self.start_mirror(fail_downloads=True)
+        path = os.path.join(self.temp_dir.name, "apache-maven-bin.tar.gz")
+        Utils.download_file(
+            self.configs,
+            url,
+            path,
+            checksum=hashlib.sha256(CONTENTS).hexdigest(),
+            mirror_urls=[failing_url],
+        )
+        with open(path, "rb") as f:
+            self.assertEqual(CONTENTS, f.read())
+        self.assertEqual(2, len(failing_mirror["requests"]))
+        self.assertEqual(2, len(mirror["requests"]))
@@ -0,0 +1,172 @@
+import os
+import time
+import unittest
+from invoke.runners import Result
+from pydeploy.distributions.debian import Debian
+from pydeploy.package_batch import PackageBatch
+from pydeploy.state import StateDb, TaskStatus
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock, patch
+
+CONFIGS = {
+    "install-packages": {"packages": ["gimp", "okular"], "package_versions": {"gimp": "2.10"}},
+    "install-vscode": {
+        "packages": ["code"],
+        "key_url": "https://example.com/key.asc",
+        "key_file_name": "microsoft.gpg",
+        "repo_file_name": "vscode.list",
+        "repo_file_template": "deb [arch=${architecture}] https://example.com/code stable main",
+    },
+    "install-docker": {
+        "packages": ["docker-ce", "docker-ce-cli"],
+        "key_url": "https://example.com/docker.asc",
+        "key_file_name": "docker.gpg",
+        "repo_file_name": "docker.list",
+        "repo_file_template": "deb [arch=${architecture}] https://example.com/docker bookworm stable",
+    },
+    "install-minikube": {"packages": ["libvirt-daemon-system", "qemu-kvm"]},
+    "install-java-openjdk": {"packages": ["openjdk-${version}-jdk"]},
+    "install-maven": {"version": "3.9.4"},
+}
+
+
+class PackageBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.state = StateDb(db_path=os.path.join(self.temp_dir.name, "state.db"))
+        self.configs = MagicMock(
+            configs=CONFIGS, package_index_max_age_sec=0, force=False, repo_key_cache=None
+        )
+        self.configs.get_task_configs.side_effect = lambda task: CONFIGS[task]
+        self.distro = Debian(self.configs)
+        self.distro.state = self.state
+
+        def run(command, **kwargs):
+            if command == self.distro.get_installed_packages_cmd():
+                return Result(
+                    stdout="gpg\tii \t2.2.40-1.1\nokular\tii \t4:22.12.3-1\n", command=command
+                )
+            if command == self.distro.get_package_sources_hash_cmd():
+                return Result(stdout=f"{len(self.conn.put.call_args_list)}\n", command=command)
+            if command == self.distro.get_architecture_cmd():
+                return Result(stdout="amd64\n", command=command)
+            return Result(command=command)
+
+        self.conn = MagicMock(host="host-a")
+        self.conn.run.side_effect = run
+        self.configs.connections = {"host-a": self.conn}
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_commands(self) -> list[str]:
+        return [c.args[0] for c in self.conn.run.call_args_list]
+
+    def test_get_task_packages(self):
+        self.assertEqual(
+            {
+                "install-packages": ["gimp", "okular"],
+                "install-vscode": ["code"],
+                "install-docker": ["docker-ce", "docker-ce-cli"],
+                "install-minikube": ["libvirt-daemon-system", "qemu-kvm"],
+            },
+            PackageBatch.get_task_packages(self.configs, list(CONFIGS)),
+        )
+
+    @patch("pydeploy.distributions.debian.Utils.requests_retry")
+    def test_apply(self, requests_retry):
+        requests_retry.return_value = MagicMock(content=b"key")
+        PackageBatch.apply(
+            self.distro,
+            self.configs,
+            self.state,
+            {"install-packages": None, "install-vscode": None},
+        )
+
+        commands = self.get_commands()
+        self.assertEqual(1, commands.count("apt-get update"))
+        self.assertEqual(
+            ["apt-get install -y gimp=2.10 code"],
+            [c for c in commands if c.startswith("apt-get install")],
+        )
+        self.assertEqual(
+            TaskStatus.SUCCESS, self.state.get_last_result("host-a", PackageBatch.TASK)["status"]
+        )
+
+        # The subsequent installs by the tasks themselves are no-ops
+        self.conn.run.reset_mock()
+        self.distro.install_package(self.conn, ["code"])
+        self.assertEqual([], self.get_commands())
+
+    @patch("pydeploy.distributions.debian.Utils.requests_retry")
+    def test_apply_skips_applied_tasks(self, requests_retry):
+        requests_retry.return_value = MagicMock(content=b"key")
+        self.state.save_task_result(
+            host="host-a",
+            task="install-vscode",
+            status=TaskStatus.SUCCESS,
+            started_at=time.time(),
+            input_hash=self.distro.get_task_input_hash("install-vscode"),
+        )
+        tasks = {"install-packages": None, "install-vscode": None}
+        self.assertEqual([], PackageBatch.apply(self.distro, self.configs, self.state, tasks))
+        self.assertEqual([], self.get_commands())
+
+        self.configs.force = True
+        self.assertEqual([], PackageBatch.apply(self.distro, self.configs, self.state, tasks))
+        self.assertIn("apt-get install -y gimp=2.10 code", self.get_commands())
+
+    def test_apply_failure_is_reported(self):
+        self.conn.put.side_effect = Exception("unreachable")
+        self.conn.run.side_effect = Exception("unreachable")
+        self.assertEqual(
+            ["host-a"],
+            PackageBatch.apply(
+                self.distro,
+                self.configs,
+                self.state,
+                {"install-packages": None, "install-vscode": None},
+            ),
+        )
+        self.assertEqual(
+            TaskStatus.FAILED, self.state.get_last_result("host-a", PackageBatch.TASK)["status"]
+        )
+
+    def test_apply_requires_multiple_tasks(self):
+        PackageBatch.apply(self.distro, self.configs, self.state, {"install-packages": None})
+        self.assertEqual([], self.get_commands())
+
+    @patch("pydeploy.distributions.debian.Utils.requests_retry")
+    def test_apply_tasks_with_arguments(self, requests_retry):
+        requests_retry.return_value = MagicMock(content=b"key")
+        conn_b = MagicMock(host="host-b")
+        conn_b.run.side_effect = self.conn.run.side_effect
+        conn_b.put = self.conn.put
+        self.configs.connections["host-b"] = conn_b
+        task_inputs = {
+            "install-docker": dict(docker_user="alice", compose_release="v2.24.5"),
+            "install-minikube": dict(minikube_user="alice"),
+            "install-packages": None,
+        }
+
+        # The task was applied to host-b with the same inputs, so it is only batched on host-a.
+        self.state.save_task_result(
+            host="host-b",
+            task="install-docker",
+            status=TaskStatus.SUCCESS,
+            started_at=time.time(),
+            input_hash=self.distro.get_task_input_hash(
+                "install-docker", task_inputs["install-docker"]
+            ),
+        )
+        self.assertEqual([], PackageBatch.apply(self.distro, self.configs, self.state, task_inputs))
+
+        for conn, packages in [
+            (self.conn, "docker-ce docker-ce-cli libvirt-daemon-system qemu-kvm gimp=2.10"),
+            (conn_b, "libvirt-daemon-system qemu-kvm gimp=2.10"),
+        ]:
+            commands = [c.args[0] for c in conn.run.call_args_list]
+            self.assertEqual(
+                [f"apt-get install -y {packages}"],
+                [c for c in commands if c.startswith("apt-get install")],
+            )
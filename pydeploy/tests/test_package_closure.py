@@ -0,0 +1,151 @@
+import hashlib
+import os
+import unittest
+from invoke.runners import Result
+from pydeploy.distributions.debian import Debian
+from pydeploy.package_closure import PackageClosure
+from pydeploy.utils import HashAlgo
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock, patch
+
+PACKAGE_FILE_CONTENTS = {
+    "gimp_2.10.34-1_amd64.deb": b"gimp",
+    "libgimp2.0_2.10.34-1_amd64.deb": b"libgimp2.0",
+    "okular_4%3a22.12.3-1_amd64.deb": b"okular",
+}
+
+
+class PackageClosureTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.distro = Debian(MagicMock(package_index_max_age_sec=0))
+        self.distro.state = MagicMock()
+        self.package_closure = PackageClosure(
+            MagicMock(artifact_cache=None, plan=None, package_index_max_age_sec=0),
+            self.distro,
+            closures_dir=os.path.join(self.temp_dir.name, "closures"),
+        )
+        self.distro.package_closure = self.package_closure
+        self.installed_packages = "libgimp2.0\tii \t2.10.34-1\n"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_conn(self, host: str = "host-a") -> MagicMock:
+        uris = "".join(
+            f"'http://deb.debian.org/debian/pool/main/{file_name}' {file_name} {len(contents)} "
+            f"SHA256:{hashlib.sha256(contents).hexdigest()}\n"
+            for file_name, contents in PACKAGE_FILE_CONTENTS.items()
+        )
+
+        def run(command, **kwargs):
+            stdout = {
+                self.distro.get_architecture_cmd(): "amd64\n",
+                self.distro.get_release_cmd(): "bookworm\n",
+                self.distro.get_installed_packages_cmd(): self.installed_packages,
+                self.distro.get_package_sources_hash_cmd(): "a1b2c3\n",
+                self.distro.get_package_uris_cmd("gimp okular"): uris,
+            }.get(command, "")
+            return Result(stdout=stdout, command=command)
+
+        conn = MagicMock(host=host)
+        conn.run.side_effect = run
+        return conn
+
+    @staticmethod
+    def download_file(configs, url: str, target_local_path: str, chunk_size, hash_algos) -> dict:
+        contents = PACKAGE_FILE_CONTENTS[os.path.basename(url)]
+        with open(target_local_path, "wb") as f:
+            f.write(contents)
+        return {HashAlgo.SHA256SUM: hashlib.sha256(contents).hexdigest()}
+
+    def test_parse_package_uris(self):
+        package_files = self.distro.parse_package_uris(
+            "'http://deb.debian.org/debian/pool/main/o/okular/okular_22.12.3-1_amd64.deb' "
+            "okular_4%3a22.12.3-1_amd64.deb 3285564 SHA256:8a6f\n"
+        )
+        self.assertEqual(1, len(package_files))
+        self.assertEqual("okular", package_files[0]["package"])
+        self.assertEqual("4:22.12.3-1", package_files[0]["version"])
+        self.assertEqual("SHA256SUM", package_files[0]["hash_algo"])
+        self.assertEqual(3285564, package_files[0]["size"])
+
+    @patch("pydeploy.utils.Utils._download_file")
+    def test_install(self, download_file):
+        download_file.side_effect = PackageClosureTest.download_file
+
+        conn = self.get_conn()
+        self.distro.install_package(conn, ["gimp", "okular"])
+        commands = [c.args[0] for c in conn.run.call_args_list]
+        self.assertIn(self.distro.get_package_uris_cmd("gimp okular"), commands)
+
+        # The installed version of the libgimp2.0 dependency is not pushed, and the package index is
+        # updated only to resolve the closure.
+        remote_paths = [c.args[1] for c in conn.put.call_args_list]
+        self.assertEqual(
+            [
+                os.path.join(PackageClosure.REMOTE_DIR, "gimp_2.10.34-1_amd64.deb"),
+                os.path.join(PackageClosure.REMOTE_DIR, "okular_4%3a22.12.3-1_amd64.deb"),
+            ],
+            remote_paths,
+        )
+        self.assertIn(f"apt-get install -y {' '.join(remote_paths)}", commands)
+        self.assertEqual(1, commands.count("apt-get update"))
+        self.assertEqual(3, download_file.call_count)
+
+        # The closure of the same packages on another host of the same release and architecture is
+        # neither resolved nor downloaded again.
+        self.installed_packages = ""
+        conn = self.get_conn("host-b")
+        self.distro.install_package(conn, ["gimp", "okular"])
+        commands = [c.args[0] for c in conn.run.call_args_list]
+        self.assertNotIn(self.distro.get_package_uris_cmd("gimp okular"), commands)
+        self.assertNotIn("apt-get update", commands)
+        self.assertEqual(3, conn.put.call_count)
+        self.assertEqual(3, download_file.call_count)
+
+    @patch("pydeploy.utils.Utils._download_file")
+    def test_install_never_downgrades(self, download_file):
+        download_file.side_effect = PackageClosureTest.download_file
+
+        # Installed packages that are older than the closure are upgraded, and those that are
+        # newer are left alone.
+        self.installed_packages = "gimp\tii \t2.10.36-1\nlibgimp2.0\tii \t2.10.30-1\n"
+        conn = self.get_conn()
+        self.package_closure.install(conn, ["gimp", "okular"])
+        self.assertEqual(
+            [
+                os.path.join(PackageClosure.REMOTE_DIR, "libgimp2.0_2.10.34-1_amd64.deb"),
+                os.path.join(PackageClosure.REMOTE_DIR, "okular_4%3a22.12.3-1_amd64.deb"),
+            ],
+            [c.args[1] for c in conn.put.call_args_list],
+        )
+
+    @patch("pydeploy.utils.Utils._download_file")
+    def test_closure_is_resolved_again_by_later_runs(self, download_file):
+        download_file.side_effect = PackageClosureTest.download_file
+        self.distro.install_package(self.get_conn(), ["gimp", "okular"])
+
+        # A later run resolves the closure again, and downloads only the new package files,
+        # unless the closure was resolved within package_index_max_age_sec.
+        for max_age_sec, resolved in [(0, True), (3600, False)]:
+            self.package_closure = PackageClosure(
+                MagicMock(artifact_cache=None, plan=None, package_index_max_age_sec=max_age_sec),
+                self.distro,
+                closures_dir=self.package_closure.closures_dir,
+            )
+            self.distro.package_closure = self.package_closure
+            self.distro.installed_packages = {}
+            self.installed_packages = ""
+            conn = self.get_conn()
+            self.distro.install_package(conn, ["gimp", "okular"])
+            commands = [c.args[0] for c in conn.run.call_args_list]
+            self.assertEqual(resolved, self.distro.get_package_uris_cmd("gimp okular") in commands)
+            self.assertEqual(3, download_file.call_count)
+
+    @patch("pydeploy.utils.Utils._download_file")
+    def test_install_checksum_mismatch(self, download_file):
+        download_file.return_value = {HashAlgo.SHA256SUM: hashlib.sha256(b"").hexdigest()}
+        with self.assertRaises(Exception):
+            self.distro.install_package(self.get_conn(), ["gimp", "okular"])
+        self.assertEqual(0, len(os.listdir(self.package_closure.get_release_dir(self.get_conn()))))
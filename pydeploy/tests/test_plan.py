@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+import sys
+import unittest
+from invoke import Program
+from io import StringIO
+from pydeploy.distributions.debian import Debian
+from pydeploy.plan import Plan
+from pydeploy.program import PyDeployProgram
+from pydeploy.state import StateDb, TaskStatus
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock, patch
+
+
+class PlanTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.state = StateDb(db_path=os.path.join(self.temp_dir.name, "state.db"))
+        self.state.start_run()
+        self.state.save_host_facts("host-a", {"architecture": "arm64", "release": "bookworm"})
+        self.distro = Debian(MagicMock(package_index_max_age_sec=0))
+        self.plan = Plan(self.state, self.distro, ["host-a", "host-b"])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_hosts_without_cached_facts_are_not_planned(self):
+        self.assertEqual(["host-a"], list(self.plan.connections.keys()))
+        self.assertIn("host-b", self.plan.get_report()["hosts"])
+        self.assertIn("error", self.plan.get_report()["hosts"]["host-b"])
+
+    def test_connection_responses(self):
+        conn = self.plan.connections["host-a"]
+        self.assertEqual("arm64", self.distro.get_architecture(conn))
+        self.assertEqual("bookworm", self.distro.get_release(conn))
+
+        # Probes of the host fail and everything else succeeds
+        self.assertTrue(conn.run("helm version", warn=True).failed)
+        self.assertTrue(conn.run("rm -f /tmp/foo").ok)
+
+    def test_report(self):
+        for started_at, duration_sec in [(1.0, 10.0), (2.0, 20.0)]:
+            self.state.save_task_result(
+                "host-a", "install-packages", TaskStatus.SUCCESS, started_at, duration_sec
+            )
+
+        conn = self.plan.connections["host-a"]
+        conn.run("test -d /etc/gnupg", warn=True)
+        with self.plan.record("host-a", "install-packages"):
+            conn.put(StringIO("deb https://example.com stable main"), "/var/tmp/example.list")
+            self.distro.install_package(conn, ["gimp", "okular"])
+        with self.plan.record("host-a", "install-helm"):
+            raise Exception("download failed")
+        self.plan.save_task_result("host-a", "install-maven", TaskStatus.SKIPPED, 0.0)
+
+        report = self.plan.get_report()
+        host_report = report["hosts"]["host-a"]
+        self.assertEqual(["test -d /etc/gnupg"], host_report["probes"])
+        task_report = host_report["tasks"]["install-packages"]
+        self.assertEqual(
+            [
+                self.distro.get_installed_packages_cmd(),
+                self.distro.get_package_sources_hash_cmd(),
+                "apt-get update",
+                "apt-get install -y gimp okular",
+            ],
+            task_report["commands"],
+        )
+        self.assertEqual(["gimp", "okular"], task_report["packages"]["install"])
+        self.assertEqual(15.0, task_report["estimated_duration_sec"])
+        self.assertEqual(35, host_report["push_bytes"])
+        self.assertEqual(
+            "Exception: download failed", host_report["tasks"]["install-helm"]["error"]
+        )
+        self.assertEqual(TaskStatus.SKIPPED, host_report["tasks"]["install-maven"]["status"])
+        self.assertEqual(15.0, report["estimated_duration_sec"])
+
+        # A planned download is pushed at its planned size, without having been downloaded.
+        self.plan.add_download("https://example.com/helm.tar.gz", "/tmp/helm.tar.gz", 1000)
+        with self.plan.record("host-a", "install-helm"):
+            conn.put("/tmp/helm.tar.gz", "/var/tmp/helm.tar.gz")
+        self.assertEqual(1035, self.plan.get_report()["hosts"]["host-a"]["push_bytes"])
+
+        # Nothing that was planned was persisted to the state db
+        self.assertIsNone(self.state.get_last_result("host-a", "install-helm"))
+        self.assertIsNone(self.state.get_last_result("host-a", "install-maven"))
+
+    @patch("sys.stderr", new_callable=StringIO)
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_report_is_the_only_output_on_stdout(self, stdout, stderr):
+        program = PyDeployProgram()
+        program.core = [MagicMock()]
+        program.core[0].args[PyDeployProgram.ARG_PLAN].value = True
+
+        def execute():
+            # Stands in for the tasks, which log, print, and set the plan with load_configs
+            logging.getLogger(__name__).warning("Planning")
+            print("-- Tasks Complete!")
+            program.plan = self.plan
+
+        handler = logging.StreamHandler(sys.stdout)
+        logging.getLogger().addHandler(handler)
+        self.addCleanup(logging.getLogger().removeHandler, handler)
+        with patch.object(Program, "execute", side_effect=execute):
+            program.execute()
+
+        self.assertEqual(self.plan.get_report(), json.loads(stdout.getvalue()))
+        self.assertIn("Planning", stderr.getvalue())
+        self.assertIn("-- Tasks Complete!", stderr.getvalue())
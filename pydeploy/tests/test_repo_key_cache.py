@@ -0,0 +1,63 @@
+import base64
+import unittest
+from pydeploy.repo_key_cache import RepoKeyCache
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock
+
+URL = "https://download.docker.com/linux/debian/gpg"
+KEY = bytes(range(256))
+ARMORED_KEY = (
+    "-----BEGIN PGP PUBLIC KEY BLOCK-----\n"
+    "\n"
+    f"{base64.encodebytes(KEY).decode('ascii')}"
+    "-----END PGP PUBLIC KEY BLOCK-----\n"
+).encode("ascii")
+
+
+def get_response(status_code: int, headers: dict = None, content: bytes = None) -> MagicMock:
+    return MagicMock(
+        status_code=status_code,
+        ok=200 <= status_code < 300,
+        headers=headers or {},
+        content=content,
+    )
+
+
+class RepoKeyCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.session = MagicMock()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_cache(self) -> RepoKeyCache:
+        return RepoKeyCache(cache_dir=self.temp_dir.name)
+
+    def test_revalidates_the_stored_key(self):
+        last_modified = "Tue, 13 Feb 2024 10:00:00 GMT"
+        self.session.get.return_value = get_response(
+            200, {"ETag": '"k1"', "Last-Modified": last_modified}, ARMORED_KEY
+        )
+        self.assertEqual(KEY, self.get_cache().get_key(self.session, URL))
+        self.assertEqual({}, self.session.get.call_args.kwargs["headers"])
+
+        # The next run revalidates the stored key instead of downloading it again.
+        self.session.get.return_value = get_response(304)
+        self.assertEqual(KEY, self.get_cache().get_key(self.session, URL))
+        self.assertEqual(
+            {"If-None-Match": '"k1"', "If-Modified-Since": last_modified},
+            self.session.get.call_args.kwargs["headers"],
+        )
+
+        # A rotated key replaces the stored one.
+        rotated_key = bytes(reversed(KEY))
+        self.session.get.return_value = get_response(200, {"ETag": '"k2"'}, rotated_key)
+        self.assertEqual(rotated_key, self.get_cache().get_key(self.session, URL))
+        self.session.get.return_value = get_response(304)
+        self.assertEqual(rotated_key, self.get_cache().get_key(self.session, URL))
+
+    def test_unavailable_key(self):
+        self.session.get.return_value = get_response(404)
+        with self.assertRaises(Exception):
+            self.get_cache().get_key(self.session, URL)
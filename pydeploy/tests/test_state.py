@@ -0,0 +1,99 @@
+import os
+import time
+import unittest
+from pydeploy.state import StateDb, TaskStatus
+from tempfile import TemporaryDirectory
+
+
+class StateDbTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.state = StateDb(db_path=os.path.join(self.temp_dir.name, "state.db"))
+        self.state.start_run(argv=["workstationsetup", "install-maven"])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_record_success(self):
+        with self.state.record("host-a", "install-maven", "3.6.3", {"version": "3.6.3"}):
+            pass
+        with self.state.record("host-b", "install-maven", "3.9.4", {"version": "3.9.4"}):
+            pass
+
+        self.assertEqual(
+            ["host-a"], self.state.get_hosts_with_tool_version("install-maven", "3.6.3")
+        )
+        actual_result = self.state.get_last_result("host-a", "install-maven")
+        self.assertEqual(TaskStatus.SUCCESS, actual_result["status"])
+        self.assertEqual(StateDb.config_hash({"version": "3.6.3"}), actual_result["config_hash"])
+        self.assertEqual(self.state.run_id, actual_result["run_id"])
+
+    def test_record_failure(self):
+        def fail():
+            with self.state.record("host-a", "install-docker"):
+                raise Exception("apt-get failed")
+
+        self.assertRaises(Exception, fail)
+        with self.state.record("host-b", "install-docker"):
+            pass
+
+        since_sec = time.time() - 7 * 86400
+        self.assertEqual(["host-a"], self.state.get_failed_hosts("install-docker", since_sec))
+        self.assertEqual([], self.state.get_failed_hosts("install-docker", time.time() + 1))
+        actual_result = self.state.get_last_result("host-a", "install-docker")
+        self.assertEqual("Exception: apt-get failed", actual_result["error"])
+
+    def test_is_applied(self):
+        def fail():
+            with self.state.record("host-a", "install-maven", input_hash="abc"):
+                raise Exception("download failed")
+
+        self.assertFalse(self.state.is_applied("host-a", "install-maven", "abc"))
+        with self.state.record("host-a", "install-maven", input_hash="abc"):
+            pass
+        self.assertTrue(self.state.is_applied("host-a", "install-maven", "abc"))
+        self.assertFalse(self.state.is_applied("host-a", "install-maven", "def"))
+        self.assertFalse(self.state.is_applied("host-b", "install-maven", "abc"))
+
+        # Skipped results do not change whether the task is considered applied.
+        self.state.save_task_result(
+            "host-a", "install-maven", TaskStatus.SKIPPED, time.time(), input_hash="abc"
+        )
+        self.assertTrue(self.state.is_applied("host-a", "install-maven", "abc"))
+
+        self.assertRaises(Exception, fail)
+        self.assertFalse(self.state.is_applied("host-a", "install-maven", "abc"))
+
+    def test_record_inputs(self):
+        with self.state.record("host-a", "setup-inotify", inputs=dict(max_user_watches=1048576)):
+            pass
+        with self.state.record("host-b", "setup-inotify"):
+            pass
+
+        actual_result = self.state.get_last_result("host-a", "setup-inotify")
+        self.assertEqual('{"max_user_watches": 1048576}', actual_result["inputs"])
+        self.assertIsNone(self.state.get_last_result("host-b", "setup-inotify")["inputs"])
+
+    def test_save_host_facts(self):
+        self.state.save_host_facts("host-a", {"architecture": "amd64", "release": "bookworm"})
+        self.state.save_host_facts("host-a", {"architecture": "arm64"})
+        self.assertEqual(
+            {"architecture": "arm64", "release": "bookworm"}, self.state.get_host_facts("host-a")
+        )
+
+    def test_save_mirror_choice(self):
+        url = "https://archive.apache.org/dist/maven/maven-3/3.9.4/binaries/apache-maven-3.9.4-bin.tar.gz"
+        mirror_url = (
+            "https://dlcdn.apache.org/maven/maven-3/3.9.4/binaries/apache-maven-3.9.4-bin.tar.gz"
+        )
+        self.state.save_mirror_choice(url, mirror_url, 0.042)
+        self.assertEqual(
+            [dict(url=url, mirror_url=mirror_url, probe_sec=0.042)], self.state.get_mirror_choices()
+        )
+        self.assertEqual([], self.state.get_mirror_choices(run_id="another-run"))
+
+    def test_config_hash_is_stable(self):
+        self.assertEqual(
+            StateDb.config_hash({"a": 1, "b": [1, 2]}),
+            StateDb.config_hash({"b": [1, 2], "a": 1}),
+        )
@@ -1,24 +1,35 @@
+import base64
+import hashlib
 import json
+import logging
 import os
 import requests
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from http_test_server import HttpServerTestCase, QuietHandler
 from pydeploy import utils
+from pydeploy.artifact_cache import ArtifactCache
 from pydeploy.utils import Utils, GitHubReleaseInfo
 from unittest.mock import MagicMock, patch
 
 UPPER = range(97, 123)
 LOWER = range(65, 91)
 
-class UtilsTest(unittest.TestCase):
 
+class UtilsTest(unittest.TestCase):
     def get_test_data_file_path(self, filename) -> str:
         cwd = os.path.dirname(os.path.realpath(__file__))
-        test_data_path =  os.path.join(cwd, "resources", filename)
+        test_data_path = os.path.join(cwd, "resources", filename)
         return test_data_path
 
     def test_get_lines_from_file(self):
         pattern = "draw.io-x64-.*zip.blockmap"
-        expected_result = ["draw.io-x64-21.1.2.zip.blockmap  5b6a2ab55f51a992242e6930dbd74823dac0b85e0cdb8647edd8e80e795c559f"]
+        expected_result = [
+            "draw.io-x64-21.1.2.zip.blockmap  5b6a2ab55f51a992242e6930dbd74823dac0b85e0cdb8647edd8e80e795c559f"
+        ]
         self.exec_test_get_lines_from_file(pattern=pattern, expected_result=expected_result)
 
     def test_get_lines_from_file_no_results(self):
@@ -46,8 +57,7 @@ class UtilsTest(unittest.TestCase):
             actual_result,
         )
 
-    @patch("pydeploy.utils.requests.get")
-    def test_get_github_release_info(self, mock_get):
+    def test_get_github_release_info(self):
         # Load test json data
         cwd = os.path.dirname(os.path.realpath(__file__))
         test_data_json_path = os.path.join(cwd, "resources", "api-github-com-response.json")
@@ -59,25 +69,27 @@ class UtilsTest(unittest.TestCase):
         mock_response = MagicMock()
         mock_response.status_code = 200
         mock_response.json.return_value = test_json_data
-        mock_get.return_value = mock_response
+        configs = MagicMock(github_release_cache=None)
+        configs.get_http_session.return_value.get.return_value = mock_response
 
         artifact_regex = "drawio-amd64-.*.deb"
         hashes_regex = "Files-SHA256-Hashes.txt"
 
         actual_result = Utils.get_github_release_info(
+            configs=configs,
             url="http://example.com/output.json",
             artifact_regex=artifact_regex,
-            hashes_regex=hashes_regex
+            hashes_regex=hashes_regex,
         )
 
         self.assertEqual(
             "https://github.com/jgraph/drawio-desktop/releases/download/v20.8.16/drawio-amd64-20.8.16.deb",
-            actual_result.artifact_url
+            actual_result.artifact_url,
         )
         self.assertEqual("drawio-amd64-20.8.16.deb", actual_result.artifact_filename)
         self.assertEqual(
             "https://github.com/jgraph/drawio-desktop/releases/download/v20.8.16/Files-SHA256-Hashes.txt",
-            actual_result.hashes_url
+            actual_result.hashes_url,
         )
         self.assertEqual("Files-SHA256-Hashes.txt", actual_result.hashes_filename)
 
@@ -149,3 +161,310 @@ class UtilsTest(unittest.TestCase):
                 actual,
                 f"Did not get expected output; input={t['input']}, actual={actual}",
             )
+
+    def test_dearmor_pgp_key(self):
+        key = bytes(range(256)) * 2
+        armored = (
+            "-----BEGIN PGP PUBLIC KEY BLOCK-----\n"
+            "Comment: example\n"
+            "\n"
+            f"{base64.encodebytes(key).decode('ascii')}"
+            "=ABCD\n"
+            "-----END PGP PUBLIC KEY BLOCK-----\n"
+        ).encode("ascii")
+        self.assertEqual(key, Utils.dearmor_pgp_key(armored))
+
+        # Keys that are already binary are returned as is
+        self.assertEqual(key, Utils.dearmor_pgp_key(key))
+
+        # The packets of all of the blocks of a keyring are concatenated
+        rotated_key = bytes(reversed(range(256)))
+        keyring = armored + (
+            "-----BEGIN PGP PUBLIC KEY BLOCK-----\n"
+            "\n"
+            f"{base64.encodebytes(rotated_key).decode('ascii')}"
+            "-----END PGP PUBLIC KEY BLOCK-----\n"
+        ).encode("ascii")
+        self.assertEqual(key + rotated_key, Utils.dearmor_pgp_key(keyring))
+
+    def test_log_to_stderr(self):
+        stream_handler = logging.StreamHandler(sys.stdout)
+        file_handler = logging.FileHandler(os.devnull)
+        root = logging.getLogger()
+        root.addHandler(stream_handler)
+        root.addHandler(file_handler)
+        try:
+            Utils.log_to_stderr()
+            self.assertIs(sys.stderr, stream_handler.stream)
+            self.assertNotEqual(sys.stderr, file_handler.stream)
+        finally:
+            root.removeHandler(stream_handler)
+            root.removeHandler(file_handler)
+            file_handler.close()
+
+    def test_download_file(self):
+        chunks = [b"a" * 1024, b"b" * 10]
+        configs = MagicMock(artifact_cache=None, plan=None)
+        mock_get = configs.get_http_session.return_value.get
+        mock_get.return_value.__enter__.return_value.iter_content.return_value = chunks
+        mock_get.return_value.__enter__.return_value.headers = {}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "artifact")
+            digests = Utils.download_file(
+                configs, "https://example.com/artifact", path, hash_algos=[utils.HashAlgo.MD5SUM]
+            )
+            self.assertEqual(
+                {
+                    utils.HashAlgo.SHA256SUM: hashlib.sha256(b"".join(chunks)).hexdigest(),
+                    utils.HashAlgo.MD5SUM: hashlib.md5(b"".join(chunks)).hexdigest(),
+                },
+                digests,
+            )
+
+            # A mismatched checksum removes the downloaded file
+            with self.assertRaises(Exception):
+                Utils.download_file(configs, "https://example.com/artifact", path, checksum="0")
+            self.assertFalse(os.path.exists(path))
+
+
+class RangeHandler(QuietHandler):
+    contents = b""
+    accept_ranges = True
+    etag = None
+    # The number of bytes of the body after which the connection of the next response is dropped.
+    drop_after = None
+    ranges = []
+
+    @staticmethod
+    def reset(contents: bytes) -> None:
+        RangeHandler.contents = contents
+        RangeHandler.accept_ranges = True
+        RangeHandler.etag = None
+        RangeHandler.drop_after = None
+        RangeHandler.ranges = []
+
+    def do_GET(self):
+        body = RangeHandler.contents
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if (
+            range_header is None
+            or not RangeHandler.accept_ranges
+            or (if_range is not None and if_range != RangeHandler.etag)
+        ):
+            self.send_response(200)
+        else:
+            start, end = range_header.removeprefix("bytes=").split("-")
+            start, end = int(start), int(end or len(body) - 1)
+            RangeHandler.ranges.append((start, end))
+            body = body[start : end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(RangeHandler.contents)}")
+        if RangeHandler.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if RangeHandler.etag is not None:
+            self.send_header("ETag", RangeHandler.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if RangeHandler.drop_after is not None:
+            self.wfile.write(body[: RangeHandler.drop_after])
+            self.wfile.flush()
+            RangeHandler.drop_after = None
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+class RangeDownloadTestCase(HttpServerTestCase):
+    """
+    Base class for the tests that download an artifact from a RangeHandler server.
+    """
+
+    def setUp(self):
+        RangeHandler.reset(os.urandom(4096))
+        _, server_url = self.start_server(RangeHandler)
+        self.url = f"{server_url}/artifact"
+        self.configs = self.get_configs(artifact_cache=None, plan=None)
+        self.temp_dir = self.get_temp_dir()
+        self.path = os.path.join(self.temp_dir.name, "artifact")
+
+
+@patch.multiple(
+    Utils, SEGMENTED_DOWNLOAD_MIN_BYTES=1024, SEGMENT_MIN_BYTES=256, SEGMENT_MAX_BYTES=256
+)
+class SegmentedDownloadTest(RangeDownloadTestCase):
+    def setUp(self):
+        super().setUp()
+        RangeHandler.contents = os.urandom(4096 + 100)
+
+    def download(self) -> dict:
+        digests = Utils.download_file(
+            self.configs,
+            self.url,
+            self.path,
+            checksum=hashlib.sha256(RangeHandler.contents).hexdigest(),
+            hash_algos=[utils.HashAlgo.MD5SUM],
+        )
+        with open(self.path, "rb") as f:
+            self.assertEqual(RangeHandler.contents, f.read())
+        self.assertEqual(
+            hashlib.md5(RangeHandler.contents).hexdigest(), digests[utils.HashAlgo.MD5SUM]
+        )
+        return digests
+
+    def test_download_file_segments(self):
+        self.download()
+        self.assertEqual(17, len(RangeHandler.ranges))
+        self.assertEqual((4096, 4195), max(RangeHandler.ranges))
+
+    def test_download_file_without_ranges(self):
+        RangeHandler.accept_ranges = False
+        self.download()
+        self.assertEqual([], RangeHandler.ranges)
+
+    def test_download_file_small(self):
+        RangeHandler.contents = os.urandom(1000)
+        self.download()
+        self.assertEqual([], RangeHandler.ranges)
+
+
+@patch.object(Utils, "DOWNLOAD_RETRY_DELAY_SEC", 0)
+class ResumableDownloadTest(RangeDownloadTestCase):
+    def setUp(self):
+        super().setUp()
+        RangeHandler.etag = '"v1"'
+        RangeHandler.drop_after = 3000
+        self.configs.artifact_cache = ArtifactCache(
+            cache_dir=os.path.join(self.temp_dir.name, "cache")
+        )
+
+    def download(self):
+        Utils.download_file(
+            self.configs,
+            self.url,
+            self.path,
+            chunk_size=256,
+            checksum=hashlib.sha256(RangeHandler.contents).hexdigest(),
+        )
+        with open(self.path, "rb") as f:
+            self.assertEqual(RangeHandler.contents, f.read())
+
+    def test_download_file_resumes_after_dropped_connection(self):
+        self.download()
+        self.assertEqual(1, len(RangeHandler.ranges))
+        self.assertGreater(RangeHandler.ranges[0][0], 0)
+        self.assertEqual([], os.listdir(self.configs.artifact_cache.partials_dir))
+
+    @patch.object(Utils, "DOWNLOAD_ATTEMPTS", 1)
+    def test_download_file_resumes_partial_download_of_previous_run(self):
+        with self.assertRaises(requests.ConnectionError):
+            self.download()
+        self.assertEqual(2, len(os.listdir(self.configs.artifact_cache.partials_dir)))
+
+        self.download()
+        self.assertEqual(1, len(RangeHandler.ranges))
+        self.assertGreater(RangeHandler.ranges[0][0], 0)
+        self.assertEqual([], os.listdir(self.configs.artifact_cache.partials_dir))
+
+    def test_download_file_restarts_partial_download_of_changed_file(self):
+        # The file changed since the partial download, so the server ignores the requested range
+        # and the download restarts from the beginning rather than splicing the two files.
+        RangeHandler.drop_after = None
+        with open(self.path, "wb") as f:
+            f.write(os.urandom(1000))
+        with open(Utils.get_validators_path(self.path), "w") as f:
+            json.dump(dict(url=self.url, etag='"v0"', last_modified=None), f)
+        digests = Utils._download_file(
+            self.configs, self.url, self.path, 256, [utils.HashAlgo.SHA256SUM]
+        )
+        self.assertEqual(
+            hashlib.sha256(RangeHandler.contents).hexdigest(), digests[utils.HashAlgo.SHA256SUM]
+        )
+        with open(self.path, "rb") as f:
+            self.assertEqual(RangeHandler.contents, f.read())
+        self.assertEqual([], RangeHandler.ranges)
+        self.assertFalse(os.path.exists(Utils.get_validators_path(self.path)))
+
+
+class ConcurrentFetchTest(unittest.TestCase):
+    def test_map_concurrently(self):
+        lock = threading.Lock()
+        running = []
+        max_running = []
+
+        def fetch(item):
+            with lock:
+                running.append(item)
+                max_running.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(item)
+            if item == 3:
+                raise ValueError(item)
+            return item * 2
+
+        self.assertEqual([0, 2, 4], Utils.map_concurrently(fetch, [0, 1, 2]))
+        self.assertEqual(3, max(max_running))
+
+        max_running.clear()
+        with self.assertRaises(ValueError):
+            Utils.map_concurrently(fetch, list(range(8)), max_workers=2)
+        self.assertEqual(2, max(max_running))
+        self.assertEqual(8, len(max_running))
+
+    @patch("pydeploy.utils.Utils._download_file")
+    def test_download_github_artifact_and_checksum(self, download_file):
+        artifact = b"artifact"
+        hashes = f"{hashlib.sha256(artifact).hexdigest()}  tool-amd64.tar.gz\n".encode("utf-8")
+
+        def download(configs, url, target_local_path, chunk_size, hash_algos):
+            contents = hashes if url.endswith(".sha256") else artifact
+            with open(target_local_path, "wb") as f:
+                f.write(contents)
+            return {algo: Utils.get_file_hash(target_local_path, algo) for algo in hash_algos}
+
+        download_file.side_effect = download
+        info = GitHubReleaseInfo(
+            "https://example.com/tool-amd64.tar.gz",
+            "tool-amd64.tar.gz",
+            "https://example.com/tool-amd64.tar.gz.sha256",
+            "tool-amd64.tar.gz.sha256",
+            "v1",
+        )
+        configs = MagicMock(artifact_cache=None, plan=None)
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        artifact_local_path, _ = Utils.download_github_artifact_and_checksum(
+            configs, info, temp_dir
+        )
+        with open(artifact_local_path, "rb") as f:
+            self.assertEqual(artifact, f.read())
+
+        # An artifact that does not match the checksum in the hashes file is removed
+        artifact = b"corrupt"
+        with self.assertRaises(Exception):
+            Utils.download_github_artifact_and_checksum(configs, info, temp_dir)
+        self.assertFalse(os.path.exists(artifact_local_path))
+
+
+@patch.object(Utils, "PLAN_DOWNLOAD_MAX_BYTES", 1024)
+class PlanDownloadTest(RangeDownloadTestCase):
+    def setUp(self):
+        super().setUp()
+        self.configs.plan = MagicMock()
+
+    def test_download_file_is_only_sized(self):
+        checksum = hashlib.sha256(RangeHandler.contents).hexdigest()
+        digests = Utils.download_file(self.configs, self.url, self.path, checksum=checksum)
+        self.assertEqual({utils.HashAlgo.SHA256SUM: checksum}, digests)
+        self.configs.plan.add_download.assert_called_once_with(self.url, self.path, 4096)
+        self.assertFalse(os.path.exists(self.path))
+        # The server does not support HEAD, so only the first byte was requested.
+        self.assertEqual([(0, 0)], RangeHandler.ranges)
+
+    def test_download_small_file(self):
+        RangeHandler.contents = os.urandom(1000)
+        Utils.download_file(self.configs, self.url, self.path)
+        self.configs.plan.add_download.assert_called_once_with(self.url, self.path)
+        with open(self.path, "rb") as f:
+            self.assertEqual(RangeHandler.contents, f.read())
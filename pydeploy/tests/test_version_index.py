@@ -0,0 +1,99 @@
+import json
+import unittest
+from pydeploy.version_index import VersionIndex
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock, patch
+
+URL = "https://services.gradle.org/versions/all"
+VERSIONS_JSON = [
+    {
+        "version": "8.6",
+        "snapshot": False,
+        "downloadUrl": "https://services.gradle.org/distributions/gradle-8.6-bin.zip",
+        "checksumUrl": "https://services.gradle.org/distributions/gradle-8.6-bin.zip.sha256",
+    },
+    {
+        "version": "8.5",
+        "snapshot": False,
+        "downloadUrl": "https://services.gradle.org/distributions/gradle-8.5-bin.zip",
+        "checksumUrl": "https://services.gradle.org/distributions/gradle-8.5-bin.zip.sha256",
+    },
+]
+
+
+def get_response(status_code: int, headers: dict = None, versions_json: list = None) -> MagicMock:
+    r = MagicMock(status_code=status_code, headers=headers or {})
+    r.__enter__.return_value = r
+    contents = json.dumps(versions_json, indent=2).encode("utf-8") if versions_json else b""
+    # Split the manifest into chunks that end in the middle of its elements.
+    r.iter_content.return_value = [contents[i : i + 7] for i in range(0, len(contents), 7)]
+    return r
+
+
+class VersionIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.session = MagicMock()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_index(self, max_age_sec: int = VersionIndex.MAX_AGE_SEC_DEFAULT) -> VersionIndex:
+        return VersionIndex(cache_dir=self.temp_dir.name, max_age_sec=max_age_sec)
+
+    def test_parse_json_array(self):
+        chunks = [b'[{"version": "1\xc3', b'\xa9"}, {"v', b'ersion": [1, 2]}', b" ]"]
+        self.assertEqual(
+            [{"version": "1é"}, {"version": [1, 2]}],
+            list(VersionIndex.parse_json_array(chunks)),
+        )
+        self.assertEqual([12, 3], list(VersionIndex.parse_json_array([b"[1", b"2", b",3]"])))
+        self.assertEqual([], list(VersionIndex.parse_json_array([b"[]"])))
+        with self.assertRaises(ValueError):
+            list(VersionIndex.parse_json_array([b'[{"version": "1"}']))
+        with self.assertRaises(ValueError):
+            list(VersionIndex.parse_json_array([b'{"version": "1"}']))
+
+    def test_get_version(self):
+        self.session.get.return_value = get_response(200, {"ETag": '"a1"'}, VERSIONS_JSON)
+        self.assertEqual(
+            (VERSIONS_JSON[1]["downloadUrl"], VERSIONS_JSON[1]["checksumUrl"]),
+            self.get_index().get_version(self.session, "gradle", URL, "8.5"),
+        )
+
+        # A fresh index is used by the next run without requesting the manifest.
+        index = self.get_index()
+        self.assertEqual(
+            VERSIONS_JSON[0]["downloadUrl"],
+            index.get_version(self.session, "gradle", URL, "8.6")[0],
+        )
+        self.assertEqual(1, self.session.get.call_count)
+
+        # A version that is not in the index has the index revalidated once.
+        self.session.get.return_value = get_response(304)
+        with self.assertRaises(Exception):
+            index.get_version(self.session, "gradle", URL, "8.7")
+        self.assertEqual(2, self.session.get.call_count)
+        self.assertEqual('"a1"', self.session.get.call_args.kwargs["headers"]["If-None-Match"])
+
+    @patch("pydeploy.version_index.time.time")
+    def test_revalidates_stale_index(self, time):
+        time.return_value = 1000.0
+        self.session.get.return_value = get_response(200, {"ETag": '"a1"'}, VERSIONS_JSON)
+        self.get_index(max_age_sec=60).get_version(self.session, "gradle", URL, "8.5")
+
+        # An unchanged manifest is not downloaded again, and the index is fresh for another
+        # max_age_sec.
+        time.return_value = 1100.0
+        self.session.get.return_value = get_response(304)
+        self.get_index(max_age_sec=60).get_version(self.session, "gradle", URL, "8.5")
+        self.assertEqual('"a1"', self.session.get.call_args.kwargs["headers"]["If-None-Match"])
+        self.get_index(max_age_sec=60).get_version(self.session, "gradle", URL, "8.5")
+        self.assertEqual(2, self.session.get.call_count)
+
+        # A changed manifest replaces the index.
+        time.return_value = 1200.0
+        self.session.get.return_value = get_response(200, {"ETag": '"a2"'}, VERSIONS_JSON[:1])
+        with self.assertRaises(Exception):
+            self.get_index(max_age_sec=60).get_version(self.session, "gradle", URL, "8.5")
+        self.assertEqual(3, self.session.get.call_count)
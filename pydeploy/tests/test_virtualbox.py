@@ -59,3 +59,40 @@ class VirtualBoxTest(unittest.TestCase):
                 else:
                     actual_result = VirtualBox.parse_installed_extpacks(t["stdout"])
                     self.assertEqual(t["expected_result"], actual_result)
+
+    def test_is_extpack_install_required(self):
+        test_data = [
+            {
+                "name": "VirtualBox not installed",
+                "failed": True,
+                "stdout": "",
+                "expected_result": True,
+            },
+            {
+                "name": "No extension packs",
+                "failed": False,
+                "stdout": EXTPACK_STDOUT_ZERO_ENTRIES,
+                "expected_result": True,
+            },
+            {
+                "name": "Configured extension pack installed",
+                "failed": False,
+                "stdout": EXTPACK_STDOUT_ONE_ENTRY,
+                "expected_result": False,
+            },
+            {
+                "name": "Different extension pack version installed",
+                "failed": False,
+                "stdout": EXTPACK_STDOUT_ONE_ENTRY.replace("6.1.44", "6.1.40"),
+                "expected_result": True,
+            },
+        ]
+
+        ctx = MagicMock()
+        ctx.distro.get_task_configs.return_value = {"version": "6.1.44", "revision": 156814}
+        for t in test_data:
+            with self.subTest(f"{t['name']}"):
+                conn = MagicMock()
+                conn.run.return_value = MagicMock(failed=t["failed"], stdout=t["stdout"])
+                actual_result = VirtualBox.is_extpack_install_required(ctx, conn, "amd64")
+                self.assertEqual(t["expected_result"], actual_result)
@@ -1,4 +1,6 @@
+import base64
 import hashlib
+import json
 import logging
 import os
 import re
@@ -8,6 +10,7 @@ import sys
 import time
 import yaml
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum, auto
 from invoke import Context
 from fabric import Connection
@@ -18,7 +21,9 @@ from typing import Tuple
 from pydeploy.enums import ArchiveType
 
 GitHubReleaseInfo = namedtuple(
-    "GitHubReleaseInfo", "artifact_url, artifact_filename, hashes_url, hashes_filename"
+    "GitHubReleaseInfo",
+    "artifact_url, artifact_filename, hashes_url, hashes_filename, tag_name",
+    defaults=(None,),
 )
 logging.basicConfig(
     format="%(asctime)s,%(levelname)s,%(module)s,%(message)s",
@@ -36,6 +41,31 @@ class HashAlgo(Enum):
 
 
 class Utils(object):
+    # The size of the chunks in which files are downloaded and hashed; large enough that the
+    # per-chunk Python overhead is negligible next to the I/O.
+    CHUNK_SIZE = 1024 * 1024
+
+    # Files of at least this size are downloaded in concurrent byte range segments, when the server
+    # accepts ranges, with segments sized between the min and the max so that there are several
+    # per worker.
+    SEGMENTED_DOWNLOAD_MIN_BYTES = 32 * 1024 * 1024
+    SEGMENTED_DOWNLOAD_MAX_WORKERS = 8
+    SEGMENT_MIN_BYTES = 1024 * 1024
+    SEGMENT_MAX_BYTES = 8 * 1024 * 1024
+
+    # Interrupted downloads are retried, resuming from where they were interrupted when the server
+    # provides validators for the file.
+    DOWNLOAD_ATTEMPTS = 3
+    DOWNLOAD_RETRY_DELAY_SEC = 1
+
+    # The number of the independent fetches of the dependencies of a task, such as the artifacts
+    # of each architecture, that are made concurrently.
+    FETCH_MAX_WORKERS = 4
+
+    # When planning, files of at most this size, such as checksum files, which the tasks read, are
+    # still downloaded.  Larger files are only sized.
+    PLAN_DOWNLOAD_MAX_BYTES = 1024 * 1024
+
     @staticmethod
     def convert_pem_cert_to_der(cert_path: str, temp_dir: TemporaryDirectory) -> Tuple[str, str]:
         # Figure out the name of the file minus the ".pem" suffix
@@ -52,44 +82,387 @@ class Utils(object):
         return der_file_name, der_file_path
 
     @staticmethod
-    def download_file(configs, url: str, target_local_path: str, chunk_size=8192):
+    def dearmor_pgp_key(key_contents: bytes) -> bytes:
+        """
+        Returns the binary OpenPGP packets of the ASCII armored key, as gpg --dearmor does.  The
+        packets of a file of several armored blocks, such as a keyring of a primary and a rotated
+        key, are concatenated.  Keys that are not armored are returned as is.
+        """
+        lines = key_contents.decode("ascii", errors="replace").strip().splitlines()
+        if not lines or not lines[0].startswith("-----BEGIN PGP"):
+            return key_contents
+
+        # The armor headers of each block are separated from its base64 body by a blank line, and
+        # the body is followed by an optional "=" prefixed checksum line and the END line.
+        retval = b""
+        body = None
+        in_headers = False
+        for line in lines:
+            line = line.strip()
+            if line.startswith("-----BEGIN PGP"):
+                body, in_headers = [], True
+            elif body is None:
+                continue
+            elif line.startswith("-----END PGP"):
+                retval += base64.b64decode("".join(body))
+                body = None
+            elif in_headers and (line == "" or ": " in line):
+                in_headers = line != ""
+            elif not line.startswith("="):
+                in_headers = False
+                body.append(line)
+        return retval
+
+    @staticmethod
+    def download_file(
+        configs,
+        url: str,
+        target_local_path: str,
+        chunk_size=CHUNK_SIZE,
+        checksum: str = None,
+        hash_algo: HashAlgo = HashAlgo.SHA256SUM,
+        hash_algos: list[HashAlgo] = None,
+        mirror_urls: list[str] = None,
+    ) -> dict[HashAlgo, str]:
+        """
+        Downloads the file at the url to the target_local_path and returns the dict of HashAlgo to
+        the hex digest of the file for the hash_algo and any additional hash_algos, which are
+        computed while the file is downloaded.
+
+        If the expected checksum of the file is provided, the file is verified against it, raising
+        an Exception if it does not match, and is served from the configs.artifact_cache when it has
+        already been downloaded.
+
+        The mirror_urls are urls of the same file on other mirrors.  The file is downloaded from
+        the fastest of the url and the mirror_urls, see Mirrors, falling back to the others when a
+        download fails.  It is still looked up in the artifact cache by the url.
+
+        When planning, a file larger than PLAN_DOWNLOAD_MAX_BYTES is only sized, see
+        Utils.plan_download, and nothing is written to the target_local_path.
+        """
         # We cannot include the type-hint for the configs parameter because it would otherwise cause
         # a circular import.
+        hash_algos = list(dict.fromkeys([hash_algo] + (hash_algos or [])))
+        if configs.plan is not None:
+            size = Utils.get_download_size(configs, url)
+            if size is not None and size > Utils.PLAN_DOWNLOAD_MAX_BYTES:
+                return Utils.plan_download(
+                    configs, url, target_local_path, size, checksum, hash_algo
+                )
+        if checksum is not None and configs.artifact_cache is not None:
+            digests = configs.artifact_cache.fetch(
+                url,
+                checksum,
+                hash_algo,
+                target_local_path,
+                lambda path, algos: Utils._download_file_from_mirrors(
+                    configs, [url] + (mirror_urls or []), path, chunk_size, algos
+                ),
+            )
+            for algo in hash_algos:
+                if algo not in digests:
+                    digests[algo] = Utils.get_file_hash(target_local_path, algo)
+        else:
+            digests = Utils._download_file_from_mirrors(
+                configs, [url] + (mirror_urls or []), target_local_path, chunk_size, hash_algos
+            )
+            if checksum is not None and digests[hash_algo] != checksum.lower():
+                os.remove(target_local_path)
+                raise Exception(
+                    f"Downloaded file checksum mismatch; url={url}, checksum={checksum}, "
+                    f"actual_checksum={digests[hash_algo]}, hash_algo={hash_algo}"
+                )
+        if configs.plan is not None:
+            configs.plan.add_download(url, target_local_path)
+        return digests
+
+    @staticmethod
+    def _download_file(
+        configs,
+        url: str,
+        target_local_path: str,
+        chunk_size: int,
+        hash_algos: list[HashAlgo],
+        segmented: bool = True,
+    ) -> dict[HashAlgo, str]:
         logging.info(f"Downloading file, url={url} target_local_path={target_local_path}")
 
-        # The stream=True parameter enables us to download large files in chunks
-        verify = configs.is_request_verify()
-        with requests.get(url, stream=True, verify=verify) as r:
-            r.raise_for_status()
-            with open(target_local_path, "wb") as f:
-                for chunk in r.iter_content(chunk_size=chunk_size):
-                    f.write(chunk)
+        # The file is hashed as it is streamed, rather than read back once it is written.  Only the
+        # part of the file left by an interrupted download, if any, is read back.
+        session = configs.get_http_session()
+        validators_path = Utils.get_validators_path(target_local_path)
+        hashers, offset, validators = Utils.get_partial_download(
+            url, target_local_path, chunk_size, hash_algos
+        )
+        attempt = 1
+        while True:
+            headers = {}
+            if offset > 0:
+                # If the file changed since the partial download, If-Range has the server respond
+                # with all of it instead of the requested range.
+                headers["Range"] = f"bytes={offset}-"
+                headers["If-Range"] = validators.get("etag") or validators.get("last_modified")
+            try:
+                with session.get(url, stream=True, headers=headers) as r:
+                    r.raise_for_status()
+                    if offset > 0 and not Utils.is_range_response(r, offset):
+                        logging.info(f"Partial download is stale, restarting; url={url}")
+                        hashers = {algo: Utils.get_hasher(algo) for algo in hash_algos}
+                        offset = 0
+                    if offset == 0:
+                        size = Utils.get_segmented_download_size(r) if segmented else None
+                        if size is not None:
+                            # Ranges are requested from the url that the redirects, if any,
+                            # resolved to.
+                            range_url = r.url
+                            break
+                        validators = Utils.put_validators(url, r, validators_path)
+                    expected_size = Utils.get_expected_size(r, offset)
+                    with open(
+                        target_local_path, "ab" if offset else "wb", buffering=chunk_size
+                    ) as f:
+                        for chunk in r.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+                            offset += len(chunk)
+                            for h in hashers.values():
+                                h.update(chunk)
+                    # A connection that is closed early does not otherwise raise.
+                    if expected_size is not None and offset < expected_size:
+                        raise requests.ConnectionError(
+                            f"Connection closed before the end of the file; url={url}, "
+                            f"bytes={offset}, expected_bytes={expected_size}"
+                        )
+                if os.path.exists(validators_path):
+                    os.remove(validators_path)
+                return {algo: h.hexdigest() for algo, h in hashers.items()}
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+            ) as e:
+                if attempt >= Utils.DOWNLOAD_ATTEMPTS:
+                    raise
+                if not validators:
+                    hashers = {algo: Utils.get_hasher(algo) for algo in hash_algos}
+                    offset = 0
+                logging.warning(
+                    f"Download interrupted, retrying; url={url}, offset={offset}, "
+                    f"attempt={attempt}, error={e}"
+                )
+                time.sleep(Utils.DOWNLOAD_RETRY_DELAY_SEC * attempt)
+                attempt += 1
+
+        # The segments are written in place, so the file cannot be resumed from its size.
+        if os.path.exists(validators_path):
+            os.remove(validators_path)
+        try:
+            Utils.download_file_segments(
+                session, range_url, target_local_path, size, hashers.values()
+            )
+        except Exception as e:
+            logging.warning(f"Segmented download failed, streaming instead; url={url}, error={e}")
+            return Utils._download_file(
+                configs, url, target_local_path, chunk_size, hash_algos, segmented=False
+            )
+        return {algo: h.hexdigest() for algo, h in hashers.items()}
+
+    @staticmethod
+    def _download_file_from_mirrors(
+        configs,
+        urls: list[str],
+        target_local_path: str,
+        chunk_size: int,
+        hash_algos: list[HashAlgo],
+    ) -> dict[HashAlgo, str]:
+        # The mirrors are only raced when the file is not already in the artifact cache.
+        if len(urls) > 1:
+            urls = configs.mirrors.get_ordered_urls(urls)
+        for i, url in enumerate(urls):
+            try:
+                return Utils._download_file(configs, url, target_local_path, chunk_size, hash_algos)
+            except requests.RequestException as e:
+                if i == len(urls) - 1:
+                    raise
+                logging.warning(
+                    f"Download failed, falling back to the next mirror; url={url}, "
+                    f"next_url={urls[i + 1]}, error={e}"
+                )
+
+    @staticmethod
+    def get_download_size(configs, url: str) -> int:
+        """
+        Returns the size of the file at the url from the Content-Length of a HEAD request or, if
+        the server does not provide one, from the Content-Range of a request for its first byte;
+        otherwise None.
+        """
+        session = configs.get_http_session()
+        r = session.head(url, allow_redirects=True)
+        if r.ok and r.headers.get("Content-Length") and not r.headers.get("Content-Encoding"):
+            return int(r.headers["Content-Length"])
+        with session.get(url, headers={"Range": "bytes=0-0"}, stream=True) as r:
+            content_range = r.headers.get("Content-Range", "")
+            if r.status_code == 206 and content_range.rpartition("/")[2].isdigit():
+                return int(content_range.rpartition("/")[2])
+        return None
+
+    @staticmethod
+    def get_partial_download(
+        url: str, target_local_path: str, chunk_size: int, hash_algos: list[HashAlgo]
+    ) -> Tuple[dict, int, dict]:
+        """
+        Returns the hashers updated with the contents of the partial download of the url at the
+        target_local_path, the number of bytes already downloaded and the validators, see
+        put_validators, with which to resume it.  There is no partial download to resume when the
+        number of bytes is 0.
+        """
+        hashers = {algo: Utils.get_hasher(algo) for algo in hash_algos}
+        validators_path = Utils.get_validators_path(target_local_path)
+        if not os.path.exists(target_local_path) or not os.path.exists(validators_path):
+            return hashers, 0, {}
+        with open(validators_path, "r") as f:
+            validators = json.load(f)
+        if validators.get("url") != url:
+            return hashers, 0, {}
+
+        offset = 0
+        with open(target_local_path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                offset += len(chunk)
+                for h in hashers.values():
+                    h.update(chunk)
+        logging.info(f"Resuming partial download; url={url}, offset={offset}")
+        return hashers, offset, validators
+
+    @staticmethod
+    def get_expected_size(r: Response, offset: int) -> int:
+        """
+        Returns the size of the file once the body of the response is appended at the offset, or
+        None if the size is not known in advance.
+        """
+        if r.headers.get("Content-Encoding"):
+            return None
+        try:
+            return offset + int(r.headers.get("Content-Length"))
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def get_validators_path(target_local_path: str) -> str:
+        return f"{target_local_path}.validators"
+
+    @staticmethod
+    def is_range_response(r: Response, offset: int) -> bool:
+        return r.status_code == 206 and r.headers.get("Content-Range", "").startswith(
+            f"bytes {offset}-"
+        )
+
+    @staticmethod
+    def put_validators(url: str, r: Response, validators_path: str) -> dict:
+        """
+        Writes the ETag and Last-Modified validators of the response next to the file to which it
+        is downloaded, so that the download can be resumed if it is interrupted, and returns them.
+        Downloads without either validator are not resumable, and an empty dict is returned.
+        """
+        validators = {}
+        if r.headers.get("ETag") or r.headers.get("Last-Modified"):
+            validators = dict(
+                url=url, etag=r.headers.get("ETag"), last_modified=r.headers.get("Last-Modified")
+            )
+            with open(validators_path, "w") as f:
+                json.dump(validators, f)
+        elif os.path.exists(validators_path):
+            os.remove(validators_path)
+        return validators
+
+    @staticmethod
+    def get_segmented_download_size(r: Response) -> int:
+        """
+        Returns the size of the file of the response if it is large enough to be downloaded in
+        concurrent segments and the server accepts byte ranges for it, otherwise None.
+        """
+        if r.headers.get("Accept-Ranges") != "bytes" or r.headers.get("Content-Encoding"):
+            return None
+        try:
+            size = int(r.headers.get("Content-Length"))
+        except (TypeError, ValueError):
+            return None
+        return size if size >= Utils.SEGMENTED_DOWNLOAD_MIN_BYTES else None
+
+    @staticmethod
+    def download_file_segments(
+        session: requests.Session, url: str, target_local_path: str, size: int, hashers: list
+    ) -> None:
+        """
+        Downloads the file of the given size at the url to the target_local_path in byte range
+        segments that are fetched concurrently and written in place into the preallocated file.
+
+        The hashers are updated with each segment once all of the segments before it have
+        completed, and at most a window of segments is held in memory at any time.
+        """
+        # Aim for several segments per worker, so that a slow segment does not hold up the others
+        # for long, while keeping the per-request overhead small next to the size of a segment.
+        segment_size = min(
+            max(size // (Utils.SEGMENTED_DOWNLOAD_MAX_WORKERS * 8), Utils.SEGMENT_MIN_BYTES),
+            Utils.SEGMENT_MAX_BYTES,
+        )
+        segments = [
+            (start, min(start + segment_size, size)) for start in range(0, size, segment_size)
+        ]
+        workers = min(Utils.SEGMENTED_DOWNLOAD_MAX_WORKERS, len(segments))
+        window = workers * 2
+        logging.info(
+            f"Downloading file in segments; url={url}, size={size}, segments={len(segments)}, "
+            f"workers={workers}"
+        )
+
+        with open(target_local_path, "wb") as f:
+            f.truncate(size)
+        fd = os.open(target_local_path, os.O_WRONLY)
+
+        def fetch_segment(start: int, end: int) -> bytes:
+            headers = {"Range": f"bytes={start}-{end - 1}"}
+            for attempt in range(1, Utils.DOWNLOAD_ATTEMPTS + 1):
+                try:
+                    with session.get(url, headers=headers) as r:
+                        r.raise_for_status()
+                        content = r.content
+                        break
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if attempt >= Utils.DOWNLOAD_ATTEMPTS:
+                        raise
+                    logging.warning(
+                        f"Segment download interrupted, retrying; url={url}, "
+                        f"range={headers['Range']}, attempt={attempt}, error={e}"
+                    )
+                    time.sleep(Utils.DOWNLOAD_RETRY_DELAY_SEC * attempt)
+            if not Utils.is_range_response(r, start) or len(content) != end - start:
+                raise Exception(
+                    f"Server did not return the requested range; url={url}, "
+                    f"range={headers['Range']}, status_code={r.status_code}, bytes={len(content)}"
+                )
+            os.pwrite(fd, content, start)
+            return content
+
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = {}
+            for i in range(len(segments)):
+                for j in range(len(futures) + i, min(i + window, len(segments))):
+                    futures[j] = pool.submit(fetch_segment, *segments[j])
+                data = futures.pop(i).result()
+                for h in hashers:
+                    h.update(data)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            os.close(fd)
 
     @staticmethod
     def file_checksum(
-        file_path: str, checksum: str, hash_algo: HashAlgo, chunk_size: int = 1024
+        file_path: str, checksum: str, hash_algo: HashAlgo, chunk_size: int = CHUNK_SIZE
     ) -> bool:
-        h = None
-        match hash_algo:
-            case HashAlgo.MD5SUM:
-                h = hashlib.md5()
-            case HashAlgo.SHA1SUM:
-                h = hashlib.sha1()
-            case HashAlgo.SHA256SUM:
-                h = hashlib.sha256()
-            case HashAlgo.SHA512SUM:
-                h = hashlib.sha512()
-
-        # Open the file for reading in binary mode
-        with open(file_path, "rb") as f:
-            # Loop until we finish reading the entire file reading the file a chunk at a time
-            chunk = 0
-            while chunk != b"":
-                chunk = f.read(chunk_size)
-                h.update(chunk)
         # Generate a hexadecimal representation of the hash digest and compare it against
         # the check sum that was passed in.
-        actual_checksum = h.hexdigest()
+        actual_checksum = Utils.get_file_hash(file_path, hash_algo, chunk_size)
 
         if checksum != actual_checksum:
             logging.error(
@@ -106,20 +479,9 @@ class Utils(object):
         hashes_line_token: int,
         hash_algo: HashAlgo,
     ) -> bool:
-        checksum_lines = Utils.get_lines_from_file(
-            path=hashes_file_path, pattern=hashes_file_pattern
+        checksum = Utils.get_checksum_from_checksum_file(
+            hashes_file_path, hashes_file_pattern, hashes_line_token
         )
-        if len(checksum_lines) != 1:
-            raise Exception(
-                "Extracting lines from checksum file.  No lines extracted; "
-                f"file_path={file_path}, "
-                f"hashes_file_path={hashes_file_path}, "
-                f"hashes_file_pattern={hashes_file_pattern}, "
-            )
-
-        # The hashes_line_token indicates the token the the array in which the hash should be after
-        # we split the line extracted from the hashes_file_path on whitespace.
-        checksum = checksum_lines[0].split()[hashes_line_token]
         if Utils.file_checksum(file_path=file_path, checksum=checksum, hash_algo=hash_algo):
             return True
         return False
@@ -140,6 +502,24 @@ class Utils(object):
             return False
         return True
 
+    @staticmethod
+    def get_checksum_from_checksum_file(
+        hashes_file_path: str, hashes_file_pattern: str, hashes_line_token: int
+    ) -> str:
+        checksum_lines = Utils.get_lines_from_file(
+            path=hashes_file_path, pattern=hashes_file_pattern
+        )
+        if len(checksum_lines) != 1:
+            raise Exception(
+                "Extracting lines from checksum file.  No lines extracted; "
+                f"hashes_file_path={hashes_file_path}, "
+                f"hashes_file_pattern={hashes_file_pattern}, "
+            )
+
+        # The hashes_line_token indicates the token the the array in which the hash should be after
+        # we split the line extracted from the hashes_file_path on whitespace.
+        return checksum_lines[0].split()[hashes_line_token]
+
     @staticmethod
     def get_file_type(path: str, ctx: Context = None, conn: Connection = None) -> str:
         Utils._is_ctx_or_conn(ctx, conn)
@@ -151,9 +531,36 @@ class Utils(object):
         else:
             raise Exception(f"Unable to get file type, cmd={cmd}, stderr={r.stderr}")
 
+    @staticmethod
+    def get_file_hash(
+        file_path: str, hash_algo: HashAlgo = HashAlgo.SHA256SUM, chunk_size: int = CHUNK_SIZE
+    ) -> str:
+        h = Utils.get_hasher(hash_algo)
+
+        # Open the file for reading in binary mode
+        with open(file_path, "rb") as f:
+            # Loop until we finish reading the entire file reading the file a chunk at a time
+            chunk = 0
+            while chunk != b"":
+                chunk = f.read(chunk_size)
+                h.update(chunk)
+        return h.hexdigest()
+
+    @staticmethod
+    def get_hasher(hash_algo: HashAlgo):
+        match hash_algo:
+            case HashAlgo.MD5SUM:
+                return hashlib.md5()
+            case HashAlgo.SHA1SUM:
+                return hashlib.sha1()
+            case HashAlgo.SHA256SUM:
+                return hashlib.sha256()
+            case HashAlgo.SHA512SUM:
+                return hashlib.sha512()
+
     @staticmethod
     def get_github_release_info(
-        url: str, artifact_regex: str, hashes_regex: str, verify: bool = True
+        configs, url: str, artifact_regex: str, hashes_regex: str
     ) -> GitHubReleaseInfo:
         def get_url(pattern: str, asset_json: dict) -> str:
             name = asset_json["name"]
@@ -163,11 +570,16 @@ class Utils(object):
             else:
                 return None
 
-        r = requests.get(url=url, verify=verify)
-        if not r.ok:
-            raise Exception(f"Unable to get github release info json; url={url}, r={r}")
+        if configs.github_release_cache is not None:
+            release_json = configs.github_release_cache.get_release_json(
+                configs.get_http_session(), url
+            )
+        else:
+            r = configs.get_http_session().get(url=url)
+            if not r.ok:
+                raise Exception(f"Unable to get github release info json; url={url}, r={r}")
+            release_json = r.json()
 
-        release_json = r.json()
         artifact_url = None
         hashes_url = None
         for asset in release_json["assets"]:
@@ -180,27 +592,74 @@ class Utils(object):
 
         artifact_filename = artifact_url.split("/")[-1]
         hashes_filename = hashes_url.split("/")[-1]
-        return GitHubReleaseInfo(artifact_url, artifact_filename, hashes_url, hashes_filename)
+        return GitHubReleaseInfo(
+            artifact_url,
+            artifact_filename,
+            hashes_url,
+            hashes_filename,
+            release_json.get("tag_name"),
+        )
 
     @staticmethod
     def download_github_artifact_and_checksum(
         configs,
         github_release_info: GitHubReleaseInfo,
         temp_dir: TemporaryDirectory,
+        hashes_line_token: int = 0,
+        hash_algo: HashAlgo = HashAlgo.SHA256SUM,
     ) -> Tuple[str, str]:
+        """
+        Downloads the hashes file and the artifact of the release, which is verified against its
+        checksum in the hashes file; the hashes_line_token of the line of the hashes file that
+        contains the name of the artifact.
+
+        When the artifact cache is enabled, or when planning, the hashes file is downloaded first so
+        that an artifact that is already cached, or only planned, is not downloaded.  Otherwise both
+        are downloaded concurrently and the artifact is verified once both have completed.
+        """
         artifact_local_path = os.path.join(temp_dir.name, github_release_info.artifact_filename)
         hashes_local_path = os.path.join(temp_dir.name, github_release_info.hashes_filename)
-        Utils.download_file(
-            configs=configs,
-            url=github_release_info.artifact_url,
-            target_local_path=artifact_local_path,
-        )
-        Utils.download_file(
-            configs=configs,
-            url=github_release_info.hashes_url,
-            target_local_path=hashes_local_path,
-        )
 
+        def get_checksum() -> str:
+            Utils.download_file(
+                configs=configs,
+                url=github_release_info.hashes_url,
+                target_local_path=hashes_local_path,
+            )
+            return Utils.get_checksum_from_checksum_file(
+                hashes_local_path,
+                f".*{re.escape(github_release_info.artifact_filename)}.*",
+                hashes_line_token,
+            )
+
+        if configs.artifact_cache is not None or configs.plan is not None:
+            Utils.download_file(
+                configs=configs,
+                url=github_release_info.artifact_url,
+                target_local_path=artifact_local_path,
+                checksum=get_checksum(),
+                hash_algo=hash_algo,
+            )
+            return artifact_local_path, hashes_local_path
+
+        checksum, digests = Utils.map_concurrently(
+            lambda fetch: fetch(),
+            [
+                get_checksum,
+                lambda: Utils.download_file(
+                    configs=configs,
+                    url=github_release_info.artifact_url,
+                    target_local_path=artifact_local_path,
+                    hash_algo=hash_algo,
+                ),
+            ],
+        )
+        if digests[hash_algo] != checksum.lower():
+            os.remove(artifact_local_path)
+            raise Exception(
+                f"Downloaded file checksum mismatch; url={github_release_info.artifact_url}, "
+                f"checksum={checksum}, actual_checksum={digests[hash_algo]}, hash_algo={hash_algo}"
+            )
         return artifact_local_path, hashes_local_path
 
     @staticmethod
@@ -244,13 +703,53 @@ class Utils(object):
             retval = yaml.safe_load(f)
         return retval
 
+    @staticmethod
+    def log_to_stderr() -> None:
+        """
+        Moves the log handlers that write to a stream, stdout as configured by every module, to
+        stderr so that stdout only carries the machine-readable output of the run.
+        """
+        for handler in logging.getLogger().handlers:
+            if type(handler) is logging.StreamHandler:
+                handler.setStream(sys.stderr)
+
+    @staticmethod
+    def map_concurrently(fn, items: list, max_workers: int = FETCH_MAX_WORKERS) -> list:
+        """
+        Calls fn with each of the items on a bounded pool of threads and returns the list of the
+        results in the order of the items.  Raises the exception of the first item, in order, for
+        which fn raised, once all of the calls have completed.
+        """
+        if len(items) <= 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+            futures = [pool.submit(fn, item) for item in items]
+        return [f.result() for f in futures]
+
+    @staticmethod
+    def plan_download(
+        configs,
+        url: str,
+        target_local_path: str,
+        size: int,
+        checksum: str,
+        hash_algo: HashAlgo,
+    ) -> dict[HashAlgo, str]:
+        """
+        Records the download of the file, of the size, to the target_local_path in the plan without
+        downloading it, or writing anything to the target_local_path.  Its expected checksum, if
+        provided, stands in for its digest.
+        """
+        configs.plan.add_download(url, target_local_path, size)
+        return {hash_algo: checksum.lower()} if checksum is not None else {}
+
     @staticmethod
     def requests_retry(
-        url: str, verify: bool, retry_wait_sec: int = 2, retry_max_attempts: int = 5
+        configs, url: str, retry_wait_sec: int = 2, retry_max_attempts: int = 5
     ) -> Response:
         attempts = 0
         while True:
-            r = requests.get(url=url, verify=verify)
+            r = configs.get_http_session().get(url=url)
             if r.status_code >= 200 and r.status_code <= 299:
                 return r
 
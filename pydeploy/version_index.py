@@ -0,0 +1,178 @@
+import codecs
+import json
+import logging
+import os
+import requests
+import sys
+import threading
+import time
+from tempfile import NamedTemporaryFile
+
+logging.basicConfig(
+    format="%(asctime)s,%(levelname)s,%(module)s,%(message)s",
+    level=logging.INFO,
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+class VersionIndex(object):
+    """
+    Persistent index of the download and checksum urls of each version of a tool, built from the
+    version manifest of the tool.  An example is the Gradle versions json, which lists every Gradle
+    release.
+
+    The manifest is a json array of one object per version.  It is stream parsed as it is
+    downloaded, and only the fields of each version that the tasks need are kept in the index.  The
+    index is stored with the validators of the manifest and is not requested again until it is
+    older than max_age_sec.  After that it is revalidated with a conditional request, so an unchanged
+    manifest is not downloaded again.  A version that is not in a fresh index has the index
+    revalidated once, in case the version was released since.
+    """
+
+    CACHE_DIR_DEFAULT = os.path.join(os.path.expanduser("~"), ".pydeploy", "version-indexes")
+    CHUNK_SIZE = 64 * 1024
+    MAX_AGE_SEC_DEFAULT = 24 * 60 * 60
+
+    def __init__(
+        self, cache_dir: str = CACHE_DIR_DEFAULT, max_age_sec: int = MAX_AGE_SEC_DEFAULT
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.max_age_sec = max_age_sec
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Dict of tool name to the index of the tool loaded, or fetched, in this run.
+        self.indexes = {}
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def fetch(self, session: requests.Session, name: str, url: str, index: dict) -> dict:
+        """
+        Fetches the manifest at the url, conditionally on the validators of the index if it is of
+        the same url, and returns the updated index.
+        """
+        headers = {}
+        if index is not None and index["url"] == url:
+            if index.get("etag"):
+                headers["If-None-Match"] = index["etag"]
+            if index.get("last_modified"):
+                headers["If-Modified-Since"] = index["last_modified"]
+
+        with session.get(url, headers=headers, stream=True) as r:
+            if r.status_code == 304 and headers:
+                logger.info(f"Version manifest not modified; name={name}, url={url}")
+                index["fetched_at"] = time.time()
+            else:
+                r.raise_for_status()
+                versions = {
+                    str(entry["version"]): [entry.get("downloadUrl"), entry.get("checksumUrl")]
+                    for entry in VersionIndex.parse_json_array(
+                        r.iter_content(chunk_size=VersionIndex.CHUNK_SIZE)
+                    )
+                    if "version" in entry
+                }
+                logger.info(f"Fetched version manifest; name={name}, versions={len(versions)}")
+                index = dict(
+                    url=url,
+                    etag=r.headers.get("ETag"),
+                    last_modified=r.headers.get("Last-Modified"),
+                    fetched_at=time.time(),
+                    versions=versions,
+                )
+        self.store(name, index)
+        return index
+
+    def get_index_path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def get_lock(self, name: str) -> threading.Lock:
+        with self.locks_lock:
+            if name not in self.locks:
+                self.locks[name] = threading.Lock()
+            return self.locks[name]
+
+    def get_version(
+        self, session: requests.Session, name: str, url: str, version: str
+    ) -> tuple[str, str]:
+        """
+        Returns the tuple of the download url and the checksum url of the version of the tool with
+        the name, from the index of the manifest at the url.  Raises an Exception if the version is
+        not in the manifest.
+        """
+        with self.get_lock(name):
+            index = self.indexes.get(name) or self.load(name)
+            fetched = False
+            if not self.is_fresh(index, url):
+                index = self.fetch(session, name, url, index)
+                fetched = True
+            if version not in index["versions"] and not fetched:
+                logger.info(f"Version not in index, revalidating; name={name}, version={version}")
+                index = self.fetch(session, name, url, index)
+            self.indexes[name] = index
+
+        if version not in index["versions"]:
+            raise Exception(
+                f"Unable to find version in the version manifest; name={name}, url={url}, "
+                f"version={version}"
+            )
+        download_url, checksum_url = index["versions"][version]
+        return download_url, checksum_url
+
+    def is_fresh(self, index: dict, url: str) -> bool:
+        return (
+            index is not None
+            and index["url"] == url
+            and time.time() - index["fetched_at"] < self.max_age_sec
+        )
+
+    def load(self, name: str) -> dict:
+        index_path = self.get_index_path(name)
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def parse_json_array(chunks):
+        """
+        Yields each of the elements of the json array whose utf-8 encoded bytes are the chunks, as
+        soon as it has been received in full, so that the whole array is never held in memory.
+        """
+        decoder = json.JSONDecoder()
+        utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        buffer = ""
+        pos = 0
+        started = False
+        ended = False
+        for chunk in chunks:
+            buffer = buffer[pos:] + utf8_decoder.decode(chunk)
+            pos = 0
+            while not ended:
+                # Skip the whitespace and the separators between the elements.
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,[]":
+                    if buffer[pos] == "[":
+                        started = True
+                    elif buffer[pos] == "]":
+                        ended = True
+                    pos += 1
+                if ended or pos == len(buffer):
+                    break
+                if not started:
+                    raise ValueError(f"Expected a json array; found={buffer[pos:pos + 16]}")
+                try:
+                    element, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # The element has not been received in full yet.
+                    break
+                if end == len(buffer):
+                    # A number may continue in the next chunk.
+                    break
+                pos = end
+                yield element
+        if not ended:
+            raise ValueError("Truncated json array")
+
+    def store(self, name: str, index: dict) -> None:
+        with NamedTemporaryFile("w", dir=self.cache_dir, delete=False) as f:
+            json.dump(index, f)
+        os.replace(f.name, self.get_index_path(name))
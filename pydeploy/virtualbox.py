@@ -1,7 +1,6 @@
 import copy
 import json
 import os
-import requests
 from io import StringIO
 from fabric import Connection
 from invoke import Context, Exit
@@ -31,12 +30,7 @@ class VirtualBox(object):
         ).safe_substitute(version)
         ext_pack_filename = ext_pack_url.split("/")[-1]
         ext_pack_local_file_path = os.path.join(temp_dir.name, ext_pack_filename)
-        Utils.download_file(
-            configs=ctx.distro.configs,
-            url=ext_pack_url,
-            target_local_path=ext_pack_local_file_path,
-        )
-        r = requests.get(ext_pack_shasums_url)
+        r = ctx.distro.configs.get_http_session().get(ext_pack_shasums_url)
         r_text_tokens = r.text.split("\n")
         checksum = None
         for line in r_text_tokens:
@@ -49,17 +43,17 @@ class VirtualBox(object):
                 "Unable to get checksum for virtualbox "
                 f"ext_pack_shasums_url={ext_pack_shasums_url}"
             )
-        if Utils.file_checksum(
-            file_path=ext_pack_local_file_path,
+        Utils.download_file(
+            configs=ctx.distro.configs,
+            url=ext_pack_url,
+            target_local_path=ext_pack_local_file_path,
             checksum=checksum,
             hash_algo=HashAlgo.SHA256SUM,
-        ):
-            return {
-                "filename": ext_pack_filename,
-                "local_file_path": ext_pack_local_file_path,
-            }
-
-        return None
+        )
+        return {
+            "filename": ext_pack_filename,
+            "local_file_path": ext_pack_local_file_path,
+        }
 
     @staticmethod
     def install(ctx: Context, conn: Connection, dependencies: dict) -> None:
@@ -79,21 +73,44 @@ class VirtualBox(object):
         # to do but fall through and install the extension pack defined in the configs.
         if installed_extpacks != {}:
             # Is the version that we want to install already installed?
-            if (
-                task_configs["version"] == installed_extpacks["version"]
-                and task_configs["revision"] == installed_extpacks["revision"]
-                and installed_extpacks["usable"] == True
-            ):
+            if VirtualBox.is_extpack_current(task_configs, installed_extpacks):
                 # We already have the correct version installed . . . nothing else to do
                 return
             r = conn.run('vboxmanage extpack uninstall "Oracle VM VirtualBox Extension Pack"')
 
+        if dependencies.get("install-virtualbox") is None:
+            raise Exit("Extension pack install required but the extension pack was not downloaded")
+
         # Put the extension pack on the remote host and install it
         virtualbox_dependencies = dependencies["install-virtualbox"]
         remote_ext_pack_file_path = os.path.join("/var/tmp/", virtualbox_dependencies["filename"])
         conn.put(virtualbox_dependencies["local_file_path"], remote_ext_pack_file_path)
         r = conn.run(f"yes y | vboxmanage extpack install {remote_ext_pack_file_path}")
 
+    @staticmethod
+    def is_extpack_current(task_configs: dict, installed_extpacks: dict) -> bool:
+        if installed_extpacks == {}:
+            return False
+        return (
+            str(task_configs["version"]) == installed_extpacks["version"]
+            and str(task_configs["revision"]) == installed_extpacks["revision"]
+            and installed_extpacks["usable"] == True
+        )
+
+    @staticmethod
+    def is_extpack_install_required(ctx: Context, conn: Connection, architecture: str) -> bool:
+        """
+        Probes the host to determine whether the configured extension pack needs to be installed so
+        that we can decide whether to download it before touching any of the hosts.
+        """
+        task_configs = ctx.distro.get_task_configs("install-virtualbox")
+        r = conn.run("vboxmanage list extpacks", warn=True)
+        if r.failed:
+            # VirtualBox itself is not yet installed on the host.
+            return True
+        installed_extpacks = VirtualBox.parse_installed_extpacks(r.stdout)
+        return not VirtualBox.is_extpack_current(task_configs, installed_extpacks)
+
     @staticmethod
     def parse_installed_extpacks(cmd_stdout: str) -> dict:
         retval = {}
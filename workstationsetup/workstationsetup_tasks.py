@@ -1,7 +1,9 @@
+import json
 import logging
 import os
 import requests
 import sys
+import time
 from fabric import Connection
 from invoke.exceptions import Exit
 from invoke import Context, task
@@ -9,12 +11,15 @@ from tempfile import TemporaryDirectory
 from pydeploy.certs import Certs
 from pydeploy.docker import Docker
 from pydeploy.developer_tools import DeveloperTools
+from pydeploy.drift import Drift
 from pydeploy.gcp import Gcp
 from pydeploy.git import Git
 from pydeploy.kubernetes import Kubernetes
 from pydeploy.java import Java
 from pydeploy.os import OS
+from pydeploy.program import PyDeployProgram
 from pydeploy.slack import Slack
+from pydeploy.state import StateDb, TaskStatus
 from pydeploy.tasks import Tasks
 from pydeploy.utils import Utils, HashAlgo
 from pydeploy.virtualbox import VirtualBox
@@ -77,6 +82,18 @@ ARG_HELP_CONFIGURE_GIT_USER = (
     "REQUIRED - The user-id for the user which the .gitconfigs are being set"
 )
 ARG_HELP_CONFIGURE_GIT_EDITOR = f"OPTIONAL - The default editor for git to user for commit messages, default={CONFIGURE_GIT_DEFAULT_EDITOR}"
+ARG_HELP_DRIFT_CERT_VALIDATION_STRINGS = (
+    "OPTIONAL - CSV of strings, each of which must be contained in the subject of one of the certs "
+    "in the os ca-cert bundle on each host"
+)
+ARG_HELP_DRIFT_PARALLELISM = (
+    f"OPTIONAL - The number of hosts to scan concurrently, default={Drift.PARALLELISM_DEFAULT}"
+)
+ARG_HELP_DRIFT_REPORT_PATH = (
+    "OPTIONAL - The path to which to write the JSON drift report, default=None, which will print "
+    "the report to stdout, with the logs on stderr"
+)
+
 ARG_HELP_CONFIGURE_GIT_RECONCILE_METHOD = (
     "OPTIONAL - Sets the default reconciliation strategy when pulling for all branches, "
     "default=None, which will not set this git config value. "
@@ -124,25 +141,149 @@ class WorkstationSetup(Tasks):
         """
         Configures git for the given user with the provided user information.
         """
-        for host, conn in ctx.configs.connections.items():
-            Git.configure_git(
-                ctx,
-                conn,
-                user,
-                user_email,
-                user_full_name,
-                editor,
-                default_pull_reconcile_method,
+        inputs = dict(
+            user=user,
+            user_email=user_email,
+            user_full_name=user_full_name,
+            editor=editor,
+            default_pull_reconcile_method=default_pull_reconcile_method,
+        )
+        hosts = WorkstationSetup.get_hosts_to_apply(ctx, "configure-git", inputs)
+        for host, conn in hosts.items():
+            with WorkstationSetup.record(ctx, host, "configure-git", inputs=inputs):
+                Git.configure_git(
+                    ctx,
+                    conn,
+                    user,
+                    user_email,
+                    user_full_name,
+                    editor,
+                    default_pull_reconcile_method,
+                )
+
+    @task(
+        pre=[Tasks.load_configs],
+        help={
+            "cert_validation_strings": ARG_HELP_DRIFT_CERT_VALIDATION_STRINGS,
+            "parallelism": ARG_HELP_DRIFT_PARALLELISM,
+            "report_path": ARG_HELP_DRIFT_REPORT_PATH,
+        },
+    )
+    def drift(
+        ctx, cert_validation_strings=None, parallelism=Drift.PARALLELISM_DEFAULT, report_path=None
+    ):
+        """
+        Read-only scan that reports, as JSON, how each host differs from the configured state.
+        """
+        report = Drift.scan(
+            ctx,
+            parallelism=int(parallelism),
+            cert_validation_strings=(
+                cert_validation_strings.split(",") if cert_validation_strings else None
+            ),
+        )
+        report_str = json.dumps(report, indent=2)
+        if report_path:
+            with open(report_path, "w") as f:
+                f.write(report_str)
+            logger.info(
+                f"Drift report written; report_path={report_path}, summary={report['summary']}"
             )
+        else:
+            print(report_str)
+
+    @staticmethod
+    def get_input_hash(ctx: Context, task: str, inputs: dict = None) -> str:
+        """
+        Returns the hash of the effective inputs of a task, see Distribution.get_task_input_hash.
+        """
+        return ctx.distro.get_task_input_hash(task, inputs)
 
     @staticmethod
     def get_architectures(ctx: Context) -> set[str]:
         # Figure out the set of architectures for all of the hosts configured for this task.
-        retval = set()
-        for _, conn in ctx.configs.connections.items():
-            retval.add(ctx.distro.get_architecture(conn))
+        return set(WorkstationSetup.get_host_architectures(ctx).values())
+
+    @staticmethod
+    def get_host_architectures(ctx: Context, connections: dict = None) -> dict[str, str]:
+        connections = connections if connections is not None else ctx.configs.connections
+        retval = {}
+        for host, conn in connections.items():
+            retval[host] = ctx.distro.host_classes.get_host_facts(conn)["architecture"]
+            ctx.state.save_host_facts(host, {"architecture": retval[host]})
         return retval
 
+    @staticmethod
+    def get_hosts_to_apply(ctx: Context, task: str, inputs: dict = None) -> dict:
+        """
+        Returns the dict of host to connection for only those hosts to which the task needs to be
+        applied: those for which the hash of the task inputs does not match the inputs of the last
+        successful application of the task recorded in the state db.  Every host is returned when
+        running with --force.
+        """
+        input_hash = WorkstationSetup.get_input_hash(ctx, task, inputs)
+        retval = {}
+        for host, conn in ctx.configs.connections.items():
+            if not ctx.configs.force and ctx.state.is_applied(host, task, input_hash):
+                logger.info(
+                    f"Task inputs unchanged since the last success, skipping; host={host}, "
+                    f"task={task}"
+                )
+                ctx.state.save_task_result(
+                    host=host,
+                    task=task,
+                    status=TaskStatus.SKIPPED,
+                    started_at=time.time(),
+                    input_hash=input_hash,
+                )
+                continue
+            retval[host] = conn
+        return retval
+
+    @staticmethod
+    def get_hosts_requiring_install(
+        ctx: Context,
+        host_architectures: dict[str, str],
+        is_install_required,
+        task: str = None,
+        version: str = None,
+        inputs: dict = None,
+    ) -> dict[str, str]:
+        """
+        Concurrently probes each of the hosts with the provided
+        is_install_required(ctx, conn, architecture) function and returns a dict of host to
+        architecture for only those hosts that require the install.  This enables the tasks to
+        download only the artifacts, for the architectures, that are actually needed; a run against
+        hosts that are already up to date downloads nothing.
+
+        If the task is provided, the hosts that are already up to date are recorded as having the
+        task applied with the version and inputs so that they are skipped by the next run.
+        """
+        hosts = list(host_architectures.items())
+        install_required = Utils.map_concurrently(
+            lambda item: is_install_required(ctx, ctx.configs.connections[item[0]], item[1]),
+            hosts,
+        )
+        retval = {}
+        for (host, architecture), required in zip(hosts, install_required):
+            if required:
+                retval[host] = architecture
+                continue
+            logger.info(f"Host is already up to date, skipping install; host={host}")
+            if task is not None:
+                with WorkstationSetup.record(ctx, host, task, version=version, inputs=inputs):
+                    pass
+        return retval
+
+    @staticmethod
+    @Tasks.inputs("install-cert")
+    def get_install_cert_inputs(ctx, cert_path, cert_dir_name, cert_validation_string) -> dict:
+        return dict(
+            cert_sha256sum=Utils.get_file_hash(cert_path),
+            cert_dir_name=cert_dir_name,
+            cert_validation_string=cert_validation_string,
+        )
+
     @task(
         pre=[Tasks.load_configs],
         post=[print_feedback],
@@ -156,14 +297,30 @@ class WorkstationSetup(Tasks):
         """
         Installs an additional ca cert, in PEM format, into the os ca certificates bundle.
         """
-        for host, conn in ctx.configs.connections.items():
-            success = Certs.install_cert(
-                ctx, conn, cert_dir_name, cert_path, cert_validation_string
-            )
-            if success == False:
-                logger.error("Could not validate that cert was installed")
-            else:
-                logger.info(f"Cert successfully installed; cert_path={cert_path}")
+        inputs = WorkstationSetup.get_install_cert_inputs(
+            ctx, cert_path, cert_dir_name, cert_validation_string
+        )
+        hosts = WorkstationSetup.get_hosts_to_apply(ctx, "install-cert", inputs)
+        for host, conn in hosts.items():
+            with WorkstationSetup.record(ctx, host, "install-cert", inputs=inputs):
+                success = Certs.install_cert(
+                    ctx, conn, cert_dir_name, cert_path, cert_validation_string
+                )
+                if success == False:
+                    logger.error("Could not validate that cert was installed")
+                else:
+                    logger.info(f"Cert successfully installed; cert_path={cert_path}")
+
+    @staticmethod
+    @Tasks.inputs("install-cert-into-jvm")
+    def get_install_cert_into_jvm_inputs(
+        ctx, cert_path, cert_alias, jvm_trust_store_password
+    ) -> dict:
+        return dict(
+            cert_sha256sum=Utils.get_file_hash(cert_path),
+            cert_alias=cert_alias,
+            jvm_trust_store_password=jvm_trust_store_password,
+        )
 
     @task(
         pre=[Tasks.load_configs],
@@ -178,18 +335,26 @@ class WorkstationSetup(Tasks):
         """
         Installs the provided CA cert, in pem format, into the jvm for which java-alternatives is currently configured.
         """
+        inputs = WorkstationSetup.get_install_cert_into_jvm_inputs(
+            ctx, cert_path, cert_alias, jvm_trust_store_password
+        )
+        hosts = WorkstationSetup.get_hosts_to_apply(ctx, "install-cert-into-jvm", inputs)
+        if not hosts:
+            return
+
         temp_dir = TemporaryDirectory()
         der_file_name, der_file_path = Utils.convert_pem_cert_to_der(
             cert_path=cert_path, temp_dir=temp_dir
         )
-        for host, conn in ctx.configs.connections.items():
-            Java.install_cert(
-                conn=conn,
-                cert_file_name=der_file_name,
-                local_cert_path=der_file_path,
-                cert_alias=cert_alias,
-                jvm_trust_store_password=jvm_trust_store_password,
-            )
+        for host, conn in hosts.items():
+            with WorkstationSetup.record(ctx, host, "install-cert-into-jvm", inputs=inputs):
+                Java.install_cert(
+                    conn=conn,
+                    cert_file_name=der_file_name,
+                    local_cert_path=der_file_path,
+                    cert_alias=cert_alias,
+                    jvm_trust_store_password=jvm_trust_store_password,
+                )
         temp_dir.cleanup()
 
     @task(
@@ -200,11 +365,39 @@ class WorkstationSetup(Tasks):
         """
         Installs the Google Chrome browser.
         """
-        for host, conn in ctx.configs.connections.items():
-            ctx.distro.add_repo(configs=ctx.configs, conn=conn, task="install-chrome")
-            task_configs = ctx.distro.get_task_configs("install-chrome")
-            packages = task_configs["package"]
-            ctx.distro.install_package(conn=conn, packages=packages)
+        for host, conn in WorkstationSetup.get_hosts_to_apply(ctx, "install-chrome").items():
+            with WorkstationSetup.record(ctx, host, "install-chrome"):
+                ctx.distro.add_repo(configs=ctx.configs, conn=conn, task="install-chrome")
+                task_configs = ctx.distro.get_task_configs("install-chrome")
+                packages = task_configs["package"]
+                ctx.distro.install_package(
+                    conn=conn,
+                    packages=packages,
+                    unsafe_io=task_configs.get("unsafe_package_io", False),
+                )
+
+    @staticmethod
+    @Tasks.inputs("install-docker")
+    def get_install_docker_inputs(
+        ctx,
+        docker_user,
+        docker_bip,
+        docker_fixed_cidr,
+        docker_default_addr_pools_base,
+        docker_default_addr_pools_size,
+        docker_insecure_registries,
+    ) -> dict:
+        # The docker-compose release is part of the inputs so that a new release is picked up by
+        # hosts that are otherwise up to date.
+        return dict(
+            docker_user=docker_user,
+            docker_bip=docker_bip,
+            docker_fixed_cidr=docker_fixed_cidr,
+            docker_default_addr_pools_base=docker_default_addr_pools_base,
+            docker_default_addr_pools_size=docker_default_addr_pools_size,
+            docker_insecure_registries=docker_insecure_registries,
+            compose_release=Docker.get_compose_release_tag(ctx),
+        )
 
     @task(
         pre=[Tasks.load_configs],
@@ -230,24 +423,62 @@ class WorkstationSetup(Tasks):
         """
         Installs docker and docker-compose, and adds the provided user to the docker group.
         """
+        inputs = WorkstationSetup.get_install_docker_inputs(
+            ctx,
+            docker_user,
+            docker_bip,
+            docker_fixed_cidr,
+            docker_default_addr_pools_base,
+            docker_default_addr_pools_size,
+            docker_insecure_registries,
+        )
+        hosts = WorkstationSetup.get_hosts_to_apply(ctx, "install-docker", inputs)
+        if not hosts:
+            return
+
+        host_architectures = WorkstationSetup.get_host_architectures(ctx, hosts)
+        expected_checksums = Docker.get_compose_checksums(ctx, set(host_architectures.values()))
+        compose_hosts = WorkstationSetup.get_hosts_requiring_install(
+            ctx,
+            host_architectures,
+            lambda ctx, conn, architecture: Docker.is_compose_install_required(
+                ctx, conn, architecture, expected_checksums
+            ),
+        )
+
         temp_dir = TemporaryDirectory()
         dependencies = {}
         dependencies["install-docker"] = Docker.get_dependencies(
-            ctx=ctx, temp_dir=temp_dir, architectures=WorkstationSetup.get_architectures(ctx)
+            ctx=ctx, temp_dir=temp_dir, architectures=set(compose_hosts.values())
         )
 
-        for host, conn in ctx.configs.connections.items():
-            Docker.install(
-                ctx,
-                conn,
-                dependencies,
-                docker_user,
-                docker_bip,
-                docker_fixed_cidr,
-                docker_default_addr_pools_base,
-                docker_default_addr_pools_size,
-                docker_insecure_registries,
-            )
+        for host, conn in hosts.items():
+            with WorkstationSetup.record(ctx, host, "install-docker", inputs=inputs):
+                Docker.install(
+                    ctx,
+                    conn,
+                    dependencies,
+                    docker_user,
+                    docker_bip,
+                    docker_fixed_cidr,
+                    docker_default_addr_pools_base,
+                    docker_default_addr_pools_size,
+                    docker_insecure_registries,
+                    install_compose=(host in compose_hosts),
+                )
+        temp_dir.cleanup()
+
+    @staticmethod
+    @Tasks.inputs("install-drawio")
+    def get_install_drawio_inputs(ctx) -> dict:
+        task_configs = ctx.distro.get_task_configs("install-drawio")
+        github_release_info = Utils.get_github_release_info(
+            configs=ctx.configs,
+            url=task_configs["github_release_url"],
+            artifact_regex=task_configs["artifact_regex"],
+            hashes_regex=task_configs["hashes_regex"],
+        )
+        return dict(artifact_url=github_release_info.artifact_url)
 
     @task(
         pre=[Tasks.load_configs],
@@ -257,6 +488,11 @@ class WorkstationSetup(Tasks):
         """
         Installs the Drawio desktop application.
         """
+        inputs = WorkstationSetup.get_install_drawio_inputs(ctx)
+        hosts = WorkstationSetup.get_hosts_to_apply(ctx, "install-drawio", inputs)
+        if not hosts:
+            return
+
         temp_dir = TemporaryDirectory()
         # The dependencies dict is designed to contain a key for each installation task.
         # The value for each is a dict that contains specific dependencies, or paths to
@@ -267,8 +503,9 @@ class WorkstationSetup(Tasks):
         dependencies["install-drawio"] = DeveloperTools.install_drawio_get_dependencies(
             ctx, temp_dir
         )
-        for host, conn in ctx.configs.connections.items():
-            DeveloperTools.install_drawio(ctx=ctx, conn=conn, dependencies=dependencies)
+        for host, conn in hosts.items():
+            with WorkstationSetup.record(ctx, host, "install-drawio", inputs=inputs):
+                DeveloperTools.install_drawio(ctx=ctx, conn=conn, dependencies=dependencies)
         temp_dir.cleanup()
 
     @task(
@@ -279,8 +516,11 @@ class WorkstationSetup(Tasks):
         """
         Installs the google-cloud-cli program suite.
         """
-        for _, conn in ctx.configs.connections.items():
-            Gcp.install_google_cloud_cli(ctx=ctx, conn=conn)
+        for host, conn in WorkstationSetup.get_hosts_to_apply(
+            ctx, "install-google-cloud-cli"
+        ).items():
+            with WorkstationSetup.record(ctx, host, "install-google-cloud-cli"):
+                Gcp.install_google_cloud_cli(ctx=ctx, conn=conn)
 
     @task(
         pre=[Tasks.load_configs],
@@ -291,14 +531,36 @@ class WorkstationSetup(Tasks):
         """
         Install the gradle build tool.
         """
-        temp_dir = TemporaryDirectory()
-        dependencies = {}
-        dependencies["install-gradle"] = Java.install_gradle_get_dependencies(
-            ctx, temp_dir, version
+        inputs = dict(version=version)
+        hosts = WorkstationSetup.get_hosts_requiring_install(
+            ctx,
+            WorkstationSetup.get_host_architectures(
+                ctx, WorkstationSetup.get_hosts_to_apply(ctx, "install-gradle", inputs)
+            ),
+            lambda ctx, conn, architecture: Java.is_gradle_install_required(
+                ctx, conn, architecture, version
+            ),
+            task="install-gradle",
+            version=version,
+            inputs=inputs,
         )
-        for _, conn in ctx.configs.connections.items():
-            Java.install_gradle(ctx=ctx, conn=conn, dependencies=dependencies, version=version)
-        temp_dir.cleanup()
+        if hosts:
+            temp_dir = TemporaryDirectory()
+            dependencies = {}
+            dependencies["install-gradle"] = Java.install_gradle_get_dependencies(
+                ctx, temp_dir, version
+            )
+            for host in hosts:
+                with WorkstationSetup.record(
+                    ctx, host, "install-gradle", version=version, inputs=inputs
+                ):
+                    Java.install_gradle(
+                        ctx=ctx,
+                        conn=ctx.configs.connections[host],
+                        dependencies=dependencies,
+                        version=version,
+                    )
+            temp_dir.cleanup()
         FEEDBACK["install-gradle"] = Java.GRADLE_FEEDBACK
 
     @task(
@@ -309,14 +571,26 @@ class WorkstationSetup(Tasks):
         """
         Install the helm client.
         """
+        hosts = WorkstationSetup.get_hosts_requiring_install(
+            ctx,
+            WorkstationSetup.get_host_architectures(
+                ctx, WorkstationSetup.get_hosts_to_apply(ctx, "install-helm")
+            ),
+            Kubernetes.is_helm_install_required,
+            task="install-helm",
+        )
+        if not hosts:
+            return
+
         temp_dir = TemporaryDirectory()
         dependencies = {}
         dependencies["install-helm"] = Kubernetes.get_helm_dependencies(
-            ctx=ctx, temp_dir=temp_dir, architectures=WorkstationSetup.get_architectures(ctx)
+            ctx=ctx, temp_dir=temp_dir, architectures=set(hosts.values())
         )
 
-        for host, conn in ctx.configs.connections.items():
-            Kubernetes.install_helm(ctx, conn, dependencies)
+        for host in hosts:
+            with WorkstationSetup.record(ctx, host, "install-helm"):
+                Kubernetes.install_helm(ctx, ctx.configs.connections[host], dependencies)
         temp_dir.cleanup()
 
     @task(
@@ -328,13 +602,34 @@ class WorkstationSetup(Tasks):
         """
         Install the IntelliJ community addition IDE.
         """
+        inputs = dict(version=version)
+        hosts = WorkstationSetup.get_hosts_requiring_install(
+            ctx,
+            WorkstationSetup.get_host_architectures(
+                ctx, WorkstationSetup.get_hosts_to_apply(ctx, "install-intellij", inputs)
+            ),
+            lambda ctx, conn, architecture: Java.is_intellij_install_required(
+                ctx, conn, architecture, version
+            ),
+            task="install-intellij",
+            version=version,
+            inputs=inputs,
+        )
+        if not hosts:
+            return
+
         temp_dir = TemporaryDirectory()
         dependencies = {}
         dependencies["install-intellij"] = Java.install_intellij_get_dependencies(
-            ctx=ctx, temp_dir=temp_dir, architectures=WorkstationSetup.get_architectures(ctx)
+            ctx=ctx, temp_dir=temp_dir, architectures=set(hosts.values()), version=version
         )
-        for _, conn in ctx.configs.connections.items():
-            Java.install_intellij(ctx=ctx, conn=conn, dependencies=dependencies)
+        for host in hosts:
+            with WorkstationSetup.record(
+                ctx, host, "install-intellij", version=version, inputs=inputs
+            ):
+                Java.install_intellij(
+                    ctx=ctx, conn=ctx.configs.connections[host], dependencies=dependencies
+                )
         temp_dir.cleanup()
 
     @task(
@@ -346,8 +641,15 @@ class WorkstationSetup(Tasks):
         """
         Installs the Adoptium OpenJDK package.
         """
-        for _, conn in ctx.configs.connections.items():
-            Java._install_java_adoptium_eclipse_temurin(ctx=ctx, conn=conn, version=version)
+        inputs = dict(version=version)
+        hosts = WorkstationSetup.get_hosts_to_apply(
+            ctx, "install-java-adoptium-eclipse-temurin", inputs
+        )
+        for host, conn in hosts.items():
+            with WorkstationSetup.record(
+                ctx, host, "install-java-adoptium-eclipse-temurin", version=version, inputs=inputs
+            ):
+                Java._install_java_adoptium_eclipse_temurin(ctx=ctx, conn=conn, version=version)
         FEEDBACK["install-java-adoptium-eclipse-temurin"] = Java.JAVA_FEEDBACK
 
     @task(
@@ -359,8 +661,13 @@ class WorkstationSetup(Tasks):
         """
         Installs Oracle's free, GPL-licensed, production-ready OpenJDK package.
         """
-        for _, conn in ctx.configs.connections.items():
-            Java._install_java_openjdk(ctx=ctx, conn=conn, version=version)
+        inputs = dict(version=version)
+        hosts = WorkstationSetup.get_hosts_to_apply(ctx, "install-java-openjdk", inputs)
+        for host, conn in hosts.items():
+            with WorkstationSetup.record(
+                ctx, host, "install-java-openjdk", version=version, inputs=inputs
+            ):
+                Java._install_java_openjdk(ctx=ctx, conn=conn, version=version)
         FEEDBACK["install-java-openjdk"] = Java.JAVA_FEEDBACK
 
     @task(
@@ -372,12 +679,36 @@ class WorkstationSetup(Tasks):
         """
         Installs the Apache Maven build tool.
         """
-        temp_dir = TemporaryDirectory()
-        dependencies = {}
-        dependencies["install-maven"] = Java.install_maven_get_dependencies(ctx, temp_dir, version)
-        for _, conn in ctx.configs.connections.items():
-            Java.install_maven(ctx=ctx, conn=conn, dependencies=dependencies, version=version)
-        temp_dir.cleanup()
+        inputs = dict(version=version)
+        hosts = WorkstationSetup.get_hosts_requiring_install(
+            ctx,
+            WorkstationSetup.get_host_architectures(
+                ctx, WorkstationSetup.get_hosts_to_apply(ctx, "install-maven", inputs)
+            ),
+            lambda ctx, conn, architecture: Java.is_maven_install_required(
+                ctx, conn, architecture, version
+            ),
+            task="install-maven",
+            version=version,
+            inputs=inputs,
+        )
+        if hosts:
+            temp_dir = TemporaryDirectory()
+            dependencies = {}
+            dependencies["install-maven"] = Java.install_maven_get_dependencies(
+                ctx, temp_dir, version
+            )
+            for host in hosts:
+                with WorkstationSetup.record(
+                    ctx, host, "install-maven", version=version, inputs=inputs
+                ):
+                    Java.install_maven(
+                        ctx=ctx,
+                        conn=ctx.configs.connections[host],
+                        dependencies=dependencies,
+                        version=version,
+                    )
+            temp_dir.cleanup()
         FEEDBACK["install-maven"] = Java.MAVEN_FEEDBACK
 
     @task(
@@ -391,18 +722,24 @@ class WorkstationSetup(Tasks):
         """
         Installs Minikube; a lightweight Kubernetes implementation that creates a K8s cluster on a VM on your local machine.
         """
+        inputs = dict(minikube_user=minikube_user)
+        hosts = WorkstationSetup.get_hosts_to_apply(ctx, "install-minikube", inputs)
+        if not hosts:
+            return
+
         # Get dependencies for each of the different architectures for the set of hosts onto which
         # we will install minikube.
         architectures = set()
-        for _, conn in ctx.configs.connections.items():
-            architectures.add(ctx.distro.get_architecture(conn))
+        for _, conn in hosts.items():
+            architectures.add(ctx.distro.host_classes.get_host_facts(conn)["architecture"])
         temp_dir = TemporaryDirectory()
         dependencies = {}
         dependencies["install-minikube"] = DeveloperTools.install_minikube_get_dependencies(
             ctx=ctx, architectures=architectures, temp_dir=temp_dir
         )
-        for _, conn in ctx.configs.connections.items():
-            DeveloperTools.install_minikube(ctx=ctx, conn=conn, dependencies=dependencies)
+        for host, conn in hosts.items():
+            with WorkstationSetup.record(ctx, host, "install-minikube", inputs=inputs):
+                DeveloperTools.install_minikube(ctx=ctx, conn=conn, dependencies=dependencies)
         temp_dir.cleanup()
 
     @task(
@@ -413,10 +750,16 @@ class WorkstationSetup(Tasks):
         """
         Installs the base set of packages.
         """
-        for host, conn in ctx.configs.connections.items():
-            cfgs = ctx.distro.get_task_configs("install-packages")
-            packages = cfgs["packages"]
-            ctx.distro.install_package(conn=conn, packages=packages)
+        for host, conn in WorkstationSetup.get_hosts_to_apply(ctx, "install-packages").items():
+            with WorkstationSetup.record(ctx, host, "install-packages"):
+                cfgs = ctx.distro.get_task_configs("install-packages")
+                packages = cfgs["packages"]
+                ctx.distro.install_package(
+                    conn=conn,
+                    packages=packages,
+                    versions=cfgs.get("package_versions"),
+                    unsafe_io=cfgs.get("unsafe_package_io", False),
+                )
 
     @task(
         pre=[Tasks.load_configs],
@@ -426,11 +769,29 @@ class WorkstationSetup(Tasks):
         """
         Installs PostgreSQL pgAdmin
         """
-        for host, conn in ctx.configs.connections.items():
-            ctx.distro.add_repo(configs=ctx.configs, conn=conn, task="install-pgadmin")
-            task_cfgs = ctx.distro.get_task_configs("install-pgadmin")
-            packages = task_cfgs["packages"]
-            ctx.distro.install_package(conn=conn, packages=packages)
+        for host, conn in WorkstationSetup.get_hosts_to_apply(ctx, "install-pgadmin").items():
+            with WorkstationSetup.record(ctx, host, "install-pgadmin"):
+                ctx.distro.add_repo(configs=ctx.configs, conn=conn, task="install-pgadmin")
+                task_cfgs = ctx.distro.get_task_configs("install-pgadmin")
+                packages = task_cfgs["packages"]
+                ctx.distro.install_package(
+                    conn=conn,
+                    packages=packages,
+                    unsafe_io=task_cfgs.get("unsafe_package_io", False),
+                )
+
+    @staticmethod
+    @Tasks.inputs("install-redshift")
+    def get_install_redshift_inputs(
+        ctx, redshift_user, temp_day, temp_night, brightness_day, brightness_night
+    ) -> dict:
+        return dict(
+            redshift_user=redshift_user,
+            temp_day=temp_day,
+            temp_night=temp_night,
+            brightness_day=None if brightness_day is None else float(brightness_day),
+            brightness_night=None if brightness_night is None else float(brightness_night),
+        )
 
     @task(
         pre=[Tasks.load_configs],
@@ -454,8 +815,15 @@ class WorkstationSetup(Tasks):
         """
         Installs redshift, the configs, and the user-level systemd configurations
         """
-        brightness_day = None if brightness_day is None else float(brightness_day)
-        brightness_night = None if brightness_night is None else float(brightness_night)
+        inputs = WorkstationSetup.get_install_redshift_inputs(
+            ctx, redshift_user, temp_day, temp_night, brightness_day, brightness_night
+        )
+        brightness_day = inputs["brightness_day"]
+        brightness_night = inputs["brightness_night"]
+        hosts = WorkstationSetup.get_hosts_to_apply(ctx, "install-redshift", inputs)
+        if not hosts:
+            return
+
         temp_dir = TemporaryDirectory()
         dependencies = {}
         dependencies["install-redshift"] = DeveloperTools.install_redshift_get_dependencies(
@@ -467,17 +835,18 @@ class WorkstationSetup(Tasks):
             brightness_night=brightness_night,
         )
 
-        for host, conn in ctx.configs.connections.items():
-            DeveloperTools.install_redshift(
-                ctx=ctx,
-                conn=conn,
-                redshift_user=redshift_user,
-                dependencies=dependencies,
-                temp_day=temp_day,
-                temp_night=temp_night,
-                brightness_day=brightness_day,
-                brightness_night=brightness_night,
-            )
+        for host, conn in hosts.items():
+            with WorkstationSetup.record(ctx, host, "install-redshift", inputs=inputs):
+                DeveloperTools.install_redshift(
+                    ctx=ctx,
+                    conn=conn,
+                    redshift_user=redshift_user,
+                    dependencies=dependencies,
+                    temp_day=temp_day,
+                    temp_night=temp_night,
+                    brightness_day=brightness_day,
+                    brightness_night=brightness_night,
+                )
         temp_dir.cleanup()
         FEEDBACK["install-redshift"] = DeveloperTools.REDSHIFT_FEEDBACK
 
@@ -489,10 +858,15 @@ class WorkstationSetup(Tasks):
         """
         Installs the Slack client.
         """
+        hosts = WorkstationSetup.get_hosts_to_apply(ctx, "install-slack")
+        if not hosts:
+            return
+
         temp_dir = TemporaryDirectory()
         dependencies = {"install-slack": Slack.get_dependencies(ctx, temp_dir)}
-        for host, conn in ctx.configs.connections.items():
-            Slack.install(ctx, conn, temp_dir, dependencies)
+        for host, conn in hosts.items():
+            with WorkstationSetup.record(ctx, host, "install-slack"):
+                Slack.install(ctx, conn, temp_dir, dependencies)
         temp_dir.cleanup()
 
     @task(
@@ -503,10 +877,21 @@ class WorkstationSetup(Tasks):
         """
         Installs Oracle VirtualBox
         """
+        hosts_to_apply = WorkstationSetup.get_hosts_to_apply(ctx, "install-virtualbox")
+
+        # Only download the extension pack if at least one of the hosts requires it.
+        hosts = WorkstationSetup.get_hosts_requiring_install(
+            ctx,
+            WorkstationSetup.get_host_architectures(ctx, hosts_to_apply),
+            VirtualBox.is_extpack_install_required,
+        )
         temp_dir = TemporaryDirectory()
-        dependencies = {"install-virtualbox": VirtualBox.get_dependencies(ctx, temp_dir)}
-        for host, conn in ctx.configs.connections.items():
-            VirtualBox.install(ctx, conn, dependencies)
+        dependencies = {"install-virtualbox": None}
+        if hosts:
+            dependencies["install-virtualbox"] = VirtualBox.get_dependencies(ctx, temp_dir)
+        for host, conn in hosts_to_apply.items():
+            with WorkstationSetup.record(ctx, host, "install-virtualbox"):
+                VirtualBox.install(ctx, conn, dependencies)
         temp_dir.cleanup()
 
     @task(
@@ -517,11 +902,16 @@ class WorkstationSetup(Tasks):
         """
         Installs the Visual Studio Code IDE.
         """
-        for _, conn in ctx.configs.connections.items():
-            ctx.distro.add_repo(configs=ctx.configs, conn=conn, task="install-vscode")
-            task_configs = ctx.distro.get_task_configs("install-vscode")
-            packages = task_configs["package"]
-            ctx.distro.install_package(conn=conn, packages=packages)
+        for host, conn in WorkstationSetup.get_hosts_to_apply(ctx, "install-vscode").items():
+            with WorkstationSetup.record(ctx, host, "install-vscode"):
+                ctx.distro.add_repo(configs=ctx.configs, conn=conn, task="install-vscode")
+                task_configs = ctx.distro.get_task_configs("install-vscode")
+                packages = task_configs["package"]
+                ctx.distro.install_package(
+                    conn=conn,
+                    packages=packages,
+                    unsafe_io=task_configs.get("unsafe_package_io", False),
+                )
 
     @task(
         pre=[Tasks.load_configs],
@@ -531,12 +921,60 @@ class WorkstationSetup(Tasks):
         """
         Installs the Zoom client.
         """
+        hosts = WorkstationSetup.get_hosts_to_apply(ctx, "install-zoom")
+        if not hosts:
+            return
+
         temp_dir = TemporaryDirectory()
         dependencies = {"install-zoom": Zoom.get_dependencies(ctx, temp_dir)}
-        for host, conn in ctx.configs.connections.items():
-            Zoom.install(ctx, conn, temp_dir, dependencies)
+        for host, conn in hosts.items():
+            with WorkstationSetup.record(ctx, host, "install-zoom"):
+                Zoom.install(ctx, conn, temp_dir, dependencies)
         temp_dir.cleanup()
 
+    @task(
+        help={
+            "tool": "OPTIONAL - The task name of the tool to query, example: install-maven",
+            "version": "OPTIONAL - Used with --tool; list the hosts with this version installed",
+            "failed_task": "OPTIONAL - List the hosts on which this task has failed",
+            "since_days": "OPTIONAL - Used with --failed-task; number of days to look back, default=7",
+        },
+    )
+    def query_state(ctx, tool=None, version=None, failed_task=None, since_days=7):
+        """
+        Queries the state db for hosts by tool version or failed task without contacting any hosts.
+        """
+        state_db_path = Tasks.get_config_value(
+            Tasks.PROGRAM.core, PyDeployProgram.ARG_STATE_DB_PATH
+        )
+        state = StateDb(db_path=state_db_path)
+        result = {}
+        if tool is not None and version is not None:
+            result["hosts_with_tool_version"] = state.get_hosts_with_tool_version(tool, version)
+        if failed_task is not None:
+            since_sec = time.time() - (float(since_days) * 86400)
+            result["hosts_with_failed_task"] = state.get_failed_hosts(failed_task, since_sec)
+        print(json.dumps(result, indent=2))
+
+    @staticmethod
+    def record(ctx: Context, host: str, task: str, version: str = None, inputs: dict = None):
+        """
+        Returns a context manager that persists the result, timing, version, the hashes of the
+        applied task configs and of the task inputs, and the task inputs, of the wrapped operations
+        for the host in the state db.  If not provided, the version defaults to the one defined in the task configs.
+        """
+        task_configs = ctx.configs.configs.get(task)
+        if version is None and type(task_configs) is dict:
+            version = task_configs.get("version")
+        return ctx.state.record(
+            host,
+            task,
+            version=version,
+            task_configs=task_configs,
+            input_hash=WorkstationSetup.get_input_hash(ctx, task, inputs),
+            inputs=inputs,
+        )
+
     @task(
         pre=[Tasks.load_configs],
         post=[print_feedback],
@@ -546,5 +984,7 @@ class WorkstationSetup(Tasks):
         """
         Increase the maximum user file watches for inotify.
         """
-        for _, conn in ctx.configs.connections.items():
-            OS.setup_inotify(conn, max_user_watches)
+        inputs = dict(max_user_watches=max_user_watches)
+        for host, conn in WorkstationSetup.get_hosts_to_apply(ctx, "setup-inotify", inputs).items():
+            with WorkstationSetup.record(ctx, host, "setup-inotify", inputs=inputs):
+                OS.setup_inotify(conn, max_user_watches)